@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Library of master dark frames.
+
+A master dark (mean counts per DIT and std on the mean, for the full frame and the ROIs) only depends on
+the integration time, the camera window, the ROI layout and the detector temperature. Master darks are
+kept in memory and on disk (one .npz file per key under dark_directory), so that calibrations reuse a
+recent dark instead of closing the shutters and taking a new dark sequence. Darks older than max_age
+(seconds) are not reused. Temperatures are compared by band: a dark is reused while the detector stays
+within the same band of dark_temperature_band K.
+
+"""
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from nottcontrol import config as nott_config
+from nottcontrol.camera.infratec.roi import Roi
+from nottcontrol.camera.frame import Frame, MasterAccumulator, frame_directory
+
+# Defaults from config.ini
+dark_directory = nott_config['CAMERA'].get('dark_directory', '') or str(Path(frame_directory).joinpath("darks"))
+dark_max_age = nott_config['CAMERA'].getfloat('dark_max_age', fallback=3600.)
+dark_temperature_key = nott_config['CAMERA'].get('dark_temperature_key', '') or None
+dark_temperature_band = nott_config['CAMERA'].getfloat('dark_temperature_band', fallback=0.5)
+
+
+def dark_key(integtime, window, rois, temperature=None, band=dark_temperature_band):
+    # Key of a master dark : integration time (microseconds, rounded), window, ROI layout and temperature band (None if unknown)
+    layout = tuple((round(float(roi.x),1),round(float(roi.y),1),round(float(roi.w),1),round(float(roi.h),1),int(roi.idx)) for roi in rois)
+    temperature_band = None if temperature is None or not band else int(np.floor(temperature/band))
+    return (int(round(integtime)),(int(window["x"]),int(window["y"]),int(window["w"]),int(window["h"])),layout,temperature_band)
+
+
+class MasterDark(object):
+    """
+        Master frames and std maps of a dark sequence. Can be passed as "dark" wherever a dark Frame is
+    (Frame.calib, calib_master, calib_seq, HumInt.get_frames_cal ...), without recomputing them on every call.
+    """
+
+    def __init__(self,master_full,master_rois,integtime,window,rois,temperature=None,count=0,created=None):
+        """
+        Parameters
+        ----------
+        master_full : (mean, std on the mean) of the full frames, as Frame.master_full
+        master_rois : (mean, std on the mean) within the ROIs, as Frame.master_rois
+        integtime : float, mean integration time (microseconds)
+        window : dictionary, camera window as in Frame
+        rois : list of ROI objects, as in Frame
+        temperature : float, detector temperature (K) during the dark sequence, if known
+        count : int, amount of dark frames
+        created : float, unix time (s) of the dark sequence (default: now)
+        """
+        self.master_full = master_full
+        self.master_rois = master_rois
+        self.meandit = integtime
+        self.window = window
+        self.rois = rois
+        self.temperature = temperature
+        self.count = count
+        self.created = time.time() if created is None else created
+
+    @classmethod
+    def from_frames(cls,frames,temperature=None):
+        # Master dark of a dark Frame or MasterAccumulator
+        count = frames.count if isinstance(frames,MasterAccumulator) else frames.rois_data.shape[1]
+        return cls(frames.master_full,frames.master_rois,float(frames.meandit),dict(frames.window),list(frames.rois),temperature,count)
+
+    @property
+    def age(self):
+        # Seconds since the dark sequence
+        return time.time()-self.created
+
+    def key(self,band=dark_temperature_band):
+        return dark_key(self.meandit,self.window,self.rois,self.temperature,band)
+
+    def save(self,path):
+        meta = {"integtime": self.meandit, "window": self.window, "temperature": self.temperature, "count": self.count,
+                "created": self.created, "rois": [[float(roi.x),float(roi.y),float(roi.w),float(roi.h),int(roi.idx)] for roi in self.rois]}
+        with open(path,"wb") as f:
+            np.savez(f,full_mean=self.master_full[0],full_std=self.master_full[1],
+                     rois_mean=self.master_rois[0],rois_std=self.master_rois[1],meta=json.dumps(meta))
+
+    @classmethod
+    def load(cls,path):
+        with np.load(path) as f:
+            meta = json.loads(str(f["meta"]))
+            rois = [Roi(x,y,w,h,int(idx)) for x,y,w,h,idx in meta["rois"]]
+            return cls((f["full_mean"],f["full_std"]),(f["rois_mean"],f["rois_std"]),meta["integtime"],meta["window"],
+                       rois,meta["temperature"],meta["count"],meta["created"])
+
+
+class DarkLibrary(object):
+    """
+        Master darks by integration time, camera window, ROI layout and temperature band, in memory and on disk.
+    """
+
+    def __init__(self,directory=dark_directory,max_age=dark_max_age,temperature_band=dark_temperature_band):
+        """
+        Parameters
+        ----------
+        directory : string, directory of the stored master darks (None: memory only)
+        max_age : float, age (s) beyond which a master dark is not reused
+        temperature_band : float, width (K) of the temperature bands (0: temperature is ignored)
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.temperature_band = temperature_band
+        self._darks = {}
+        self._lock = threading.Lock()
+
+    def key(self,integtime,window=None,rois=None,temperature=None):
+        if window is None:
+            window = Frame.window_cfg
+        if rois is None:
+            rois = Frame.rois_cfg
+        return dark_key(integtime,window,rois,temperature,self.temperature_band)
+
+    def _path(self,key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return Path(self.directory).joinpath(f"dark_{key[0]}us_{digest}.npz")
+
+    def get(self,integtime,window=None,rois=None,temperature=None,max_age=None):
+        """
+            Master dark matching the given conditions (window and ROIs default to config.ini), or None if there is none
+        younger than max_age (s, default: that of the library).
+        """
+        if max_age is None:
+            max_age = self.max_age
+        key = self.key(integtime,window,rois,temperature)
+        with self._lock:
+            dark = self._darks.get(key)
+        if dark is None and self.directory is not None:
+            path = self._path(key)
+            if path.is_file():
+                try:
+                    dark = MasterDark.load(path)
+                except (OSError,ValueError,KeyError) as e:
+                    print(f"Dark library: failed to load {path} ({e}).")
+                    dark = None
+                # The file name is a digest of the key, checking the key itself
+                if dark is not None and dark.key(self.temperature_band) != key:
+                    dark = None
+            if dark is not None:
+                with self._lock:
+                    self._darks[key] = dark
+        if dark is None or dark.age > max_age:
+            return None
+        return dark
+
+    def store(self,frames,temperature=None):
+        """
+            Adds the master dark of a dark Frame, MasterAccumulator or MasterDark, replacing any with the same key.
+        temperature : detector temperature (K) during the dark sequence
+        Returns the MasterDark.
+        """
+        if isinstance(frames,MasterDark):
+            dark = frames
+        else:
+            dark = MasterDark.from_frames(frames,temperature)
+        key = dark.key(self.temperature_band)
+        with self._lock:
+            self._darks[key] = dark
+        if self.directory is not None:
+            path = self._path(key)
+            path.parent.mkdir(parents=True,exist_ok=True)
+            dark.save(path)
+        return dark
+
+    def purge(self,max_age=None):
+        # Removes master darks older than max_age (s, default: that of the library) from memory and disk. Returns the amount removed.
+        if max_age is None:
+            max_age = self.max_age
+        with self._lock:
+            expired = [key for key,dark in self._darks.items() if dark.age > max_age]
+            for key in expired:
+                del self._darks[key]
+        removed = set(expired)
+        if self.directory is not None and Path(self.directory).is_dir():
+            for path in Path(self.directory).glob("dark_*.npz"):
+                try:
+                    dark = MasterDark.load(path)
+                except (OSError,ValueError,KeyError):
+                    continue
+                if dark.age > max_age:
+                    removed.add(dark.key(self.temperature_band))
+                    path.unlink()
+        return len(removed)
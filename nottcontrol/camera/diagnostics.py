@@ -81,7 +81,8 @@ class Diagnostics(object):
         dt = 5.
         self.human_interf.shutter_set([1,1,1,1],wait=True)
         sci_frames = self.human_interf.science_frame_sequence(dt)
-        dark_frames = self.human_interf.dark_frame_sequence(dt)
+        # Master dark from the dark library, only taken (shutters closed) if none is recent enough
+        dark_frames = self.human_interf.dark_master(dt)
         self.Nroi = len(sci_frames.rois_data)
         self.dark_frames = dark_frames
         # Full frame
@@ -131,13 +132,14 @@ class Diagnostics(object):
         cal_mean_snr = np.divide(cal_mean,cal_mean_std)
         cal_mean_std = cal_mean_std*self.outputs_pos
         
-        cal_seq = cal_seq*self.outputs_pos[:, np.newaxis, :, :]
-        cal_seq_snr = np.divide(cal_seq,cal_seq_std[:, np.newaxis, :, :])
+        # Masking in place, the calibrated sequence is a fresh (float32) array
+        cal_seq *= self.outputs_pos[:, np.newaxis, :, :]
         cal_seq_std = cal_seq_std*self.outputs_pos
         
         # Time series of broadband flux: sum output pixels' signal in each frame
         fluxes_broad = cal_seq.sum(axis=(2,3))
-        snrs_broad = cal_seq_snr.sum(axis=(2,3)) 
+        # Sum of the SNR of the output pixels in each frame, without a full-size SNR sequence
+        snrs_broad = np.einsum('rnij,rij->rn', cal_seq, np.divide(1., cal_seq_std + ~self.outputs_pos) * self.outputs_pos)
         fluxes_broad_err = np.sqrt((cal_seq_std**2).sum(axis=(1,2)))
         # Dispersed flux: sum output pixels' signal row-per-row in master frame
         flux_disp = cal_mean.sum(axis=2)[self.output_top_idx:self.output_top_idx+self.output_height]
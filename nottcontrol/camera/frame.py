@@ -12,10 +12,12 @@ import numpy as np
 from PIL import Image
 from nottcontrol.camera.infratec.roi import Roi
 from nottcontrol.camera.infratec.brightness_calculator import BrightnessCalculator
+from nottcontrol.camera.frame_archive import FrameArchiveReader, stamp_to_id
 from nottcontrol import config as nott_config
 from pathlib import Path
 from platform import system
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 
 # Location of frames on the machine
@@ -23,6 +25,38 @@ if system() == "Windows":
     frame_directory = str(nott_config['DEFAULT']['frame_directory'])
 else:
     frame_directory = str(nott_config['DEFAULT']['linux_frame_directory'])
+# Storage format of recorded frames ("png" or "archive"), see config.ini
+frame_storage = nott_config['CAMERA'].get('frame_storage', 'png')
+# Parallel decoding of PNG frames, see config.ini
+png_workers = nott_config['CAMERA'].getint('png_workers', fallback=1)
+png_pool = nott_config['CAMERA'].get('png_pool', 'thread')
+# Batch size of streamed master frame calculations, see config.ini
+master_batch_frames = nott_config['CAMERA'].getint('master_batch_frames', fallback=100)
+
+def _decode_png(img_path):
+    # Module-level, so that it can be sent to a process pool
+    with Image.open(img_path) as img:
+        return np.asarray(img)
+
+def _png_paths(ids,directory):
+    # PNG file of each frame ID, under directory/YYYYMMDD/HHMMSSmmm.png
+    img_paths = []
+    for frame_id in ids:
+        Ymd,HMS = frame_id.split(sep="_")[0],frame_id.split(sep="_")[1]
+        img_paths.append(str(Path(directory).joinpath(Ymd,HMS+'.png')))
+    return img_paths
+
+def _roi_slices(rois,window):
+    # ROIs adjusted to the camera window, and the matching (row slice, column slice) of each ROI within a windowed frame
+    rois_crop = []
+    rois_slices = []
+    for roi in rois:
+        # ROI positions within windowed frame
+        x,y,w,h = int(round(roi.x-window["x"])),int(round(roi.y-window["y"])),int(round(roi.w)),int(round(roi.h))
+        i1,i2,j1,j2 = y,y+h,x,x+w
+        rois_crop.append(Roi(x,y,w,h,roi.idx))
+        rois_slices.append((slice(i1,i2),slice(j1,j2)))
+    return rois_crop,rois_slices
 
 class Frame(object):
     # This class represents a sequence of frames, taken by the infrared camera.
@@ -57,7 +91,7 @@ class Frame(object):
             rois_cfg.append(Roi(roi[0],roi[1],roi[2],roi[3],roi_index))
             roi_index += 1
     
-    def __init__(self,ids,integtimes=[],window=None,rois=None):
+    def __init__(self,ids,integtimes=[],window=None,rois=None,data=None):
         """
         Parameters
         ----------
@@ -71,6 +105,10 @@ class Frame(object):
             Contains the infrared camera window's position and size, as integers (px), respectively under keys "x"&"y" (column,row of top-left corner) and "w"&"h" (width,height).
         rois : list (list index : ROI index - 1, values : objects of ROI class)
             Contains the infrared camera regions of interest's positions and sizes, as ROI objects. 
+        data : numpy array (frame index, pixel row, pixel column), or list of such arrays
+            Already loaded frame data, matching ids. If None, the frames are loaded from their PNG files.
+            A list holds consecutive parts of the sequence (e.g. memory-mapped archive chunks), which are
+            only concatenated when the full frames are accessed through "data".
         
         Fields
         ------
@@ -96,32 +134,69 @@ class Frame(object):
         # Setting window
         self.window = window
         # Fetch data from local machine
-        data_cube = []
-        for frame_id in ids:
-            Ymd,HMS = frame_id.split(sep="_")[0],frame_id.split(sep="_")[1]
-            directory = Path(self.frame_directory).joinpath(Ymd)
-            filename = HMS+'.png'
-            img_path = str(Path.joinpath(directory,filename))
-            img = Image.open(img_path)
-            data_slice =  np.asarray(img)
-            data_cube.append(data_slice)
-            
-        self.data = np.array(data_cube)
-        self.width = self.data.shape[2]
-        self.height = self.data.shape[1]
+        if data is None:
+            data = self._load_png(ids)
+        if isinstance(data, list):
+            self._data_parts = data
+            self._data = data[0] if len(data) == 1 else None
+        else:
+            self.data = data
+        self.width = self._data_parts[0].shape[2]
+        self.height = self._data_parts[0].shape[1]
         # ROIs
-        rois_crop = []
-        rois_data = []
-        for roi in rois:
-            # ROI positions within windowed frame
-            x,y,w,h = int(round(roi.x-window["x"])),int(round(roi.y-window["y"])),int(round(roi.w)),int(round(roi.h))
-            i1,i2,j1,j2 = y,y+h,x,x+w
-            rois_crop.append(Roi(x,y,w,h,roi.idx))
-            rois_data.append(self.data[:,i1:i2,j1:j2])
-        self.rois = rois
-        self.rois_crop = rois_crop
-        self.rois_data = np.array(rois_data)
+        self.set_rois(rois)
         self.bg_roi_idx = [8,9] # default, overwritten upon calling link_to_channels
+    
+    @classmethod
+    def from_archive(cls,start,end,window=None,rois=None,directory=None,mmap=True):
+        """
+        Creates a Frame from all frames recorded in [start, end] (unix time, ms) in the chunked frame archive (frame_storage = archive).
+        Frame IDs and integration times are taken from the archive index.
+        If mmap, the archive chunks are memory-mapped instead of read: only the ROI pixels are copied out of the files
+        into "rois_data", the full frames are only paged in when "data" is accessed (e.g. master_full).
+        Otherwise, each chunk is read at once.
+        """
+        if directory is None:
+            directory = frame_directory
+        data,index = FrameArchiveReader(directory).read_parts(start,end,mmap=mmap)
+        ids = [stamp_to_id(stamp) for stamp in index['stamp']]
+        frames = cls(ids,index['integtime'],window,rois,data=data)
+        frames.frame_directory = directory
+        return frames
+    
+    def _load_png(self,ids,workers=None,pool=None):
+        # Loads the PNG file of each frame ID into a preallocated (N,H,W) array.
+        # Decoding is spread over a "thread" or "process" pool of {workers} decoders (defaults from config.ini).
+        if workers is None:
+            workers = png_workers
+        if pool is None:
+            pool = png_pool
+        if len(ids) == 0:
+            raise ValueError("No frame IDs to load.")
+        img_paths = _png_paths(ids,self.frame_directory)
+        
+        # The first frame sets the shape and dtype of the data cube
+        first = _decode_png(img_paths[0])
+        data_cube = np.empty((len(img_paths),)+first.shape, dtype=first.dtype)
+        data_cube[0] = first
+        
+        if workers <= 1 or len(img_paths) == 1:
+            for i in range(1,len(img_paths)):
+                data_cube[i] = _decode_png(img_paths[i])
+        elif pool == "process":
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, len(img_paths) // (4*workers))
+                for i,data_slice in enumerate(executor.map(_decode_png, img_paths[1:], chunksize=chunksize), start=1):
+                    data_cube[i] = data_slice
+        elif pool == "thread":
+            def decode_into(i):
+                data_cube[i] = _decode_png(img_paths[i])
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Consuming the iterator re-raises decoding errors
+                list(executor.map(decode_into, range(1,len(img_paths))))
+        else:
+            raise ValueError(f"Unknown PNG decoding pool '{pool}', expected 'thread' or 'process'.")
+        return data_cube
      
     def set_ids(self,ids):
         self.ids = ids
@@ -164,6 +239,18 @@ class Frame(object):
                 
         return channels_roi,channels_data
     
+    @property
+    def data(self):
+        # Full data cube (frame index, pixel row, pixel column)
+        if self._data is None:
+            self._data = np.concatenate(self._data_parts)
+        return self._data
+    
+    @data.setter
+    def data(self,data):
+        self._data = data
+        self._data_parts = [data]
+    
     def set_data(self,data):
         self.data = data
         self.width = data.shape[2]
@@ -173,34 +260,45 @@ class Frame(object):
      
     def set_rois(self,rois):
         # ROIs
-        rois_crop = []
-        rois_data = []
-        for roi in rois:
-            # ROI positions within windowed frame
-            x,y,w,h = int(round(roi.x-self.window["x"])),int(round(roi.y-self.window["y"])),int(round(roi.w)),int(round(roi.h))
-            i1,i2,j1,j2 = y,y+h,x,x+w
-            rois_crop.append(Roi(x,y,w,h,roi.idx))
-            rois_data.append(self.data[:,i1:i2,j1:j2])
+        rois_crop,rois_slices = _roi_slices(rois,self.window)
         self.rois = rois
         self.rois_crop = rois_crop
-        self.rois_data = np.array(rois_data)
+        # Slicing part per part, so only the ROI pixels of (memory-mapped) data parts are copied
+        rois_data = [np.array([part[:,rows,cols] for rows,cols in rois_slices]) for part in self._data_parts]
+        self.rois_data = rois_data[0] if len(rois_data) == 1 else np.concatenate(rois_data,axis=1)
         return
         
+    def _full_stats(self):
+        # Running statistics of the full frames, part by part and batch by batch: memory-mapped parts are not concatenated
+        # into one cube, and the float64 temporaries are bounded
+        stats = RunningStats()
+        for part in self._data_parts:
+            stats.update(part,master_batch_frames)
+        return stats
+    
     def av_full(self):
         # Averaging the full frames, over all DITs
+        if self._data is None:
+            return self._full_stats().mean
         return np.mean(self.data,axis=0)
         
+    def _rois_stats(self):
+        # Running statistics of the ROIs, batch of frames by batch of frames (bounds the float64 temporaries)
+        stats = RunningStats()
+        stats.update(self.rois_data.swapaxes(0,1),master_batch_frames)
+        return stats
+    
     def av_rois(self):
         # Averaging the ROIs, over all DITs
         return np.mean(self.rois_data,axis=1)
     
     def std_full(self):
         # Calculating the standard deviation over all DITs, for the full frames
-        return np.std(self.data,axis=0)
+        return self._full_stats().std
     
     def std_rois(self):
         # Calculating the standard deviation over all DITs, for the ROIs
-        return np.std(self.rois_data,axis=1)
+        return self._rois_stats().std
      
     def get_roi(self,idx):
         
@@ -215,14 +313,10 @@ class Frame(object):
         # Calculates a master frame (=mean counts per DIT; detector integration time) and the corresponding std map
         # Does so for the full camera frame
 
-        # Amount of frames
-        N = len(self.data)
-        # Calculating the master frame from the individual frames
-        master_frame = self.av_full()
+        # Mean and std in a single pass
+        stats = self._full_stats()
         # Dividing sample std by nr. of frames to get the std on the mean
-        master_frame_std = self.std_full() / np.sqrt(N)
-    
-        return master_frame,master_frame_std
+        return stats.mean,stats.std / np.sqrt(stats.count)
     
     @property
     def master_rois(self):
@@ -231,19 +325,16 @@ class Frame(object):
         
         if hasattr(self, "_master_rois"):
             return self._master_rois
-        # Amount of frames
-        N = len(self.data)
-        # Calculating the master frame from the individual frames
-        master_frame = self.av_rois()
+        # Mean and std in a single pass
+        stats = self._rois_stats()
         # Dividing sample std by nr. of frames to get the std on the mean
-        master_frame_std = self.std_rois() / np.sqrt(N)
-    
-        return master_frame,master_frame_std
+        return stats.mean,stats.std / np.sqrt(stats.count)
       
-    def calib_seq(self, dark, flat=None, full=False, dark_mean=None, dark_mean_std=None):
+    def calib_seq(self, dark, flat=None, full=False, dark_mean=None, dark_mean_std=None, out=None):
         # Compute a sequence of calibrated (dark-subtracted, also background-subtracted if not full) individual frames and calculate the corresponding std map for each
         # "dark" and "flat" denote series of dark (shutters closed) and flat (even illumination) frames, are both instances of the Frame class
         # If not full, the average of the two background ROIs (see config.ini) is also subtracted from each ROI.
+        # The calibrated sequence is float32, written into "out" if it is a float32 array of the right shape (see _calib_fused).
 
         # Mean dark frame and corresponding std frame (only calculated if not provided)
         if dark_mean is None or dark_mean_std is None:
@@ -252,24 +343,68 @@ class Frame(object):
             else:
                 dark_mean, dark_mean_std = dark.master_full
         
+        _, _, cal_seq, cal_seq_std = self._calib_fused(dark_mean, dark_mean_std, full, out)
+        return cal_seq, cal_seq_std
+
+    def _calib_fused(self, dark_mean, dark_mean_std, full=False, out=None):
+        # Calibrated master frame and sequence, with their std maps, in one pass over the data:
+        # the dark-subtracted sequence is written once into a float32 buffer ("out" if it fits), the statistics of each ROI
+        # (or batch of full frames) are accumulated from it, and the background is then subtracted in place.
+        if full:
+            shape = (sum(len(part) for part in self._data_parts), self.height, self.width)
+        else:
+            shape = self.rois_data.shape
+        if out is None or out.shape != shape or out.dtype != np.float32:
+            out = np.empty(shape, dtype=np.float32)
+        cal_seq = out
+
+        if full:
+            # Dark subtract, batch by batch of frames (data parts are not concatenated)
+            stats = RunningStats()
+            offset = 0
+            for part in self._data_parts:
+                for i in range(0, len(part), master_batch_frames):
+                    batch = part[i:i+master_batch_frames]
+                    seq = cal_seq[offset:offset+len(batch)]
+                    np.subtract(batch, dark_mean, out=seq, casting='unsafe')
+                    stats.update(seq)
+                    offset += len(batch)
+            N = stats.count
+            sci_mean, sci_std = stats.mean, stats.std
+        else:
+            # Dark subtract, ROI by ROI
+            N = shape[1]
+            sci_mean = np.empty((shape[0],)+shape[2:])
+            sci_std = np.empty_like(sci_mean)
+            for i in range(shape[0]):
+                np.subtract(self.rois_data[i], dark_mean[i], out=cal_seq[i], casting='unsafe')
+                stats = RunningStats()
+                stats.update(cal_seq[i], master_batch_frames)
+                sci_mean[i], sci_std[i] = stats.mean, stats.std
+
+        # Total std of the master frame (science mean std + dark mean std) and of the sequence (science sample std + dark mean std)
+        cal_mean = sci_mean
+        cal_mean_std = np.hypot(sci_std / np.sqrt(N), dark_mean_std)
+        cal_seq_std = np.hypot(sci_std, dark_mean_std)
+
         if not full:
-            # Calibrate the sequence of frames (= one DIT each; detector integration time), calculate total std (science sample std + dark mean std + mean background error)
-            # Dark subtract
-            cal_seq = self.rois_data - dark_mean[:, np.newaxis, :, :]
-            cal_seq_std = np.hypot(self.std_rois(), dark_mean_std)
-            # Calculate mean dark-subtracted background from background ROIs, for each individual frame in the sequence.
             N = len(self.bg_roi_idx)
-            cal_meanbg_seq = np.average(cal_seq[self.bg_roi_idx],axis=0)
+            # Mean dark-subtracted background from background ROIs, for the master frame
+            cal_meanbg_mean = np.average(cal_mean[self.bg_roi_idx],axis=0)
+            cal_meanbg_mean_std = np.linalg.norm(cal_mean_std[self.bg_roi_idx],axis=0) / N
+            cal_mean = cal_mean - cal_meanbg_mean[np.newaxis, :, :]
+            cal_mean_std = np.hypot(cal_mean_std, cal_meanbg_mean_std[np.newaxis, :, :])
+            # Same for each individual frame in the sequence, summing the background ROIs one by one instead of copying them out
+            cal_meanbg_seq = cal_seq[self.bg_roi_idx[0]].copy()
+            for idx in self.bg_roi_idx[1:]:
+                cal_meanbg_seq += cal_seq[idx]
+            cal_meanbg_seq /= N
             cal_meanbg_seq_err = np.linalg.norm(cal_seq_std[self.bg_roi_idx],axis=0) / N
-            # Background subtract
-            cal_seq = cal_seq - cal_meanbg_seq[np.newaxis, :, :, :]
+            # Background subtract, in place
+            cal_seq -= cal_meanbg_seq[np.newaxis, :, :, :]
             cal_seq_std = np.hypot(cal_seq_std, cal_meanbg_seq_err[np.newaxis, :, :])
-        else:
-            # Calibrate the sequence of frames (= one DIT each; detector integration time), calculate total std (science sample std + dark mean std)
-            cal_seq = self.data - dark_mean[np.newaxis, :, :]
-            cal_seq_std = np.hypot(self.std_full(), dark_mean_std)
 
-        return cal_seq, cal_seq_std
+        return cal_mean, cal_mean_std, cal_seq, cal_seq_std
 
     def calib_master(self, dark, flat=None, full=False, dark_mean=None, dark_mean_std=None):
         # Compute the calibrated (dark-subtracted, also background-subtracted if not full) master frame and calculate the corresponding std map
@@ -317,18 +452,176 @@ class Frame(object):
         # Transpose to get (wavelength, ROI) index numbering; i.e. NIFITS format.
         return cal_mean.sum(axis=-1).transpose((1,0)), np.linalg.norm(cal_mean_std, axis=-1).transpose((1,0)) / np.size(cal_mean_std, -1)
 
-    def calib(self, dark, flat=None, full=False):
-        # Function that combines above two into one.
+    def calib(self, dark, flat=None, full=False, out=None):
+        # Function that combines above two into one, in a single pass over the data (see _calib_fused).
+        # The calibrated sequence is float32, written into "out" if it is a float32 array of the right shape (to reuse it across calls).
         if not full:
             dark_mean, dark_mean_std = dark.master_rois
         else:
             dark_mean, dark_mean_std = dark.master_full
-        cal_mean,cal_mean_std = self.calib_master(dark, flat, full, dark_mean, dark_mean_std)
-        cal_seq,cal_seq_std = self.calib_seq(dark, flat, full, dark_mean, dark_mean_std)
-        return cal_mean, cal_mean_std, cal_seq, cal_seq_std  
+        return self._calib_fused(dark_mean, dark_mean_std, full, out)
 
     def cache_master_rois(self):
         self._master_rois = self.master_rois
         # self._master_full = self.master_full
-      
-        
+
+
+class RunningStats(object):
+    """
+        Running mean and variance of a stream of arrays (Welford), updated batch by batch
+    (pairwise combination of Chan et al.). Samples are along axis 0 of each batch, accumulated in float64.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self._m2 = None # sum of squared deviations from the mean
+
+    def update(self,batch,batch_frames=None):
+        # Adds the samples of batch, {batch_frames} at a time if given (bounds the float64 temporaries)
+        if batch_frames is not None and len(batch) > batch_frames:
+            for i in range(0,len(batch),batch_frames):
+                self.update(batch[i:i+batch_frames])
+            return
+        n = len(batch)
+        if n == 0:
+            return
+        batch_mean = np.mean(batch,axis=0,dtype=np.float64)
+        batch_m2 = np.sum(np.square(batch-batch_mean),axis=0)
+        self._combine(n,batch_mean,batch_m2)
+
+    def merge(self,other):
+        # Adds the samples accumulated by another RunningStats
+        if other.count > 0:
+            self._combine(other.count,other.mean,other._m2)
+
+    def _combine(self,n,mean,m2):
+        if self.count == 0:
+            self.count,self.mean,self._m2 = n,np.array(mean,dtype=np.float64),np.array(m2,dtype=np.float64)
+            return
+        total = self.count+n
+        delta = mean-self.mean
+        self.mean += delta*(n/total)
+        self._m2 += m2+np.square(delta)*(self.count*n/total)
+        self.count = total
+
+    @property
+    def var(self):
+        # Population variance, as np.var
+        return self._m2/self.count
+
+    @property
+    def std(self):
+        # Population standard deviation, as np.std
+        return np.sqrt(self.var)
+
+
+class MasterAccumulator(object):
+    """
+        Master frame (= mean counts per DIT) and std maps of a sequence of frames, accumulated as the frames
+    arrive (from the camera, the PNG loader or the frame archive) instead of over the full (N,H,W) data cube,
+    which is never held in memory. Outputs match those of Frame (master_full, master_rois, std_full, std_rois),
+    e.g. to be passed as dark_mean, dark_mean_std to Frame.calib_master / calib_seq.
+    """
+
+    def __init__(self,window=None,rois=None,full=True,batch_frames=None):
+        """
+        Parameters
+        ----------
+        window : dictionary, camera window as in Frame (default: config.ini)
+        rois : list of ROI objects, as in Frame (default: config.ini)
+        full : bool
+            If False, only the ROIs are accumulated (master_full is then unavailable).
+        batch_frames : int
+            Frames processed at a time by add (default: master_batch_frames of config.ini).
+        """
+        if window is None:
+            window = Frame.window_cfg
+        if rois is None:
+            rois = Frame.rois_cfg
+        if batch_frames is None:
+            batch_frames = master_batch_frames
+        self.window = window
+        self.rois = rois
+        self.rois_crop,self._rois_slices = _roi_slices(rois,window)
+        self.batch_frames = batch_frames
+        self.full_stats = RunningStats() if full else None
+        self.rois_stats = RunningStats()
+        self.integtimes = []
+
+    def add(self,frames,integtimes=None):
+        # Adds a frame (H,W) or a sequence of frames (N,H,W), with their integration times (microseconds)
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[np.newaxis]
+        for i in range(0,len(frames),self.batch_frames):
+            batch = frames[i:i+self.batch_frames]
+            if self.full_stats is not None:
+                self.full_stats.update(batch)
+            # (frame, ROI, pixel row, pixel column)
+            self.rois_stats.update(np.stack([batch[:,rows,cols] for rows,cols in self._rois_slices],axis=1))
+        if integtimes is not None:
+            self.integtimes.extend(np.atleast_1d(integtimes))
+
+    @property
+    def count(self):
+        return self.rois_stats.count
+
+    @property
+    def meandit(self):
+        return np.mean(self.integtimes)
+
+    def _check(self,full):
+        if self.count == 0:
+            raise ValueError("No frames accumulated.")
+        if full and self.full_stats is None:
+            raise ValueError("Full frames are not accumulated (full=False).")
+
+    def av_full(self):
+        self._check(True)
+        return self.full_stats.mean
+
+    def std_full(self):
+        self._check(True)
+        return self.full_stats.std
+
+    def av_rois(self):
+        self._check(False)
+        return self.rois_stats.mean
+
+    def std_rois(self):
+        self._check(False)
+        return self.rois_stats.std
+
+    @property
+    def master_full(self):
+        # Master frame and std on the mean, as Frame.master_full
+        return self.av_full(),self.std_full() / np.sqrt(self.count)
+
+    @property
+    def master_rois(self):
+        # Master frame and std on the mean within the ROIs (ROI, pixel row, pixel column), as Frame.master_rois
+        return self.av_rois(),self.std_rois() / np.sqrt(self.count)
+
+    @classmethod
+    def from_png(cls,ids,integtimes=None,directory=None,**kwargs):
+        # Accumulates the PNG frames of the given IDs, decoding them one by one
+        if directory is None:
+            directory = frame_directory
+        accumulator = cls(**kwargs)
+        for i,img_path in enumerate(_png_paths(ids,directory)):
+            accumulator.add(_decode_png(img_path),None if integtimes is None else integtimes[i])
+        return accumulator
+
+    @classmethod
+    def from_archive(cls,start,end,directory=None,**kwargs):
+        # Accumulates all frames recorded in [start, end] (unix time, ms) in the frame archive, paging them in batch by batch
+        if directory is None:
+            directory = frame_directory
+        data_parts,index = FrameArchiveReader(directory).read_parts(start,end,mmap=True)
+        accumulator = cls(**kwargs)
+        offset = 0
+        for part in data_parts:
+            accumulator.add(part,index['integtime'][offset:offset+len(part)])
+            offset += len(part)
+        return accumulator
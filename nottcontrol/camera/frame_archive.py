@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked binary storage of infrared camera frames.
+
+Instead of one PNG per frame, frames are appended to rolling chunk files inside
+the usual frame_directory/YYYYMMDD/ folders:
+    HHMMSSmmm.raw : contiguous uint16 frames, C-ordered, no header
+    HHMMSSmmm.idx : one INDEX_DTYPE record per frame in the .raw file
+The chunk name is the timestamp of its first frame. A new chunk is started
+every `chunk_frames` frames, on a change of frame shape and at midnight (UTC).
+
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import numpy as np
+
+RAW_SUFFIX = ".raw"
+INDEX_SUFFIX = ".idx"
+FRAME_DTYPE = np.dtype('<u2')
+# stamp : unix time (ms), as registered in redis
+# integtime : integration time (microseconds)
+# height, width : frame shape (px)
+INDEX_DTYPE = np.dtype([('stamp', '<i8'), ('integtime', '<f8'), ('height', '<u2'), ('width', '<u2')])
+
+_epoch = datetime(1970, 1, 1)
+
+def unix_time_ms(timestamp):
+    # Same convention as RedisClient.unix_time_ms : naive UTC datetime to milliseconds since epoch
+    return round((timestamp - _epoch).total_seconds() * 1000.0)
+
+def stamp_to_id(stamp):
+    # Unix time (ms) to frame ID ("Y%m%d_H%M%S" formatted string, up to millisecond precision)
+    utc_stamp = datetime.fromtimestamp(0, timezone.utc) + timedelta(milliseconds=int(stamp))
+    return utc_stamp.strftime("%Y%m%d") + "_" + utc_stamp.strftime("%H%M%S%f")[:-3]
+
+def _chunk_name(stamp):
+    return stamp_to_id(stamp).split(sep="_")[1]
+
+def _chunk_start(day, name):
+    # Unix time (ms) of the first frame of chunk {name} in day directory {day}
+    start = datetime.strptime(day + name, "%Y%m%d%H%M%S%f")
+    return unix_time_ms(start)
+
+
+class FrameArchiveWriter(object):
+    """
+        Appends frames, with their timestamp and integration time, to rolling chunk files.
+    Writing is thread safe: frames can be appended from the frame processing thread
+    while recording is stopped (close) from the GUI or socket thread.
+    """
+
+    def __init__(self, frame_directory, chunk_frames=1000):
+        """
+        Parameters
+        ----------
+        frame_directory : string
+            Root directory of the archive, day directories are created below it.
+        chunk_frames : int
+            Maximum amount of frames per chunk.
+        """
+        self.frame_directory = frame_directory
+        self.chunk_frames = chunk_frames
+        self._lock = threading.Lock()
+        self._raw_file = None
+        self._idx_file = None
+        self._day = None
+        self._shape = None
+        self._count = 0
+
+    def append(self, img, timestamp, integtime):
+        """
+        img : 2D numpy array, frame data
+        timestamp : datetime (naive, UTC), frame timestamp
+        integtime : float, integration time (microseconds)
+        """
+        img = np.ascontiguousarray(img, dtype=FRAME_DTYPE)
+        stamp = unix_time_ms(timestamp)
+        day = timestamp.strftime("%Y%m%d")
+
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record['stamp'] = stamp
+        record['integtime'] = integtime
+        record['height'], record['width'] = img.shape
+
+        with self._lock:
+            if (self._raw_file is None or self._count >= self.chunk_frames
+                    or day != self._day or img.shape != self._shape):
+                self._open_chunk(day, stamp, img.shape)
+            # Frame data is flushed before its index record, so readers never index a missing frame.
+            self._raw_file.write(img.tobytes())
+            self._raw_file.flush()
+            self._idx_file.write(record.tobytes())
+            self._idx_file.flush()
+            self._count += 1
+
+    def _open_chunk(self, day, stamp, shape):
+        self._close_chunk()
+        directory = Path(self.frame_directory).joinpath(day)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = _chunk_name(stamp)
+        self._raw_file = open(directory.joinpath(name + RAW_SUFFIX), 'ab')
+        self._idx_file = open(directory.joinpath(name + INDEX_SUFFIX), 'ab')
+        self._day = day
+        self._shape = shape
+        self._count = 0
+
+    def _close_chunk(self):
+        if self._raw_file is not None:
+            self._raw_file.close()
+            self._idx_file.close()
+        self._raw_file = None
+        self._idx_file = None
+
+    def close(self):
+        # Ends the current chunk; the next append starts a new one.
+        with self._lock:
+            self._close_chunk()
+
+
+class FrameArchiveReader(object):
+    """
+        Loads all frames registered within a time window, reading each overlapping chunk in one go.
+    """
+
+    def __init__(self, frame_directory):
+        self.frame_directory = frame_directory
+
+    def chunks(self, start, end):
+        """
+            Returns the (raw path, index path) pairs of all chunks that may hold frames within [start, end] (unix time, ms), chronologically.
+        """
+        day = datetime.fromtimestamp(start / 1000, timezone.utc).date()
+        last_day = datetime.fromtimestamp(end / 1000, timezone.utc).date()
+        candidates = []
+        while day <= last_day:
+            day_str = day.strftime("%Y%m%d")
+            directory = Path(self.frame_directory).joinpath(day_str)
+            if directory.is_dir():
+                for idx_path in directory.glob("*" + INDEX_SUFFIX):
+                    chunk_start = _chunk_start(day_str, idx_path.stem)
+                    candidates.append((chunk_start, idx_path.with_suffix(RAW_SUFFIX), idx_path))
+            day += timedelta(days=1)
+        candidates.sort()
+
+        # A chunk ends where the next one starts
+        selected = []
+        for i, (chunk_start, raw_path, idx_path) in enumerate(candidates):
+            if chunk_start > end:
+                break
+            if i+1 < len(candidates) and candidates[i+1][0] <= start:
+                continue
+            selected.append((raw_path, idx_path))
+        return selected
+
+    def read_index(self, idx_path, raw_path=None):
+        """
+            Reads the index of a chunk. If the matching raw file is given, index records
+        of frames that are not (yet) fully written to disk are dropped.
+        """
+        index = np.fromfile(idx_path, dtype=INDEX_DTYPE)
+        if raw_path is not None and len(index) > 0:
+            frame_size = int(index['height'][0]) * int(index['width'][0]) * FRAME_DTYPE.itemsize
+            n_written = Path(raw_path).stat().st_size // frame_size
+            index = index[:n_written]
+        return index
+
+    def read_parts(self, start, end, mmap=False):
+        """
+            Loads all frames with a timestamp in [start, end] (unix time, ms), chunk by chunk.
+        If mmap, the frames are not read but mapped (read-only) from the chunk files,
+        so pixels are only paged in when accessed.
+        Returns
+        -------
+        data_parts : list of numpy arrays (N_chunk, H, W) of uint16, one per chunk, chronologically
+        index : numpy array (N,) of INDEX_DTYPE records, matching the concatenated data parts along axis 0
+        """
+        data_parts, index_parts = [], []
+        for raw_path, idx_path in self.chunks(start, end):
+            index = self.read_index(idx_path, raw_path)
+            in_window = np.flatnonzero((index['stamp'] >= start) & (index['stamp'] <= end))
+            if len(in_window) == 0:
+                continue
+            # Records of a chunk are chronological, so the window is a contiguous range of frames
+            first, count = int(in_window[0]), len(in_window)
+            height, width = int(index['height'][0]), int(index['width'][0])
+            frame_size = height * width * FRAME_DTYPE.itemsize
+            if mmap:
+                data = np.memmap(raw_path, dtype=FRAME_DTYPE, mode='r', offset=first*frame_size, shape=(count, height, width))
+            else:
+                data = np.fromfile(raw_path, dtype=FRAME_DTYPE, count=count*height*width, offset=first*frame_size)
+                data = data.reshape(count, height, width)
+            data_parts.append(data)
+            index_parts.append(index[first:first+count])
+
+        if not data_parts:
+            raise FileNotFoundError(f"No archived frames found in [{start}, {end}] ms under {self.frame_directory}.")
+        if len({part.shape[1:] for part in data_parts}) != 1:
+            raise ValueError("Archived frames in the requested window do not share the same shape (camera window changed).")
+        return data_parts, np.concatenate(index_parts)
+
+    def read(self, start, end):
+        """
+            Loads all frames with a timestamp in [start, end] (unix time, ms).
+        Returns
+        -------
+        data : numpy array (N, H, W) of uint16
+        index : numpy array (N,) of INDEX_DTYPE records, matching data along axis 0
+        """
+        data_parts, index = self.read_parts(start, end)
+        if len(data_parts) == 1:
+            return data_parts[0], index
+        return np.concatenate(data_parts), index
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Shared-memory ring buffer of raw infrared camera frames, wrapping shmlib.py.
+
+The camera GUI (scify.py) publishes every frame it receives, together with its
+timestamp and integration time. Analysis code on the same machine (HumInt, Diagnostics, ...)
+reads the frames of the last seconds straight from memory, without a round-trip through
+PNG files on disk.
+
+Two shm files are used:
+    {fname}          : (depth, H, W) uint16 frames
+    {fname}.meta.shm : (depth, 3) float64 rows of (unix time (ms), integration time (us), frame counter)
+The counter (cnt0) of the meta shm is the total amount of frames published so far.
+Frame number n lives in slot n % depth.
+
+"""
+
+from time import sleep
+import struct
+import numpy as np
+from xaosim.shmlib import shm
+from nottcontrol import config as nott_config
+from nottcontrol.camera.frame_archive import unix_time_ms
+
+# Defaults from config.ini
+frame_shm_enabled = nott_config['CAMERA'].getboolean('frame_shm', fallback=False)
+frame_shm_fname = nott_config['CAMERA'].get('frame_shm_fname', '/dev/shm/nott_frames.im.shm')
+frame_shm_depth = nott_config['CAMERA'].getint('frame_shm_depth', fallback=2000)
+
+META_STAMP, META_INTEGTIME, META_COUNTER = 0, 1, 2
+
+
+class FrameRingShm(object):
+    def __init__(self, fname=frame_shm_fname, depth=frame_shm_depth, shape=None):
+        """
+            Ring buffer of camera frames in shared memory.
+        If shape (H, W) is given, the shm files are (re)created for publishing frames of that shape.
+        Otherwise, existing shm files - created by the publisher - are opened for reading.
+        """
+        self.fname = fname
+        self.meta_fname = fname.replace(".im.shm", "") + ".meta.shm"
+        if shape is not None:
+            self.frames_shm = shm(fname, data=np.zeros((depth,)+tuple(shape), dtype=np.uint16), verbose=False)
+            self.meta_shm = shm(self.meta_fname, data=np.zeros((depth, 3), dtype=np.float64), verbose=False)
+            # Creation counts as a write in shmlib; start numbering frames from 0
+            c0 = self.meta_shm.c0_offset
+            self.meta_shm.buf[c0:c0+8] = struct.pack('Q', 0)
+        else:
+            self.frames_shm = shm(fname, verbose=False)
+            self.meta_shm = shm(self.meta_fname, verbose=False)
+            if self.frames_shm.empty or self.meta_shm.empty:
+                raise FileNotFoundError(f"No frame ring buffer published at {fname}, is the camera GUI publishing frames (frame_shm = True)?")
+        # Zero-copy views on the shared memory
+        self._frames = self._view(self.frames_shm)
+        self._meta = self._view(self.meta_shm)
+        self.depth = self._frames.shape[0]
+        self.shape = self._frames.shape[1:]
+
+    @staticmethod
+    def _view(ashm):
+        if ashm.mtdata['naxis'] == 2:
+            shape = (ashm.mtdata['y'], ashm.mtdata['x'])
+        else:
+            shape = (ashm.mtdata['z'], ashm.mtdata['y'], ashm.mtdata['x'])
+        data = np.frombuffer(ashm.buf, dtype=ashm.npdtype, count=int(np.prod(shape)), offset=ashm.im_offset)
+        return data.reshape(shape)
+
+    def get_counter(self):
+        """
+            Total amount of frames published so far.
+        """
+        return self.meta_shm.get_counter()
+
+    def push(self, img, timestamp, integtime):
+        """
+            Writes a frame to the next slot, then publishes it by incrementing the counter.
+        img : 2D numpy array, frame data
+        timestamp : datetime (naive, UTC), frame timestamp
+        integtime : float, integration time (microseconds)
+        """
+        counter = self.get_counter()
+        slot = counter % self.depth
+        self._frames[slot] = img
+        self._meta[slot] = (unix_time_ms(timestamp), integtime, counter)
+        self.meta_shm.increment_counter()
+
+    def read(self, first, last):
+        """
+            Copies frames number [first, last) out of the ring buffer.
+        Frames that were already overwritten by the publisher, before or while copying, are dropped.
+        Returns
+        -------
+        data : numpy array (N, H, W) of uint16
+        stamps : numpy array (N,), unix time (ms)
+        integtimes : numpy array (N,), integration time (microseconds)
+        """
+        last = min(last, self.get_counter())
+        first = max(first, last - self.depth)
+        slots = np.arange(first, last) % self.depth
+        data = self._frames[slots]
+        meta = self._meta[slots]
+        # Slots that got overwritten during the copy no longer hold the requested frame numbers
+        overwritten = max(0, self.get_counter() - self.depth - first)
+        valid = (meta[:, META_COUNTER] == np.arange(first, last))
+        valid[:overwritten] = False
+        if not valid.all():
+            print(f"Frame ring buffer: dropping {np.count_nonzero(~valid)} overwritten frames, consider a larger frame_shm_depth.")
+        return data[valid], meta[valid, META_STAMP], meta[valid, META_INTEGTIME]
+
+    def read_last(self, dt):
+        """
+            Copies the frames of the last dt seconds, counted back from the latest published frame.
+        """
+        last = self.get_counter()
+        first = max(0, last - self.depth)
+        stamps = self._meta[np.arange(first, last) % self.depth, META_STAMP]
+        if len(stamps) == 0:
+            return self.read(last, last)
+        first += int(np.searchsorted(stamps, stamps[-1] - 1000*dt))
+        return self.read(first, last)
+
+    def record(self, dt):
+        """
+            Waits dt seconds and copies all frames published in the meantime.
+        """
+        first = self.get_counter()
+        sleep(dt)
+        return self.read(first, self.get_counter())
+
+    def close(self, erase_file=False):
+        """
+            Is used to release (and if erase_file, remove) the shm
+        """
+        # The views on the buffers have to be released before closing them
+        del self._frames, self._meta
+        self.frames_shm.close(erase_file=erase_file)
+        self.meta_shm.close(erase_file=erase_file)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Frame-rate benchmark of the infrared acquisition pipeline (frame_pipeline.py, as run by scify.py).
+
+Simulated frames (simulated_interface.py) are submitted at increasing frame rates, each for a fixed
+duration, and processed as when recording: ROI statistics, coadding, saving (PNG or archive) and
+the redis writes of integration times and ROI values. For each rate it reports the per-stage latency
+percentiles, the queue depth, the dropped frames and the redis write throughput, and the results are
+written to a JSON file to compare runs.
+
+Run it with
+    python -m nottcontrol.camera.infratec.benchmark [--rates 100 200 400] [--storage archive] [--redis URL]
+
+Nothing is written to redis unless a url is given. The benchmark writes synthetic samples to the
+cam_integtime and roi* keys, so the url should be a dedicated database (e.g. redis://localhost:6379/15),
+the databaseurl of config.ini is refused.
+"""
+
+import argparse
+import json
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+
+from nottcontrol import config
+from nottcontrol.camera.frame_archive import FrameArchiveWriter
+from nottcontrol.camera.infratec.frame_pipeline import FramePipeline, StageTimer
+from nottcontrol.camera.infratec.simulated_interface import (SimulatedInterface, PARAM_WINDOW_X, PARAM_WINDOW_Y,
+                                                             PARAM_WINDOW_W, PARAM_WINDOW_H)
+
+# Defaults from config.ini
+frame_storage = config['CAMERA'].get('frame_storage', 'png')
+record_rois = config['CAMERA'].getboolean('record_rois', fallback=False)
+databaseurl = config['DEFAULT']['databaseurl']
+
+DEFAULT_RATES = (50, 100, 200, 400, 800, 1600)
+# Amount of distinct pre-rendered frames, cycled through during a run
+NB_FRAMES = 200
+
+
+def load_rois(nb_rois=10):
+    # (x, y, w, h) of ROI 1..nb_rois within the window, and their redis keys, as loaded by scify.py
+    x0 = config['CAMERA'].getint('window_x') if config['CAMERA'].getboolean('windowing') else 0
+    y0 = config['CAMERA'].getint('window_y') if config['CAMERA'].getboolean('windowing') else 0
+    rects, keys = [], []
+    for i in range(1, nb_rois+1):
+        x, y, w, h = config.getarray('CAMERA', f'ROI {i}')
+        rects.append((x-x0, y-y0, w, h))
+        keys.append(f'roi{i}')
+    return rects, keys
+
+def render_frames(nb_frames=NB_FRAMES, seed=None):
+    # Frames of the simulated camera, windowed as in scify.set_window (without OPC UA: co-phasing positions)
+    camera = SimulatedInterface(seed=seed)
+    if config['CAMERA'].getboolean('windowing'):
+        camera.setparam_int32(PARAM_WINDOW_W, config['CAMERA'].getint('window_w'))
+        camera.setparam_int32(PARAM_WINDOW_H, config['CAMERA'].getint('window_h'))
+        camera.setparam_int32(PARAM_WINDOW_X, config['CAMERA'].getint('window_x'))
+        camera.setparam_int32(PARAM_WINDOW_Y, config['CAMERA'].getint('window_y'))
+    piezo_scan = np.linspace(0, 10, nb_frames)
+    frames = []
+    for offset in piezo_scan:
+        camera.set_piezo_positions([0, offset, 0, offset])
+        frames.append(camera.render())
+    return frames
+
+def timestamp_step(rate):
+    # Interval between the timestamps of frames submitted at {rate} Hz, at least 1 ms as timestamps are rounded to
+    # the ms (redis samples, PNG file names and archive records would collide otherwise)
+    return timedelta(milliseconds=max(1000/rate, 1))
+
+def writer_stats(redisclient):
+    # Counters of the redis writer, zero before the first write
+    if redisclient is None or redisclient.writer is None:
+        return {'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+    return redisclient.writer.stats()
+
+
+def run_rate(rate, duration, frames, storage, frame_directory, redisclient, coadd=0, store_rois=False, timestamp0=None):
+    """
+        Submits frames at {rate} Hz during {duration} s to a new pipeline, processing them as when recording.
+    Frames are timestamped from timestamp0 (default: now) by timestamp_step. Returns the report of the run.
+    """
+    timer = StageTimer()
+    rects, keys = load_rois()
+    archive = FrameArchiveWriter(frame_directory) if storage == "archive" else None
+    pipeline = FramePipeline(redisclient, frame_directory, lambda: rects, keys, frame_archive=archive,
+                             record_rois=store_rois, timer=timer)
+    pipeline.integtime = 1000
+    save_frame = storage != "none"
+    stats_before = writer_stats(redisclient)
+
+    producing = threading.Event()
+    producing.set()
+    processed = []
+
+    def consume():
+        while producing.is_set() or not pipeline.queue.empty():
+            try:
+                pipeline.process_next(True, save_frame, coadd, timeout=0.1)
+            except queue.Empty:
+                continue
+            processed.append(time.perf_counter())
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+
+    # Frames are paced on the rate as by the camera, their timestamps are spaced by timestamp_step
+    nb_submitted = int(round(rate * duration))
+    step = timestamp_step(rate)
+    if timestamp0 is None:
+        timestamp0 = datetime.utcnow()
+    t0 = t_start = time.perf_counter()
+    for n in range(nb_submitted):
+        pipeline.submit(frames[n % len(frames)], timestamp0 + n*step)
+        t_next = t0 + (n+1)/rate
+        delay = t_next - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    t_submitted = time.perf_counter()
+    producing.clear()
+    consumer.join()
+    t_processed = time.perf_counter()
+    pipeline.flush()
+    t_written = time.perf_counter()
+
+    if redisclient is not None:
+        redisclient.flush(timeout=60)
+    t_flushed = time.perf_counter()
+    stats_after = writer_stats(redisclient)
+    if archive is not None:
+        archive.close()
+    pipeline.close()
+
+    depths = np.array(timer.queue_depths)
+    written = stats_after['written'] - stats_before['written']
+    return {
+        'rate': rate,
+        'submitted': nb_submitted,
+        'processed': len(processed),
+        'dropped': pipeline.dropped_frames,
+        'dropped_writes': pipeline.dropped_writes,
+        'write_backlog_time': t_written - t_processed,
+        'submit_rate': nb_submitted / (t_submitted - t_start),
+        'processing_rate': len(processed) / (processed[-1] - t_start) if processed else 0.0,
+        'backlog_time': t_processed - t_submitted,
+        'queue_depth': {'mean': float(depths.mean()), 'p90': float(np.percentile(depths, 90)), 'max': int(depths.max())},
+        'stages': timer.percentiles(),
+        'redis': {
+            'written': written,
+            'dropped': stats_after['dropped'] - stats_before['dropped'],
+            'failed': stats_after['failed'] - stats_before['failed'],
+            'batches': stats_after['batches'] - stats_before['batches'],
+            'flush_time': t_flushed - t_written,
+            'throughput': written / (t_flushed - t_start),
+        },
+    }
+
+
+def print_report(results):
+    for result in results:
+        print(f"\n{result['rate']} Hz: {result['processed']}/{result['submitted']} frames processed, "
+              f"{result['dropped']} dropped, {result['dropped_writes']} not saved, {result['processing_rate']:.1f} frames/s "
+              f"(queue depth mean {result['queue_depth']['mean']:.2f}, max {result['queue_depth']['max']})")
+        print(f"    {'stage':<16}{'count':>8}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)")
+        for stage, stats in result['stages'].items():
+            print(f"    {stage:<16}{stats['count']:>8}{stats['mean']:>9.3f}{stats['p50']:>9.3f}"
+                  f"{stats['p90']:>9.3f}{stats['p99']:>9.3f}{stats['max']:>9.3f}")
+        redis = result['redis']
+        if redis['written'] or redis['dropped'] or redis['failed']:
+            print(f"    redis: {redis['written']} samples written in {redis['batches']} batches "
+                  f"({redis['throughput']:.0f} samples/s, flush {1000*redis['flush_time']:.1f} ms), "
+                  f"{redis['dropped']} dropped, {redis['failed']} failed")
+    sustained = [result['rate'] for result in results if result['dropped'] == 0 and result['dropped_writes'] == 0]
+    print(f"\nHighest rate without dropped frames: {max(sustained) if sustained else 'none'} Hz")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Frame-rate benchmark of the infrared acquisition pipeline")
+    parser.add_argument("--rates", type=float, nargs="+", default=DEFAULT_RATES, help="Frame rates to run (Hz)")
+    parser.add_argument("--duration", type=float, default=5.0, help="Duration of each run (s)")
+    parser.add_argument("--storage", choices=("png", "archive", "none"), default=frame_storage, help="Storage of the frames")
+    parser.add_argument("--coadd", type=int, default=0, help="Amount of frames to coadd (0: no coadding)")
+    parser.add_argument("--record-rois", action=argparse.BooleanOptionalAction, default=record_rois, help="Write ROI values to redis")
+    parser.add_argument("--redis", default="none", help="Url of a dedicated redis database to write to, or 'none' (default)")
+    parser.add_argument("--frame-directory", default=None, help="Directory of the saved frames (default: temporary directory)")
+    parser.add_argument("--output", default="frame_benchmark.json", help="JSON file of the results")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the simulated frames")
+    args = parser.parse_args(argv)
+
+    if args.redis == databaseurl:
+        parser.error(f"--redis {args.redis} is the databaseurl of config.ini, use a dedicated database to write benchmark samples")
+    redisclient = None
+    if args.redis.lower() != "none":
+        # Only imported when writing to redis
+        from nottcontrol.redisclient import RedisClient
+        redisclient = RedisClient(args.redis)
+
+    frames = render_frames(seed=args.seed)
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]} px, storage: {args.storage}, "
+          f"coadd: {args.coadd}, ROIs to redis: {args.record_rois}, redis: {args.redis}")
+
+    results = []
+    # Above 1000 Hz timestamps run ahead of time, runs start after the timestamps of the previous one
+    timestamp0 = datetime.utcnow()
+    with tempfile.TemporaryDirectory(prefix="frame_benchmark_") as tmp_directory:
+        for rate in args.rates:
+            frame_directory = Path(args.frame_directory or tmp_directory).joinpath(f"{rate:g}Hz")
+            print(f"Running {rate:g} Hz for {args.duration:g} s...")
+            timestamp0 = max(timestamp0, datetime.utcnow())
+            results.append(run_rate(rate, args.duration, frames, args.storage, str(frame_directory), redisclient,
+                                    args.coadd, args.record_rois, timestamp0))
+            timestamp0 += results[-1]['submitted']*timestamp_step(rate)
+    if redisclient is not None:
+        redisclient.close()
+
+    print_report(results)
+    report = {'date': datetime.utcnow().isoformat(), 'frame_shape': list(frames[0].shape), 'storage': args.storage,
+              'coadd': args.coadd, 'record_rois': args.record_rois, 'redis': args.redis, 'duration': args.duration,
+              'results': results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -22,4 +22,47 @@ class BrightnessCalculator():
             avg = numpy.average(roi)
             shape = numpy.shape(roi)
             sum = avg * shape[0] * shape[1]
-            self.results.append(BrightnessResults(min, max, avg, sum))
\ No newline at end of file
+            self.results.append(BrightnessResults(min, max, avg, sum))
+
+# Result of RoiBrightnessEngine, one record per ROI (and per frame, for a batch of frames)
+BRIGHTNESS_DTYPE = numpy.dtype([('min', numpy.float64), ('max', numpy.float64), ('avg', numpy.float64), ('sum', numpy.float64)])
+
+class RoiBrightnessEngine():
+    """
+    Calculates min, max, avg and sum within all ROIs of a frame, or of a batch of frames, in one vectorized call.
+    The pixel indices of all ROIs are precomputed once into a single flat index table,
+    so that a frame only needs one gather, after which every statistic is a segmented (reduceat) reduction.
+    """
+
+    def __init__(self, rects, frame_shape):
+        """
+        rects : list of (x, y, w, h) tuples, ROI top-left column/row and width/height (px) in the frame. Rounded to whole pixels, clipped to the frame.
+        frame_shape : (height, width) of the frames
+        """
+        self.frame_shape = tuple(frame_shape)
+        height, width = self.frame_shape
+        indices = []
+        for x, y, w, h in rects:
+            x, y = int(round(x)), int(round(y))
+            rows = numpy.arange(max(y, 0), min(y + int(round(h)), height))
+            cols = numpy.arange(max(x, 0), min(x + int(round(w)), width))
+            if len(rows) == 0 or len(cols) == 0:
+                raise ValueError(f'ROI {(x, y, w, h)} does not overlap with the frame of shape {self.frame_shape}')
+            indices.append((rows[:, numpy.newaxis] * width + cols[numpy.newaxis, :]).ravel())
+        self.sizes = numpy.array([len(index) for index in indices])
+        self.offsets = numpy.concatenate(([0], numpy.cumsum(self.sizes)[:-1]))
+        self.index = numpy.concatenate(indices)
+
+    def run(self, frames):
+        """
+        frames : numpy array (..., height, width), a single frame or a batch of frames
+        Returns a BRIGHTNESS_DTYPE structured array of shape (..., number of ROIs)
+        """
+        frames = numpy.asarray(frames)
+        pixels = frames.reshape(frames.shape[:-2] + (-1,))[..., self.index]
+        results = numpy.empty(frames.shape[:-2] + (len(self.sizes),), dtype=BRIGHTNESS_DTYPE)
+        results['min'] = numpy.minimum.reduceat(pixels, self.offsets, axis=-1)
+        results['max'] = numpy.maximum.reduceat(pixels, self.offsets, axis=-1)
+        results['sum'] = numpy.add.reduceat(pixels, self.offsets, axis=-1, dtype=numpy.float64)
+        results['avg'] = results['sum'] / self.sizes
+        return results
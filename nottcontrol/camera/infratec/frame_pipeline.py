@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Per-frame processing of the infrared camera GUI (scify.py), without any Qt dependency.
+
+Frames received by the camera callback are submitted to a bounded queue, from which a processing
+thread takes them one by one: publishing to shared memory, saving (PNG or archive), ROI statistics
+(pushed to redis when recording with record_rois) and coadding. Frames to save are handed to a single
+long-lived writer thread, through a second bounded queue. The GUI only provides the recording
+state and is notified of new ROI results; benchmark.py drives the same pipeline headless.
+
+"""
+
+import threading
+import time
+import queue
+from datetime import timedelta
+from pathlib import Path
+import numpy as np
+from nottcontrol.camera.infratec.brightness_calculator import RoiBrightnessEngine
+
+# Frames beyond this amount of queued frames are dropped
+max_queued_frames = 5
+# Frames to save beyond this amount of queued writes are not saved
+max_queued_writes = 50
+
+
+def round_to_ms(timestamp):
+    # Rounds a datetime to the nearest millisecond
+    remaining_us = timestamp.microsecond % 1000
+    if remaining_us >= 500:
+        return timestamp + timedelta(microseconds=(1000-remaining_us))
+    return timestamp - timedelta(microseconds=remaining_us)
+
+
+class StageTimer(object):
+    """
+        Collects the duration of each processing stage (seconds), per frame, to report latency percentiles.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}
+        # Amount of frames already queued when a frame is submitted
+        self.queue_depths = []
+
+    def record(self, stage, t_start):
+        # Duration of {stage}, started at t_start (time.perf_counter)
+        duration = time.perf_counter() - t_start
+        with self._lock:
+            self.durations.setdefault(stage, []).append(duration)
+
+    def record_queue_depth(self, depth):
+        with self._lock:
+            self.queue_depths.append(depth)
+
+    def reset(self):
+        with self._lock:
+            self.durations = {}
+            self.queue_depths = []
+
+    def percentiles(self, q=(50, 90, 99)):
+        # {stage: {'count', 'mean', 'p50', ...}}, durations in milliseconds
+        with self._lock:
+            durations = {stage: np.array(values) for stage, values in self.durations.items()}
+        report = {}
+        for stage, values in durations.items():
+            stats = {'count': len(values), 'mean': 1000*float(values.mean()), 'max': 1000*float(values.max())}
+            for p, value in zip(q, np.percentile(values, q)):
+                stats[f'p{p}'] = 1000*float(value)
+            report[stage] = stats
+        return report
+
+
+class FramePipeline(object):
+    def __init__(self, redisclient, frame_directory, roi_rects, roi_keys, frame_archive=None,
+                 publish_frames=False, record_rois=False, timer=None):
+        """
+        Parameters
+        ----------
+        redisclient : RedisClient, receiving integration times and ROI values (None: nothing is written to redis)
+        frame_directory : string, root directory of saved frames
+        roi_rects : callable returning the (x, y, w, h) of all ROIs, called when the ROI engine is (re)built
+        roi_keys : list of the redis key prefixes of the ROIs, in the same order
+        frame_archive : FrameArchiveWriter, if frames are saved to an archive instead of PNG files
+        publish_frames : if True, all frames are published to the shared-memory ring buffer
+        record_rois : if True, ROI values of recorded frames are written to redis
+        timer : StageTimer, if the duration of each stage is to be recorded
+        """
+        self.redisclient = redisclient
+        self.frame_directory = frame_directory
+        self.roi_rects = roi_rects
+        self.roi_keys = roi_keys
+        self.frame_archive = frame_archive
+        self.publish_frames = publish_frames
+        self.record_rois = record_rois
+        self.timer = timer
+        self.integtime = 0
+        # Pixel index table of the ROIs, set to None when a ROI is moved or resized
+        self.roi_engine = None
+        self.frame_ring = None
+        self.coadd_frames_buffer = []
+        self.queue = queue.Queue()
+        self.dropped_frames = 0
+        self.roi_tracking_frames = 0
+        # Frames to save, written by the writer thread (started on the first frame to save)
+        self.write_queue = queue.Queue(maxsize=max_queued_writes)
+        self.dropped_writes = 0
+        self._writer = None
+
+    def _record(self, stage, t_start):
+        if self.timer is not None:
+            self.timer.record(stage, t_start)
+
+    def submit(self, img, timestamp):
+        """
+            Queues a frame for processing, unless too many are already waiting. Returns False if the frame was dropped.
+        """
+        depth = self.queue.qsize()
+        if self.timer is not None:
+            self.timer.record_queue_depth(depth)
+        if depth > max_queued_frames:
+            print('Dropping frame!')
+            self.dropped_frames += 1
+            return False
+        self.queue.put((img, timestamp, time.perf_counter()))
+        return True
+
+    def process_next(self, recording, save_frame, coadd_frames, on_results=None, timeout=None):
+        """
+            Takes the next queued frame and processes it, see process. Raises queue.Empty after timeout (s).
+        """
+        img, timestamp, t_submit = self.queue.get(timeout=timeout)
+        self._record('wait', t_submit)
+        return self.process(img, timestamp, recording, save_frame, coadd_frames, on_results)
+
+    def process(self, img, timestamp, recording, save_frame, coadd_frames, on_results=None):
+        """
+            Processes one frame.
+        recording : whether the camera GUI is recording
+        save_frame : whether the frame is to be saved (PNG or archive)
+        coadd_frames : amount of frames to coadd, 0 if not coadding
+        on_results : callable(timestamp, results), called with the ROI results to display
+        Returns the frame to display and whether coadding is still in process (the frame is then not to be displayed).
+        """
+        t_frame = time.perf_counter()
+        # Timestamp is a datetime.utc object
+        timestamp = round_to_ms(timestamp)
+
+        if self.publish_frames:
+            t = time.perf_counter()
+            self.publish_frame(img, timestamp)
+            self._record('publish', t)
+
+        if save_frame:
+            t = time.perf_counter()
+            self.queue_write(img, timestamp)
+            self._record('save_queue', t)
+
+        if recording or not coadd_frames: #always process individual frames if recording; always process all frames if not coadding
+            self.process_roi(img, timestamp, False, recording, not coadd_frames, on_results)
+
+        #If coadding, check to see if we have the required amount of frames
+        coadd_in_process = False
+        if coadd_frames:
+            self.coadd_frames_buffer.append(img)
+            if len(self.coadd_frames_buffer) >= coadd_frames:
+                t = time.perf_counter()
+                #Create 3D array containing all values
+                arr = np.array(self.coadd_frames_buffer)
+                #maintain dtype, otherwise the background substraction will throw an error
+                img = np.average(arr, axis=0).astype(np.uint16)
+                self._record('coadd', t)
+                self.process_roi(img, timestamp, True, recording, True, on_results)
+                self.coadd_frames_buffer.clear()
+            else:
+                coadd_in_process = True
+
+        self._record('frame', t_frame)
+        return img, coadd_in_process
+
+    def publish_frame(self, img, timestamp):
+        # Only imported when publishing, shmlib is not available on every machine
+        from nottcontrol.camera.frame_shm import FrameRingShm
+        if self.frame_ring is None or self.frame_ring.shape != img.shape:
+            if self.frame_ring is not None:
+                self.frame_ring.close()
+            self.frame_ring = FrameRingShm(shape=img.shape)
+        self.frame_ring.push(img, timestamp, self.integtime)
+
+    def queue_write(self, img, timestamp):
+        # Hands a frame to the writer thread. Returns False if too many writes are waiting and the frame is not saved.
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_frames, name="FrameWriter", daemon=True)
+            self._writer.start()
+        try:
+            self.write_queue.put_nowait((img, timestamp))
+        except queue.Full:
+            print('Dropping frame write!')
+            self.dropped_writes += 1
+            return False
+        return True
+
+    def _write_frames(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                # Flush marker, all writes queued before it are done
+                item.set()
+                continue
+            try:
+                self.save_frame(*item)
+            except Exception as e:
+                print(f'Saving frame failed ({e})')
+
+    def flush(self, timeout=None):
+        """
+            Waits until all frames queued for saving before the call are written. Returns False on timeout.
+        """
+        if self._writer is None:
+            return True
+        done = threading.Event()
+        try:
+            self.write_queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def save_frame(self, img, timestamp):
+        t = time.perf_counter()
+        if self.frame_archive is not None:
+            self.frame_archive.append(img, timestamp, self.integtime)
+        else:
+            # Only imported when saving PNG files
+            import cv2
+            directory = Path(self.frame_directory).joinpath(timestamp.strftime("%Y%m%d"))
+            directory.mkdir(parents=True, exist_ok=True)
+            # Already rounded to the nearest ms earlier, just drop the "000" at the end.
+            filename = timestamp.strftime("%H%M%S%f")[:-3] + ".png"
+            cv2.imwrite(str(directory.joinpath(filename)), img)
+        self._record('save', t)
+        if self.redisclient is not None:
+            t = time.perf_counter()
+            self.redisclient.add_cam_integtime(timestamp, self.integtime)
+            self._record('redis_integtime', t)
+
+    def process_roi(self, img, timestamp, coadded_frame, recording, display, on_results=None):
+        t = time.perf_counter()
+        results = self.run_roi_calculator(img)
+        self._record('roi', t)
+        if not coadded_frame and recording:
+            if self.record_rois and self.redisclient is not None:
+                t = time.perf_counter()
+                self.redisclient.add_roi_values(timestamp, dict(zip(self.roi_keys, results)))
+                self._record('redis_rois', t)
+            self.roi_tracking_frames += 1
+
+        if display and on_results is not None:
+            on_results(timestamp, results)
+
+    def run_roi_calculator(self, img):
+        # Returns the min/max/avg/sum of all ROIs (RoiBrightnessEngine structured array, one record per ROI)
+        engine = self.roi_engine
+        if engine is None or engine.frame_shape != img.shape:
+            engine = RoiBrightnessEngine(self.roi_rects(), img.shape)
+            self.roi_engine = engine
+        return engine.run(img)
+
+    def close(self):
+        # Writes the remaining frames and stops the writer thread
+        if self._writer is not None:
+            self.write_queue.put(None)
+            self._writer.join()
+            self._writer = None
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+            self.frame_ring = None
@@ -31,9 +31,9 @@ class RoiWidget(QWidget):
         self.label.setPalette(pal)
     
     def setValues(self, brightnessResults: BrightnessResults):
-        self.ui.lineEdit_roi1_min.setText(f'{brightnessResults.min:.2f}')
-        self.ui.lineEdit_roi1_max.setText(f'{brightnessResults.max:.2f}')
-        self.ui.lineEdit_roi1_avg.setText(f'{brightnessResults.avg:.2f}')
+        self.ui.lineEdit_roi1_min.setText(f'{brightnessResults["min"]:.2f}')
+        self.ui.lineEdit_roi1_max.setText(f'{brightnessResults["max"]:.2f}')
+        self.ui.lineEdit_roi1_avg.setText(f'{brightnessResults["avg"]:.2f}')
     
     def isChecked(self):
         return self.ui.checkBox_ROI1.isChecked()
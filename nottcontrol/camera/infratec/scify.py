@@ -16,10 +16,10 @@ from PyQt5.QtWidgets import QVBoxLayout
 from PyQt5.QtWidgets import QFileDialog
 from PyQt5.QtGui import QColorConstants
 from nottcontrol.camera.infratec.infratec_interface import InfratecInterface, Image
+from nottcontrol.camera.infratec.simulated_interface import SimulatedInterface
 
 import numpy
 import cv2
-from nottcontrol.camera.infratec.brightness_calculator import BrightnessCalculator
 from nottcontrol.camera.infratec.parametersdialog import ParametersDialog
 from nottcontrol.redisclient import RedisClient
 from nottcontrol import config
@@ -27,8 +27,8 @@ from collections import deque
 from enum import Enum
 from nottcontrol.camera.infratec.roi import Roi
 from nottcontrol.camera.infratec.roiwidget import RoiWidget
-import queue
-from pathlib import Path
+from nottcontrol.camera.frame_archive import FrameArchiveWriter
+from nottcontrol.camera.infratec.frame_pipeline import FramePipeline
 import zmq
 from platform import system
 
@@ -62,12 +62,15 @@ class MainWindow(QMainWindow):
     #Without this call, the GUI is resized and tiny
     os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
     request_image_update = pyqtSignal(numpy.ndarray)
-    roi_calculation_finished = pyqtSignal(BrightnessCalculator)
+    roi_calculation_finished = pyqtSignal(numpy.ndarray)
     closing = pyqtSignal()
     
     def __init__(self):
         super(MainWindow, self).__init__()
-        self.interface = InfratecInterface()
+        if config['CAMERA'].getboolean('simulated_camera', fallback=False):
+            self.interface = SimulatedInterface()
+        else:
+            self.interface = InfratecInterface()
 
         pg.setConfigOptions(imageAxisOrder='row-major')
         ## Switch to using white background and black foreground
@@ -111,7 +114,6 @@ class MainWindow(QMainWindow):
         self.frame_rate_timer.timeout.connect(self.calculate_frame_rates)
 
         self.nbCameraImages = 0
-        self.roi_tracking_frames = 0
         self.calculating_roi = False
 
         url =  config['DEFAULT']['databaseurl']
@@ -130,12 +132,31 @@ class MainWindow(QMainWindow):
         deque_length = 6000
 
         self.timestamps = deque(maxlen = deque_length)
-        self.coadd_frames_buffer = []
-        self.roi_queue = queue.Queue()
         
         self.running = True
         threading.Thread(target=self.socket_server, daemon=True).start()
         self.frame_directory = frame_directory
+        # Frames are either saved one PNG per frame, or appended to chunks of a frame archive
+        if config['CAMERA'].get('frame_storage', 'png') == "archive":
+            self.frame_archive = FrameArchiveWriter(frame_directory, config['CAMERA'].getint('archive_chunk_frames', fallback=1000))
+        else:
+            self.frame_archive = None
+        # Publishing of all frames to a shared-memory ring buffer (created upon the first frame)
+        publish_frames = config['CAMERA'].getboolean('frame_shm', fallback=False)
+        # Queue, saving, ROI statistics and coadding of the frames, see frame_pipeline.py
+        self.pipeline = FramePipeline(self.redisclient, frame_directory, self.roi_rects,
+                                      [roi_widget.db_key for roi_widget in self.roi_widgets],
+                                      frame_archive=self.frame_archive, publish_frames=publish_frames,
+                                      record_rois=record_rois)
+
+    @property
+    def integtime(self):
+        # Integration time stored with saved frames
+        return self.pipeline.integtime
+
+    @integtime.setter
+    def integtime(self, value):
+        self.pipeline.integtime = value
     
     def socket_server(self):
         context = zmq.Context()
@@ -173,7 +194,7 @@ class MainWindow(QMainWindow):
         self.ui.lineEdit_coadd_frames.setEnabled(self.is_coadd_enabled())
 
         if self.is_coadd_enabled:
-            self.coadd_frames_buffer.clear()
+            self.pipeline.coadd_frames_buffer.clear()
     
     def is_coadd_enabled(self):
         return self.ui.cb_coadd.isChecked()
@@ -182,66 +203,19 @@ class MainWindow(QMainWindow):
         s = self.ui.lineEdit_coadd_frames.text()
         return int(s)
 
-    def save_frame_write_redis(self, filepath, img, timestamp):
-        cv2.imwrite(filepath, img)
-        self.store_integtime_to_db(timestamp, self.integtime)
-
     def process_frame(self):
         tLastUpdate = time.perf_counter()
-        base_path = self.frame_directory
-        print(f"base directory: {base_path}")
+        print(f"base directory: {self.frame_directory}")
         while True:
-            item = self.roi_queue.get()
-            img = item[0]
-            # Timestamp is a datetime.utc object
-            timestamp = item[1]
-            # Getting remaining amount of microseconds in the millisecond
-            remaining_us = timestamp.microsecond % 1000
-            # Rounding
-            if remaining_us >= 500:
-                timestamp = timestamp + timedelta(microseconds=(1000-remaining_us))
-            else:
-                timestamp = timestamp - timedelta(microseconds=remaining_us)
-            #base_path = r"Y:\Documents\Scify\Frames\frame_"
-            directory = Path(base_path).joinpath(timestamp.strftime("%Y%m%d"))
-            directory.mkdir(parents=True, exist_ok=True)
-            # Already rounded to the nearest ms earlier, just drop the "000" at the end.
-            timestamp_str = timestamp.strftime("%H%M%S%f")[:-3]
-            filename = timestamp_str + ".png"
-            filepath = str(Path.joinpath(directory, filename))
-
             recording = self.recording
-
             save_frame = recording and self.ui.checkBox_saveframes.isChecked()
-            
-            if save_frame:
-                thread = threading.Thread(target = self.save_frame_write_redis, args =(filepath, img, timestamp))
-                thread.start()
+            coadd_frames = self.nb_coadd_frames() if self.is_coadd_enabled() else 0
+            img, coadd_in_process = self.pipeline.process_next(recording, save_frame, coadd_frames, self.update_gui_with_newroi)
 
-            if recording or not self.is_coadd_enabled(): #always process individual frames if recording; always process all frames if not coadding
-                self.process_roi(img, timestamp, coadded_frame=False)
-                
-            #If coadding, check to see if we have the required amount of frames
-            coadd_in_process = False
-            if self.is_coadd_enabled():
-                self.coadd_frames_buffer.append(img)
-                if len(self.coadd_frames_buffer) >= self.nb_coadd_frames():
-                    #Create 3D array containing all values
-                    arr = numpy.array(self.coadd_frames_buffer)
-                    #maintain dtype, otherwise the background substraction will throw an error
-                    img = numpy.average(arr, axis=0).astype(numpy.uint16)
-                    self.process_roi(img, timestamp, coadded_frame=True)
-                    self.coadd_frames_buffer.clear()
-                else:
-                    coadd_in_process = True
-            
             t = time.perf_counter()
             if (t-tLastUpdate) > 0.4 and not coadd_in_process:
                 tLastUpdate = t
                 self.request_image_update.emit(img)
-            
-            if save_frame:
-                thread.join()
     
     def load_roi_config(self, config):
         self.roi_config = []
@@ -317,13 +291,13 @@ class MainWindow(QMainWindow):
     
     def calculate_frame_rates(self):
         camera_frame_rate = self.nbCameraImages / 5
-        roi_frame_rate = self.roi_tracking_frames / 5
+        roi_frame_rate = self.pipeline.roi_tracking_frames / 5
         print(f'Camera frame rate: {camera_frame_rate:.2f}')
         print(f'ROI tracking frame rate: {roi_frame_rate:.2f}')
         
         #TODO technically, need to lock
         self.nbCameraImages = 0
-        self.roi_tracking_frames = 0
+        self.pipeline.roi_tracking_frames = 0
 
     def connect_clicked(self):
         if not self.connected:
@@ -419,6 +393,10 @@ class MainWindow(QMainWindow):
         self.ui.button_record.setText('Start')
         self.ui.label_recording.setText('Not recording')
         self.recording = False
+        if self.frame_archive is not None:
+            # Frames still queued for saving are written before the chunk is closed
+            self.pipeline.flush()
+            self.frame_archive.close()
     
     def take_background(self):
         self.background_img = self.image.getImageItem().image
@@ -464,10 +442,7 @@ class MainWindow(QMainWindow):
             timestamp = img_timestamp_ref + timedelta(milliseconds=timestamp_offset)
         #print(f"Delay: {recording_timestamp - timestamp}")
         
-        if(self.roi_queue.qsize() > 5):
-            print('Dropping frame!')
-        else:
-            self.roi_queue.put((img, timestamp))
+        self.pipeline.submit(img, timestamp)
 
     
     def initialize_image_display(self, img):
@@ -497,8 +472,20 @@ class MainWindow(QMainWindow):
     def initialize_roi(self, img):
         for roi_widget in self.roi_widgets:
             roi = roi_widget.createRoi()
+            roi.sigRegionChangeFinished.connect(self.invalidate_roi_engine)
             self.image.getView().addItem(roi)
     
+    def invalidate_roi_engine(self):
+        self.pipeline.roi_engine = None
+
+    def roi_rects(self):
+        # (x, y, w, h) of the ROI widgets, for the ROI engine of the pipeline
+        rects = []
+        for roi_widget in self.roi_widgets:
+            pos, size = roi_widget.roi.pos(), roi_widget.roi.size()
+            rects.append((pos[0], pos[1], size[0], size[1]))
+        return rects
+    
     def get_roi_from_config(self, roi_config:Roi, pen):
         return pg.RectROI([roi_config.x, roi_config.y], [roi_config.w, roi_config.h], pen = pen)
         
@@ -518,46 +505,22 @@ class MainWindow(QMainWindow):
             if roi_widget.isChecked():
                 self.pw_roi.plot(list(self.timestamps), list(roi_widget.max_values), name= roi_widget.name, pen= roi_widget.color)
                 
-    def process_roi(self, img, timestamp, coadded_frame):
-        calculator = self.run_roi_calculator(img)
-        if not coadded_frame and self.recording:
-            if record_rois:
-                self.store_roi_to_db(timestamp, calculator)
-            self.roi_tracking_frames += 1
-        
-        if coadded_frame or not self.is_coadd_enabled():
-            self.update_gui_with_newroi(timestamp, calculator)
-            
-    def update_gui_with_newroi(self, timestamp, calculator):
+    def update_gui_with_newroi(self, timestamp, results):
         self.timestamps.appendleft(datetime.timestamp(timestamp))
         for i in range(len(self.roi_widgets)):
-            self.roi_widgets[i].add_max_value(calculator.results[i].max)
+            self.roi_widgets[i].add_max_value(results[i]['max'])
                 
-        self.roi_calculation_finished.emit(calculator)
+        self.roi_calculation_finished.emit(results)
 
-    def run_roi_calculator(self, img):
-        calculator = BrightnessCalculator([roi_widget.roi.getArrayRegion(img, self.image.getImageItem()) for roi_widget in self.roi_widgets])
-        calculator.run()
-        return calculator
-
-    def store_roi_to_db(self, timestamp, calculator):
-        roi_values = dict()
-        for i in range(len(self.roi_widgets)):
-            key = self.roi_widgets[i].db_key
-            value = calculator.results[i]
-            roi_values[key] = value
-        
-        self.redisclient.add_roi_values(timestamp, roi_values)
-        
     def store_framerate_to_db(self, timestamp, framerate):
         self.redisclient.add_cam_framerate(timestamp,framerate)
         
     def store_integtime_to_db(self, timestamp, integtime):
         self.redisclient.add_cam_integtime(timestamp,integtime)
         
-    def on_roi_calculations_finished(self, calculator):
+    def on_roi_calculations_finished(self, results):
         for i in range(len(self.roi_widgets)):
-            self.roi_widgets[i].setValues(calculator.results[i])
+            self.roi_widgets[i].setValues(results[i])
 
     def closeEvent(self, *args):
         #stopgrab
@@ -565,6 +528,8 @@ class MainWindow(QMainWindow):
             self.stop_recording()
         self.interface.free_device()
         self.interface.free_dll()
+        self.pipeline.close()
+        self.redisclient.close()
         self.closing.emit()
         super().closeEvent(*args)
 
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated Infratec camera, a drop-in replacement of InfratecInterface that needs neither the vendor DLL nor a camera.
+
+Frames are windowed uint16 images holding the dispersed outputs of the chip in the ROIs of config.ini:
+photometric outputs (P*) carry the spectrum of one beam, interferometric outputs (I*) the pairwise
+combination of two beams, modulated by their optical path difference, and background ROIs (B*) are empty.
+The optical paths follow the delay line positions, read from the OPC UA server at opcuaaddress
+(the PLC or nottcontrol.simulator), and the piezo positions set with set_piezo_positions.
+
+Frames are delivered to the registered callback at the configured frame rate (parameter 240),
+so the whole scify.py ingestion path runs as with the real camera.
+"""
+
+import threading
+import time
+import numpy as np
+from nottcontrol import config as nott_config
+
+# Defaults from config.ini
+frame_rate = nott_config['CAMERA'].getfloat('simulated_frame_rate', fallback=200.0)
+
+# Parameter numbers of the Infratec SDK
+PARAM_FRAMERATE = 240
+PARAM_INTEGTIME = 262
+PARAM_WINDOW_X, PARAM_WINDOW_Y, PARAM_WINDOW_W, PARAM_WINDOW_H = 292, 293, 294, 295
+
+FULL_FRAME = (512, 640)  # (H, W) of the unwindowed detector
+BIAS = 2000.0  # ADU
+READ_NOISE = 15.0  # ADU
+# Peak signal (ADU) of a photometric output per microsecond of integration time
+FLUX_PER_US = 8.0
+
+# Interferometric outputs: (beam a, beam b, sign of the combination), i.e. |E_a +- E_b|^2 / 2
+COMBINATIONS = {"I1": (0, 1, -1), "I2": (0, 1, 1), "I3": (2, 3, -1), "I4": (2, 3, 1)}
+PHOTOMETRIC = {"P1": 0, "P2": 1, "P3": 2, "P4": 3}
+
+
+class SimulatedInterface(object):
+    def __init__(self, opcua_url=None, seed=None):
+        """
+            Simulated camera. opcua_url : OPC UA server providing the delay line positions (default: opcuaaddress of config.ini).
+        Without reachable server, the delay lines stay at their co-phasing positions (dl*_pos of config.ini).
+        """
+        self._rng = np.random.default_rng(seed)
+        self._params = {PARAM_FRAMERATE: frame_rate, PARAM_INTEGTIME: 1000,
+                        PARAM_WINDOW_X: 0, PARAM_WINDOW_Y: 0, PARAM_WINDOW_W: FULL_FRAME[1], PARAM_WINDOW_H: FULL_FRAME[0]}
+        self._opcua_url = opcua_url if opcua_url is not None else nott_config['DEFAULT']['opcuaaddress']
+        self._opcua_conn = None
+        # Co-phasing positions (um): zero optical path difference
+        self.dl_zero = np.array([nott_config['DL'].getfloat(f'dl{i}_pos', fallback=0.0) for i in range(1, 5)])
+        self.dl_positions = self.dl_zero.copy()
+        self.piezo_positions = np.zeros(4)
+        self.flux = np.ones(4)
+        self._layout = None
+        self._noise = None
+        self._image = None
+        self._timestamp = 0.0
+        self._grabbing = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self.devices = ["Simulated camera"]
+
+    # Device handling, as InfratecInterface
+
+    def load_dll(self):
+        pass
+
+    def free_dll(self):
+        return True
+
+    def create_device(self):
+        pass
+
+    def free_device(self):
+        self.disconnect()
+        return True
+
+    def connect(self, callback, context):
+        if self._grabbing:
+            return True
+        self._connect_opcua()
+        self._grabbing = True
+        self._thread = threading.Thread(target=self._grab, args=(callback, context), daemon=True)
+        self._thread.start()
+        print('Connected succesfully! (simulated camera)')
+        return True
+
+    def disconnect(self):
+        self._grabbing = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        return True
+
+    def _connect_opcua(self):
+        # Delay line positions are kept up to date by a subscription, so reading them per frame costs no round-trip
+        from nottcontrol.opcua import get_session
+        self._dl_nodes = [f"ns=4;s=MAIN.nott_ics.Delay_Lines.NDL{i}.stat.lrPosActual" for i in range(1, 5)]
+        try:
+            self._opcua_conn = get_session(self._opcua_url)
+            self._opcua_conn.subscribe(self._dl_nodes)
+        except Exception as e:
+            print(f"Simulated camera: no delay line positions from {self._opcua_url} ({e}), using the co-phasing positions.")
+            self._opcua_conn = None
+
+    def set_piezo_positions(self, positions):
+        # Piezo positions (um), adding to the optical path of each beam
+        self.piezo_positions = np.asarray(positions, dtype=float)
+
+    # Frame generation
+
+    def _grab(self, callback, context):
+        t_start = t0 = time.perf_counter()
+        n = 0
+        while self._grabbing:
+            now = time.perf_counter()
+            image = self.render()
+            with self._lock:
+                self._image = image
+                # Camera clock (ms since grabbing started)
+                self._timestamp = 1000.0 * (now - t_start)
+            callback(context)
+            # Frames are paced on the frame rate, not on the time spent rendering and processing them
+            n += 1
+            t_next = t0 + n / self._params[PARAM_FRAMERATE]
+            delay = t_next - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Falling behind, pacing restarts from now instead of bursting to catch up
+                t0 = time.perf_counter() - n / self._params[PARAM_FRAMERATE]
+
+    def _window(self):
+        return (self._params[PARAM_WINDOW_X], self._params[PARAM_WINDOW_Y],
+                self._params[PARAM_WINDOW_W], self._params[PARAM_WINDOW_H])
+
+    def _build_layout(self):
+        """
+            Pixel regions, wavelengths and cross-dispersion profile of each output within the current window.
+        """
+        x0, y0, w, h = self._window()
+        channel_labels = nott_config.getarray('CAMERA', 'channel_labels', str)
+        roi_indices = nott_config.getarray('CAMERA', 'roi_indices', np.int32)
+        low_lamb = nott_config['CAMERA'].getfloat('low_lamb')
+        up_lamb = nott_config['CAMERA'].getfloat('up_lamb')
+        low_index = nott_config['CAMERA'].getfloat('low_index')
+        up_index = nott_config['CAMERA'].getfloat('up_index')
+        lamb_per_pix = (up_lamb - low_lamb) / (up_index - low_index)
+
+        outputs = []
+        for label, roi_index in zip(channel_labels, roi_indices):
+            if label not in PHOTOMETRIC and label not in COMBINATIONS:
+                continue
+            rx, ry, rw, rh = nott_config.getarray('CAMERA', f'ROI {roi_index}')
+            col0, row0 = int(round(rx)) - x0, int(round(ry)) - y0
+            rw, rh = max(int(round(rw)), 1), max(int(round(rh)), 1)
+            if col0 < 0 or row0 < 0 or col0 + rw > w or row0 + rh > h:
+                continue
+            # Linear dispersion along the rows (see HumInt.solve_spectral_cal_linear), band-limited by the filter
+            lambs = low_lamb + (np.arange(rh) - low_index) * lamb_per_pix
+            spectrum = 1.0 / (1.0 + np.exp(-(lambs - low_lamb) / 0.02)) / (1.0 + np.exp((lambs - up_lamb) / 0.02))
+            cols = np.arange(rw) - (rw - 1) / 2
+            profile = np.exp(-0.5 * (cols / max(rw / 4, 0.5))**2)
+            outputs.append((label, (slice(row0, row0 + rh), slice(col0, col0 + rw)), lambs, spectrum[:, None] * profile[None, :]))
+        # Bank of noise frames, cycled through with random offsets instead of drawing noise for every frame
+        noise = self._rng.normal(0.0, READ_NOISE, size=(5 * h * w,)).astype(np.float32)
+        self._layout = ((x0, y0, w, h), outputs)
+        self._noise = noise
+
+    def _optical_paths(self):
+        if self._opcua_conn is not None:
+            try:
+                # mm to um
+                self.dl_positions = 1000.0 * np.asarray(self._opcua_conn.read_nodes(self._dl_nodes), dtype=float)
+            except Exception as e:
+                print(f"Simulated camera: reading delay line positions failed ({e}).")
+                self._opcua_conn = None
+        # Delay lines are passed twice
+        return 2.0 * (self.dl_positions - self.dl_zero) + self.piezo_positions
+
+    def render(self):
+        """
+            Renders one frame (uint16, shape of the current window).
+        """
+        if self._layout is None or self._layout[0] != self._window():
+            self._build_layout()
+        (_, _, w, h), outputs = self._layout
+        offset = self._rng.integers(0, len(self._noise) - h * w)
+        img = self._noise[offset:offset + h * w].reshape(h, w) + BIAS
+        paths = self._optical_paths()
+        gain = FLUX_PER_US * self._params[PARAM_INTEGTIME]
+        for label, region, lambs, shape in outputs:
+            if label in PHOTOMETRIC:
+                intensity = self.flux[PHOTOMETRIC[label]] * np.ones_like(lambs)
+            else:
+                a, b, sign = COMBINATIONS[label]
+                phase = 2 * np.pi * (paths[a] - paths[b]) / lambs
+                intensity = 0.5 * (self.flux[a] + self.flux[b] + sign * 2 * np.sqrt(self.flux[a] * self.flux[b]) * np.cos(phase))
+            img[region] += gain * intensity[:, None] * shape
+        return np.clip(img, 0, 65535).astype(np.uint16)
+
+    def get_image(self):
+        with self._lock:
+            return Image(self._image, self._timestamp)
+
+    def get_max_digital_value(self):
+        with self._lock:
+            return int(self._image.max()) if self._image is not None else -1
+
+    # Parameters. Unknown parameters read as 0 and are stored when written.
+
+    def getparam_int32(self, number):
+        return int(self._params.get(number, 0))
+
+    def setparam_int32(self, number, value):
+        self._params[number] = int(value)
+
+    getparam_int64 = getparam_int32
+    setparam_int64 = setparam_int32
+
+    def getparam_double(self, number):
+        return float(self._params.get(number, 0.0))
+
+    def setparam_double(self, number, value):
+        self._params[number] = float(value)
+
+    getparam_single = getparam_double
+    setparam_single = setparam_double
+
+    def getparam_string(self, number):
+        return str(self._params.get(number, ''))
+
+    def setparam_string(self, number, astring):
+        self._params[number] = astring
+
+    def getparam_idx_int32(self, number, index):
+        return int(self._params.get(number, 0))
+
+    def setparam_idx_int32(self, number, index, value):
+        self._params[number] = int(value)
+
+    def getparam_idx_string(self, number, index):
+        return str(self._params.get(number, ''))
+
+    def setparam_idx_string(self, number, index, string):
+        self._params[number] = string
+
+
+class Image:
+    # Same interface as infratec_interface.Image, on an already rendered frame
+    def __init__(self, image_data, timestamp):
+        self._image_data = image_data
+        self._timestamp = timestamp
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get_max_digital_value(self):
+        return int(self._image_data.max())
+
+    def get_timestamp(self):
+        return self._timestamp
+
+    def get_image_data(self):
+        return self._image_data
@@ -3,4 +3,7 @@ class BrightnessResults():
         self.min = min
         self.max = max
         self.avg = avg
-        self.sum = sum
\ No newline at end of file
+        self.sum = sum
+    def __getitem__(self, key):
+        # Same access as a record of brightness_calculator.BRIGHTNESS_DTYPE
+        return getattr(self, key)
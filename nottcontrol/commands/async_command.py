@@ -1,19 +1,35 @@
 from nottcontrol.commands.command import Command
 import time
 
+class CommandTimeout(Exception):
+    pass
+
 class AsyncCommand(Command):
+    # Maximum time (s) between two progress checks while waiting
+    poll_interval = 0.05
+
     def is_synchronous(self) -> bool:
         return False
     
     def check_progress(self) -> bool:
         pass
 
-    def execute_sync(self, timeout = 1000):
-        self.execute()
+    def wait_for_update(self, timeout):
+        # Blocks until progress may have been made, at most timeout (s)
+        time.sleep(timeout)
+
+    def wait(self, timeout = 1000):
         start = time.perf_counter()
 
         while not self.check_progress():
-            current_time = time.perf_counter()
-            if current_time - start > timeout:
-                raise Exception('Timeout occurred!')
-        return True
\ No newline at end of file
+            remaining = timeout - (time.perf_counter() - start)
+            if remaining <= 0:
+                text = self.text()
+                self.cancel()
+                raise CommandTimeout(f'Timeout occurred! ({text} did not complete within {timeout} s)')
+            self.wait_for_update(min(self.poll_interval, remaining))
+        return True
+
+    def execute_sync(self, timeout = 1000):
+        self.execute()
+        return self.wait(timeout)
\ No newline at end of file
@@ -9,4 +9,8 @@ class Command():
         pass
 
     def is_synchronous(self):
+        pass
+
+    def cancel(self):
+        # Aborts the command if it is still in progress
         pass
\ No newline at end of file
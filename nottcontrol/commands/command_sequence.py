@@ -1,37 +1,66 @@
 from collections import deque
+import time
+from nottcontrol.commands.async_command import AsyncCommand, CommandTimeout
+from nottcontrol.commands.parallel_command import ParallelCommand
 
-class CommandSequence:
-    def __init__(self, commands, name):
-        self._commands = deque(commands)
+class CommandSequence(AsyncCommand):
+    """
+        Runs steps one after the other. A step is a command, or a list of commands run concurrently (see ParallelCommand).
+    Progress is made on check_progress, called either by a GUI timer or by wait / execute_sync,
+    which block on the OPC UA data change notifications of the active step instead of spinning.
+    step_timeout : maximum duration (s) of an asynchronous step, the sequence is cancelled beyond it
+    """
+
+    def __init__(self, commands, name, step_timeout = None):
+        self._steps = [ParallelCommand(cmd) if isinstance(cmd, (list, tuple)) else cmd for cmd in commands]
         self._name = name
+        self.step_timeout = step_timeout
+        self._commands = deque()
+        self._activeCommand = None
+        self._t_step = None
 
     def execute(self):
         print('Executing...')
+        self._commands = deque(self._steps)
         self.execute_next_step()
     
     def execute_next_step(self):
-        if not self._commands:
-            self._activeCommand = None
-            return
-
-        self._activeCommand = self._commands.popleft()
-        self._activeCommand.execute()
-
-        #If the next command is synchronous, execute it, then immediately continue
+        #Synchronous commands are executed, then we immediately continue
         #Otherwise, we stop execution here, and continue only when check_progress is called
-        if self._activeCommand.is_synchronous():
-            self.execute_next_step()
+        while self._commands:
+            self._activeCommand = self._commands.popleft()
+            self._t_step = time.perf_counter()
+            self._activeCommand.execute()
+            if not self._activeCommand.is_synchronous():
+                return
+        self._activeCommand = None
     
     def text(self):
-        print('text')
+        if self._activeCommand is None:
+            return self._name
         return f'{self._name}: {self._activeCommand.text()}'
     
     def check_progress(self):
-        print('check progress')
         if self._activeCommand is None:
             return True
         
         if self._activeCommand.check_progress():
             self.execute_next_step()
+            return self._activeCommand is None
+
+        if self.step_timeout is not None and time.perf_counter() - self._t_step > self.step_timeout:
+            text = self.text()
+            self.cancel()
+            raise CommandTimeout(f'{text} did not complete within {self.step_timeout} s, sequence cancelled.')
+        return False
+
+    def wait_for_update(self, timeout):
+        if self._activeCommand is not None:
+            return self._activeCommand.wait_for_update(timeout)
 
-        return False
\ No newline at end of file
+    def cancel(self):
+        # Drops the remaining steps and aborts the active one
+        self._commands.clear()
+        active, self._activeCommand = self._activeCommand, None
+        if active is not None:
+            active.cancel()
\ No newline at end of file
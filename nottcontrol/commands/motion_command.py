@@ -0,0 +1,56 @@
+from nottcontrol.commands.async_command import AsyncCommand
+import time
+
+class MotionCommand(AsyncCommand):
+    # Motion RPC, completed once the motor is back to STANDING and OPERATIONAL
+
+    # Time (s) after the RPC during which a STANDING status is only trusted if it was refreshed,
+    # as a subscribed status may still be the one from before the move
+    settle_time = 0.2
+
+    def __init__(self, opcua_conn, opcua_prefix):
+        self._opcua_conn = opcua_conn
+        self._opcua_prefix = opcua_prefix
+        self._t_execute = None
+
+    def status_nodes(self):
+        return [f"{self._opcua_prefix}.stat.sStatus", f"{self._opcua_prefix}.stat.sState"]
+
+    def rpc_call(self):
+        # (node id, method, arguments) of the motion RPC
+        pass
+
+    def execute(self):
+        self._t_execute = time.time()
+        self._opcua_conn.execute_rpc(*self.rpc_call())
+
+    def check_progress(self):
+        nodes = self.status_nodes()
+        cache = self._opcua_conn.cache
+        if cache is not None and self._t_execute is not None and nodes[0] in cache:
+            if time.time() - self._t_execute < self.settle_time and min(cache.stamps(nodes)) < self._t_execute:
+                return False
+        status, state = self._opcua_conn.read_nodes(nodes)
+
+        return (status == 'STANDING' and state == 'OPERATIONAL')
+
+    def wait_for_update(self, timeout):
+        return self._opcua_conn.wait_for_update(timeout)
+
+    def cancel(self):
+        self._opcua_conn.execute_rpc(self._opcua_prefix, "4:RPC_Stop", [])
+
+
+def execute_parallel(commands):
+    """
+        Executes motion commands together: the RPCs of commands sharing an OPC UA connection are sent concurrently.
+    Returns once all RPCs were acknowledged, not when the motions are complete (see AsyncCommand.wait).
+    """
+    by_connection = {}
+    for command in commands:
+        by_connection.setdefault(id(command._opcua_conn), []).append(command)
+    for group in by_connection.values():
+        t_execute = time.time()
+        for command in group:
+            command._t_execute = t_execute
+        group[0]._opcua_conn.execute_rpcs([command.rpc_call() for command in group])
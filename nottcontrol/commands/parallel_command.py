@@ -0,0 +1,44 @@
+from nottcontrol.commands.async_command import AsyncCommand
+from nottcontrol.commands.motion_command import MotionCommand, execute_parallel
+
+class ParallelCommand(AsyncCommand):
+    # Runs commands concurrently, completed once all of them are
+
+    def __init__(self, commands, name = None):
+        self._commands = list(commands)
+        self._name = name
+        self._pending = []
+
+    def execute(self):
+        # Motion RPCs are sent together, see execute_parallel
+        execute_parallel([cmd for cmd in self._commands if isinstance(cmd, MotionCommand)])
+        for cmd in self._commands:
+            if not isinstance(cmd, MotionCommand):
+                cmd.execute()
+        self._pending = [cmd for cmd in self._commands if not cmd.is_synchronous()]
+
+    def check_progress(self):
+        self._pending = [cmd for cmd in self._pending if not cmd.check_progress()]
+        return not self._pending
+
+    def wait_for_update(self, timeout):
+        # All pending commands are checked on the next update of any of them
+        if self._pending:
+            return self._pending[0].wait_for_update(timeout)
+
+    def cancel(self):
+        # Every pending command is cancelled, even if cancelling one of them fails
+        pending, self._pending = self._pending, []
+        errors = []
+        for cmd in pending:
+            try:
+                cmd.cancel()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def text(self):
+        if self._name is not None:
+            return self._name
+        return ' | '.join(cmd.text() for cmd in self._commands)
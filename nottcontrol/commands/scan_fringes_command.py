@@ -1,3 +1,4 @@
+import numpy as np
 from nottcontrol.commands.command_sequence import CommandSequence
 from nottcontrol.commands.stop_camera_recording_command import StopCameraRecordingCommand
 from nottcontrol.commands.start_camera_recording_command import StartCameraRecordingCommand
@@ -8,10 +9,14 @@ class ScanFringesCommand(CommandSequence):
     # 2) Start recording on camera (sync)
     # 3) Move (abs) to final position (async)
     # 4) Stop recording on camera (sync)
+    # motor can be a list of motors, which then move together (start_pos and end_pos scalars or one per motor)
 
-    def __init__(self, motor, start_pos, end_pos, speed, camera_window):
-        moveToStart = motor.command_move_absolute(start_pos, speed)
+    def __init__(self, motor, start_pos, end_pos, speed, camera_window, step_timeout = None):
+        motors = motor if isinstance(motor, (list, tuple)) else [motor]
+        start_pos = np.broadcast_to(start_pos, len(motors))
+        end_pos = np.broadcast_to(end_pos, len(motors))
+        moveToStart = [amotor.command_move_absolute(float(pos), speed) for amotor, pos in zip(motors, start_pos)]
         startRecording = StartCameraRecordingCommand(camera_window)
-        moveToFinish = motor.command_move_absolute(end_pos, speed)
+        moveToFinish = [amotor.command_move_absolute(float(pos), speed) for amotor, pos in zip(motors, end_pos)]
         stopRecording = StopCameraRecordingCommand(camera_window)
-        super().__init__([moveToStart, startRecording, moveToFinish, stopRecording], 'Scan fringes')
+        super().__init__([moveToStart, startRecording, moveToFinish, stopRecording], 'Scan fringes', step_timeout)
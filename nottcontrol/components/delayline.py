@@ -38,17 +38,28 @@ class DelayLine(Motor):
     @property
     def position(self):
         # Current position in um.
-        return self.getPositionAndSpeed()[0]*1000
+        return self.position_in(self.read(('position',)))
 
     @property
     def is_standing(self):
         # Motor sStatus == 'STANDING'?
-        return self.getStatusInformation()[0] == 'STANDING'
+        return self.is_standing_in(self.read(('status',)))
 
     @property
     def is_operational(self):
         # Motor sState == 'OPERATIONAL'?
-        return self.getStatusInformation()[1] == 'OPERATIONAL'
+        return self.is_operational_in(self.read(('state',)))
+
+    # Same checks, evaluated against a snapshot of Motor.read_many
+
+    def position_in(self, snapshot):
+        return snapshot['position']*1000
+
+    def is_standing_in(self, snapshot):
+        return snapshot['status'] == 'STANDING'
+
+    def is_operational_in(self, snapshot):
+        return snapshot['state'] == 'OPERATIONAL'
 
     def is_in_travel_range(self, target_pos: float = None):
         # Target position within [pos_min, pos_max]?
@@ -69,9 +80,15 @@ class DelayLine(Motor):
         """
            Move to absolute position target_pos (um). 
         """
+        self.command_move_abs(target_pos, check_valid).execute()
+
+    def command_move_abs(self, target_pos: float, check_valid: bool= True):
+        """
+           Command moving to absolute position target_pos (um), to be executed (possibly with other motions, see execute_parallel).
+        """
         if check_valid:
             self._valid_move(target_pos)
-        self.command_move_absolute(target_pos*10**(-3)).execute()
+        return self.command_move_absolute(target_pos*10**(-3))
 
     def move_rel(self, delta_pos: float, check_valid: bool= True):
         """
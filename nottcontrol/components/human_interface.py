@@ -19,11 +19,15 @@ y_filter = np.array([0.0017543387818981376, 0.004561388410207326, 0.014385942578
 mean_wl = np.sum(x_filter*y_filter) / np.sum(y_filter)
 
 from nottcontrol.opcua import OPCUAConnection
+from nottcontrol.components.motor import Motor
 from nottcontrol.components.shutter import Shutter
 from nottcontrol.components.delayline import DelayLine
-from nottcontrol.camera.frame import Frame
+from nottcontrol.commands.motion_command import execute_parallel
+from nottcontrol.camera.frame import Frame, frame_storage
+from nottcontrol.camera.dark_library import DarkLibrary, dark_temperature_key
+from nottcontrol.camera.frame_shm import FrameRingShm, frame_shm_enabled
 from nottcontrol.lucid.lib.lucid_utils import LucidUtils
-from nottcontrol.script.lib.nott_database import get_field
+from nottcontrol.script.lib.nott_database import get_field, query_fields
 from configparser import ConfigParser
 from nottcontrol import config 
 
@@ -256,6 +260,8 @@ class HumInt(object):
         self.rois = rois_interest
         self.dark = None
         self.bg_noise = None
+        # Master darks, reused by dark_master instead of closing the shutters
+        self.dark_library = DarkLibrary()
         self.opcua_conn = OPCUAConnection(opcuad)
         self.opcua_conn.connect()
         self.shutters = [
@@ -272,6 +278,8 @@ class HumInt(object):
                 f"ns=4;s=MAIN.nott_ics.Delay_Lines.NDL{dlid+1}",
                 f"NDL{dlid+1}") for dlid in range(4)
         ]
+        # Status and positions of all shutters and delay lines are kept up to date by a subscription
+        self.opcua_conn.subscribe([node for motor in self.shutters + self.delay_lines for node in motor.status_nodes])
         self.frame_VIS_pup = None
         self.frame_VIS_im = None
 
@@ -295,6 +303,8 @@ class HumInt(object):
     
     def __del__(self):
         self.opcua_conn.disconnect()
+        if hasattr(self, "frame_ring"):
+            self.frame_ring.close()
         if hasattr(self, "buffer_im_IR"):
             self.buffer_im_IR.close()
         if hasattr(self, "buffer_im_VIS_pup"):
@@ -418,6 +428,22 @@ class HumInt(object):
         aresp = self.ts.ts.get(f"cam_integtime")
         return aresp[0]
 
+    def db_integtime(self):
+        # Latest camera integration time (microseconds), as registered in redis
+        aresp = self.ts.ts.get(f"cam_integtime")
+        return aresp[1]
+
+    def db_detector_temperature(self):
+        # Latest detector temperature (K), as registered in redis, or None if not available
+        if dark_temperature_key is None:
+            return None
+        try:
+            aresp = self.ts.ts.get(dark_temperature_key)
+        except Exception as e:
+            print(f"Detector temperature not available ({e}).")
+            return None
+        return None if aresp is None else float(aresp[1])
+
     # Piezo control
 
     def four2three(self, position):
@@ -439,9 +465,13 @@ class HumInt(object):
     
     @property
     def shutter_state(self):
+        # Status and position of all shutters, in a single read
+        return self._shutter_state(Motor.read_many(self.shutters, ('status', 'position')))
+
+    def _shutter_state(self, snapshots):
         
         # Shutters' (treated like motors) status
-        motor_status = np.array([ashutter.getStatusInformation()[0] for ashutter in self.shutters])
+        motor_status = np.array([snapshot['status'] for snapshot in snapshots])
         standing = (motor_status == 'STANDING')
 
         shutter_state = np.zeros(len(self.shutters),dtype=np.int32)
@@ -449,21 +479,23 @@ class HumInt(object):
             # Throw error if a shutter is still moving.
             if not standing[i]:
                 raise self.ShutterError("Shutter " + str(ashutter.name) + " is still moving.")
+            is_open = ashutter.is_open_in(snapshots[i])
             # Throw error if a shutter is neither moving, neither standing still in an open/closed position. 
-            if not (ashutter.is_open or ashutter.is_closed):
+            if not (is_open or ashutter.is_closed_in(snapshots[i])):
                 raise self.ShutterError("Shutter " + str(ashutter.name) + " is neither moving, nor in an open/closed position.")
-            if ashutter.is_open:
+            if is_open:
                 shutter_state[i] = 1
         return shutter_state
     
     def shutter_set(self, values, wait=True, verbose=False):
         
+        snapshots = Motor.read_many(self.shutters, ('status', 'state', 'position'))
         # Shutters state on motor level : operational?
-        motor_state = np.array([ashutter.getStatusInformation()[1] for ashutter in self.shutters])
+        motor_state = np.array([snapshot['state'] for snapshot in snapshots])
         operational = (motor_state == 'OPERATIONAL')
         
         # Shutter state on surface level : open/closed?
-        shutter_state = self.shutter_state
+        shutter_state = self._shutter_state(snapshots)
         # Input shutter state
         if not isinstance(values, np.ndarray):
             thevalues = np.array(values)
@@ -471,6 +503,7 @@ class HumInt(object):
             thevalues = values
         shutter_change = np.invert(shutter_state == thevalues)
             
+        commands = []
         for i, ashutter in enumerate(self.shutters):
             # Throw error if a shutter is not operational.
             if not operational[i]:
@@ -479,9 +512,11 @@ class HumInt(object):
             # Only move if current and input state differ
             if shutter_change[i]:
                 if values_bool[i]:
-                    ashutter.open()
+                    commands.append(ashutter.command_open())
                 else:
-                    ashutter.close()
+                    commands.append(ashutter.command_close())
+        # Sent concurrently, so all shutters move together
+        execute_parallel(commands)
         if wait and shutter_change.any():
             sleep(self.shutter_pad)
         if verbose:
@@ -502,13 +537,14 @@ class HumInt(object):
         Raises a DelayLineError if any delay line is not OPERATIONAL or not STANDING. 
         """
         positions = np.nan * np.zeros(len(self.delay_lines))
+        snapshots = Motor.read_many(self.delay_lines)
 
         for i, dl in enumerate(self.delay_lines):
-            if not dl.is_operational:
+            if not dl.is_operational_in(snapshots[i]):
                 raise self.DelayLineError(f"Delay line {dl.name} is not in OPERATIONAL state.")
-            if not dl.is_standing:
+            if not dl.is_standing_in(snapshots[i]):
                 raise self.DelayLineError(f"Delay line {dl.name} is not in STANDING status.")
-            positions[i] = dl.position
+            positions[i] = dl.position_in(snapshots[i])
 
         return positions
 
@@ -536,28 +572,30 @@ class HumInt(object):
 
         # Pre-move checks and timeout calculation
         timeouts = np.zeros(len(self.delay_lines))
+        snapshots = Motor.read_many(self.delay_lines)
         for i, dl in enumerate(self.delay_lines):
             # Checks
             if not move_mask[i]:
                 continue
-            if not dl.is_operational:
+            if not dl.is_operational_in(snapshots[i]):
                 raise self.DelayLineError(f"pre-move: {dl.name} is not in OPERATIONAL state.")
-            if not dl.is_standing:
+            if not dl.is_standing_in(snapshots[i]):
                 raise self.DelayLineError(f"pre-move: {dl.name} is not in STANDING status.")
             # Delay line specific timeout
-            distance = abs(target_pos[i] - dl.position)
+            distance = abs(target_pos[i] - dl.position_in(snapshots[i]))
             speed = dl._speed # um/s
             dt_expected = np.abs(distance / speed)
             # Taking floor timeout of 10s for small motions
             timeouts[i] = max(5.0*dt_expected, timeout_min)
 
-        # Motion calls
-        for i, dl in enumerate(self.delay_lines):
-            if not move_mask[i]:
-                continue
-            dl.move_abs(target_pos[i])
-            if verbose:
-                print(f"Moving delay line {dl.name}...")
+        # Motion calls, all target positions are validated before any delay line moves
+        commands = [dl.command_move_abs(target_pos[i]) for i, dl in enumerate(self.delay_lines) if move_mask[i]]
+        if verbose:
+            for i, dl in enumerate(self.delay_lines):
+                if move_mask[i]:
+                    print(f"Moving delay line {dl.name}...")
+        # Sent concurrently, so all delay lines start moving together
+        execute_parallel(commands)
 
         # Poll until either in valid state (post-move) or timeout
         t_start = time()
@@ -569,15 +607,18 @@ class HumInt(object):
             dt = time()-t_start
             # DLs end up in finished if motion complete or if errored.
             finished = set()
+            # Status of all pending delay lines, in a single read
+            indices = sorted(pending)
+            snapshots = dict(zip(indices, Motor.read_many([self.delay_lines[i] for i in indices], ('status', 'state'))))
 
-            for i in list(pending):
+            for i in indices:
                 dl = self.delay_lines[i]
-                if not dl.is_operational:
+                if not dl.is_operational_in(snapshots[i]):
                     errors.append(f"in-move: {dl.name} became NOT OPERATIONAL through move.")
                     finished.add(i)
                     continue
 
-                if dl.is_standing and dt > 0.1*timeouts[i]:
+                if dl.is_standing_in(snapshots[i]) and dt > 0.1*timeouts[i]:
                     finished.add(i)
                     continue
                 
@@ -588,16 +629,18 @@ class HumInt(object):
 
             pending -= finished
             if pending:
-                sleep(0.05)
+                # Next status change, at most 50 ms
+                self.opcua_conn.wait_for_update(0.05)
 
         if errors:
             raise self.DelayLineError(" | ".join(errors))
 
         # Post-move checks & reporting
+        snapshots = Motor.read_many(self.delay_lines, ('state',))
         for i, dl in enumerate(self.delay_lines):
             if not move_mask[i]:
                 continue
-            if not dl.is_operational:
+            if not dl.is_operational_in(snapshots[i]):
                 errors.append(f"post-move: {dl.name} is not OPERATIONAL after move.")
             elif verbose:
                 sleep(2) # to ensure correct position readout
@@ -622,9 +665,10 @@ class HumInt(object):
             raise self.DelayLineError(f"Input position offsets (length {len(delta_pos)}) must match the amount of available delay lines {len(self.delay_lines)}.")
 
         target_pos = np.nan * np.zeros(len(self.delay_lines))
+        snapshots = Motor.read_many(self.delay_lines, ('position',))
         for i, dl in enumerate(self.delay_lines):
             if not np.isnan(delta_pos[i]) and not delta_pos[i] == 0.0:
-                target_pos[i] = dl.position + delta_pos[i]
+                target_pos[i] = dl.position_in(snapshots[i]) + delta_pos[i]
 
         self.dl_set_abs(target_pos, verbose=verbose)
 
@@ -749,8 +793,12 @@ class HumInt(object):
         sleep(dt)
         # end = int(np.round(time()*1000).astype(int))
         end = self.db_time()
-        mes = np.array([self.ts.ts.range(akey, start, end) for akey in self.rois])
-        return mes.T[1]
+        # All ROIs in one round-trip, keeping the timestamps sampled for every ROI
+        timestamps, mes = query_fields(self.rois, start, end, ts=self.ts.ts)
+        mes = mes[:, ~np.isnan(mes).any(axis=0)]
+        if mes.shape[1] == 0:
+            raise ValueError(f"No samples common to all ROIs between {start} and {end}")
+        return mes.T
 
     def sample_long_cal(self, dt):
         return self.sample_long(dt=dt) - self.dark
@@ -788,10 +836,21 @@ class HumInt(object):
     def get_frames(self,dt):
         # Timespan dt in seconds
         
+        if frame_shm_enabled:
+            # Frames published by the camera GUI during dt, straight from the shared-memory ring buffer
+            if not hasattr(self, "frame_ring"):
+                self.frame_ring = FrameRingShm()
+            data, unix_stamps, integtimes = self.frame_ring.record(dt)
+            ids = [datetime_to_id(unix_to_datetime(unix_stamp)) for unix_stamp in unix_stamps]
+            return Frame(ids, integtimes, data=data)
+        
         # db_time returns stamps in unix_time_ms since 01/01/1970 00:00:00, as registered in redis
         start = self.db_time()
         sleep(dt)
         end = self.db_time()
+        if frame_storage == "archive":
+            # Frame timestamps and integration times are indexed in the archive itself
+            return Frame.from_archive(start, end)
         # Fetching (timestamp,integration time) pairs, for each camera frame captured in this timeframe dt, from redis.
         pairs = get_field("cam_integtime", start, end, False)
         # Fetching InfraTec timestamps registered in this timeframe        
@@ -894,6 +953,25 @@ class HumInt(object):
     def dark_frame_sequence(self, dt, verbose=False):
         return self.frame_sequence(dt, shutter_state=[0,0,0,0], verbose=verbose)
 
+    def dark_master(self, dt, max_age=None, verbose=False):
+        """
+        Master dark for the current integration time, camera window, ROI layout and detector temperature.
+        Reused from the dark library if one younger than max_age (s, default: dark_max_age of config.ini) exists,
+        otherwise taken with dark_frame_sequence(dt) and added to the library.
+        The master dark is set as self.dark, used by default by get_frames_cal and the chip calibrations.
+        """
+        integtime = self.db_integtime()
+        temperature = self.db_detector_temperature()
+        dark = self.dark_library.get(integtime, temperature=temperature, max_age=max_age)
+        if dark is None:
+            if verbose:
+                print("Taking darks")
+            dark = self.dark_library.store(self.dark_frame_sequence(dt, verbose=verbose), temperature)
+        elif verbose:
+            print(f"Reusing the master dark taken {dark.age:.0f} s ago")
+        self.dark = dark
+        return dark
+
     def dark_sequence(self, dt=0.5, verbose=False):
         self.shutter_set(np.array([0,0,0,0]), wait=True, verbose=verbose)
         mydark = self.get_dark(dt=dt)
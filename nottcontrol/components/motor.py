@@ -2,19 +2,27 @@ from nottcontrol.commands.move_abs_command import MoveAbsCommand
 from nottcontrol.commands.move_rel_command import MoveRelCommand
 
 class Motor():
+    # Fields of read_many, by OPC UA node relative to the motor prefix
+    FIELDS = {'status': 'stat.sStatus', 'state': 'stat.sState', 'substate': 'stat.sSubstate',
+              'position': 'stat.lrPosActual', 'speed': 'stat.lrVelActual', 'target': 'ctrl.lrPosition'}
+
     def __init__(self, opcua_conn, opcua_prefix: str, name: str, speed: int):
         self._opcua_conn = opcua_conn
         self._prefix = opcua_prefix
         self.name = name
         self._speed = speed
     
-    def command_move_absolute(self, pos) -> MoveAbsCommand:
-        #Unit conversion as the PLC expects mm/s
-        return MoveAbsCommand(self._opcua_conn, self._prefix, pos, self._speed * 10**(-3))
+    def command_move_absolute(self, pos, speed=None) -> MoveAbsCommand:
+        #Unit conversion as the PLC expects mm/s (speed, if given, is already in mm/s)
+        if speed is None:
+            speed = self._speed * 10**(-3)
+        return MoveAbsCommand(self._opcua_conn, self._prefix, pos, speed)
     
-    def command_move_relative(self, rel_pos) -> MoveRelCommand:
-        #Unit conversion as the PLC expects mm/s
-        return MoveRelCommand(self._opcua_conn, self._prefix, rel_pos, self._speed * 10**(-3))
+    def command_move_relative(self, rel_pos, speed=None) -> MoveRelCommand:
+        #Unit conversion as the PLC expects mm/s (speed, if given, is already in mm/s)
+        if speed is None:
+            speed = self._speed * 10**(-3)
+        return MoveRelCommand(self._opcua_conn, self._prefix, rel_pos, speed)
     
     def reset(self):
         return self._opcua_conn.execute_rpc(self._prefix, "4:RPC_Reset", [])
@@ -31,6 +39,40 @@ class Motor():
     def stop(self):
         return self._opcua_conn.execute_rpc(self._prefix, "4:RPC_Stop", [])
     
+    @property
+    def status_nodes(self):
+        # Nodes read by getStatusInformation, getPositionAndSpeed and getTargetPosition
+        return [f"{self._prefix}.stat.sStatus", f"{self._prefix}.stat.sState", f"{self._prefix}.stat.sSubstate",
+                f"{self._prefix}.stat.lrPosActual", f"{self._prefix}.stat.lrVelActual", f"{self._prefix}.ctrl.lrPosition",
+                "ns=4;s=INFRATEC_TRIGERS.sNTPExtTime"]
+
+    def subscribe(self):
+        # Keeps status, position and speed up to date in the cache of the OPC UA connection, so reading them costs no round-trip
+        self._opcua_conn.subscribe(self.status_nodes)
+
+    @staticmethod
+    def read_many(motors, fields=('status', 'state', 'position')):
+        """
+            Reads fields (see Motor.FIELDS) of all motors with a single read per OPC UA connection,
+        instead of one round-trip per motor and getter.
+        Returns a list of snapshots, one {field: value} dict per motor, in order.
+        Position and speed are in PLC units (mm, mm/s).
+        """
+        snapshots = [None]*len(motors)
+        by_connection = {}
+        for i, motor in enumerate(motors):
+            by_connection.setdefault(id(motor._opcua_conn), []).append(i)
+        for indices in by_connection.values():
+            node_ids = [f"{motors[i]._prefix}.{Motor.FIELDS[field]}" for i in indices for field in fields]
+            values = motors[indices[0]]._opcua_conn.read_nodes(node_ids)
+            for k, i in enumerate(indices):
+                snapshots[i] = dict(zip(fields, values[k*len(fields):(k+1)*len(fields)]))
+        return snapshots
+
+    def read(self, fields=('status', 'state', 'position')):
+        # Snapshot of this motor only, see read_many
+        return Motor.read_many([self], fields)[0]
+
     def getPositionAndSpeed(self):
         current_pos, current_speed, timestamp = self._opcua_conn.read_nodes([f"{self._prefix}.stat.lrPosActual", f"{self._prefix}.stat.lrVelActual", 
                                                                               "ns=4;s=INFRATEC_TRIGERS.sNTPExtTime"])
@@ -1,5 +1,6 @@
 import numpy as np
 from nottcontrol.components.motor import Motor
+from nottcontrol.commands.move_abs_command import MoveAbsCommand
 
 class Shutter_Old():
     def __init__(self, opcua_conn, opcua_prefix: str, name: str):
@@ -43,21 +44,33 @@ class Shutter(Motor):
         self._close_pos = close_pos
         self.rtol = rtol # relative tolerance for is_open / is_closed
     
+    def command_open(self) -> MoveAbsCommand:
+        return self.command_move_absolute(self._open_pos)
+
+    def command_close(self) -> MoveAbsCommand:
+        return self.command_move_absolute(self._close_pos)
+
     def open(self):
-        self.command_move_absolute(self._open_pos).execute()
+        self.command_open().execute()
     
     def close(self):
-        self.command_move_absolute(self._close_pos).execute()
+        self.command_close().execute()
         
     @property
     def is_open(self):
-        pos = self.getPositionAndSpeed()[0]
-        return np.isclose(pos,self._open_pos,self.rtol) 
+        return self.is_open_in(self.read(('position',)))
     
     @property
     def is_closed(self):
-        pos = self.getPositionAndSpeed()[0]
-        return np.isclose(pos,self._close_pos,self.rtol)
+        return self.is_closed_in(self.read(('position',)))
+
+    # Same checks, evaluated against a snapshot of Motor.read_many (holding 'position')
+
+    def is_open_in(self, snapshot):
+        return np.isclose(snapshot['position'],self._open_pos,self.rtol)
+
+    def is_closed_in(self, snapshot):
+        return np.isclose(snapshot['position'],self._close_pos,self.rtol)
         
         
         
\ No newline at end of file
@@ -42,6 +42,12 @@ class MotorWidget(QWidget):
         self.ui.label_name.setText(self._motor.name)
 
         self._activeCommand = None
+
+        # Status and position are then pushed by the server instead of polled
+        try:
+            self._motor.subscribe()
+        except Exception as e:
+            print(f"Error subscribing to {self._motor.name} status: {e}")
     
     def expand_engineering_menu(self):
         localPos = self.ui.pb_engineering_menu.pos()
@@ -182,6 +188,10 @@ class MotorWidget(QWidget):
     # Stop motor
     def stop_motor(self):
         try:
+            # Also drops the remaining steps of a running sequence
+            if self._activeCommand is not None:
+                self._activeCommand.cancel()
+                self.clearActiveCommand()
             res = self._motor.stop()
         except Exception as e:
             print(f"Error calling RPC method: {e}")
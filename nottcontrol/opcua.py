@@ -1,13 +1,91 @@
 import asyncio
+import atexit
+import concurrent.futures
+import threading
 from asyncua import ua
-from asyncua.sync import Client
+from asyncua import Client as AsyncClient
+from asyncua.ua import uaerrors
+from asyncua.sync import Client, ThreadLoop
 import time
+from nottcontrol import config as nott_config
 
+# Publishing interval (ms) of data change subscriptions
+subscription_period = nott_config['DEFAULT'].getint('opcua_subscription_period', fallback=50)
+
+# Failures after which a session is reopened
+CONNECTION_ERRORS = (ConnectionError, OSError, TimeoutError, asyncio.TimeoutError, concurrent.futures.TimeoutError,
+                     uaerrors.BadSessionClosed, uaerrors.BadSessionIdInvalid, uaerrors.BadSessionNotActivated,
+                     uaerrors.BadConnectionClosed, uaerrors.BadSecureChannelClosed, uaerrors.BadSecureChannelIdInvalid,
+                     uaerrors.BadCommunicationError, uaerrors.BadNotConnected, uaerrors.BadServerNotConnected)
+
+
+class StatusCache(object):
+    """
+        Thread-safe snapshot of the latest values of subscribed nodes, with the time at which each value was received.
+    Is the handler of a data change subscription: notifications arrive in the thread of the OPC UA client,
+    readers can wait for the next one instead of polling.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._ids = {}
+        self._values = {}
+        self._stamps = {}
+        self.alive = True
+
+    def register(self, node_id, node):
+        self._ids[node.nodeid] = node_id
+
+    def datachange_notification(self, node, val, data):
+        node_id = self._ids.get(node.nodeid)
+        if node_id is None:
+            return
+        with self._cond:
+            self._values[node_id] = val
+            self._stamps[node_id] = time.time()
+            self._cond.notify_all()
+
+    def status_change_notification(self, status):
+        # The subscription died (e.g. lost session): values are no longer kept up to date
+        with self._cond:
+            self.alive = False
+            self._cond.notify_all()
+
+    def __contains__(self, node_id):
+        return node_id in self._ids.values()
+
+    def get_many(self, node_ids):
+        # Latest values of node_ids, or None if any of them was not received yet (or the cache is dead)
+        with self._cond:
+            if not self.alive:
+                return None
+            try:
+                return [self._values[node_id] for node_id in node_ids]
+            except KeyError:
+                return None
+
+    def stamps(self, node_ids):
+        # Unix time (s) at which the latest value of each of node_ids was received (0 if none yet)
+        with self._cond:
+            return [self._stamps.get(node_id, 0.0) for node_id in node_ids]
+
+    def wait(self, timeout=None):
+        # Blocks until the next notification, or timeout (s). Returns False on timeout.
+        with self._cond:
+            return self._cond.wait(timeout)
 
 
 class OPCUAConnection:
     def __init__(self, url):
-        self.client = Client(url)
+        self.url = url
+        self.client = self._new_client()
+        # Node handles, and method node ids by (parent node id, method browse name)
+        self._nodes = {}
+        self._methods = {}
+        # Data change subscription, see subscribe
+        self.cache = None
+        self._subscription = None
+        self._subscribed = []
 
     def connect(self):
         self.client.connect()
@@ -15,20 +93,283 @@ class OPCUAConnection:
     def disconnect(self):
         self.client.disconnect()
 
+    def _new_client(self):
+        return Client(self.url)
+
+    def get_node(self, node_id):
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._nodes[node_id] = self.client.get_node(node_id)
+        return node
+
+    def get_method(self, node_id, rpc):
+        # Resolving a method by browse name costs a round-trip, it is only done once
+        method = self._methods.get((node_id, rpc))
+        if method is None:
+            method = self._methods[(node_id, rpc)] = self.get_node(node_id).get_child(rpc).nodeid
+        return method
+
+    def subscribe(self, node_ids, period=subscription_period):
+        """
+            Subscribes to data changes of node_ids, kept up to date in self.cache.
+        read_node(s) of subscribed nodes are then served from the cache, without a round-trip.
+        """
+        if self._subscription is None:
+            self.cache = StatusCache()
+            self._subscription = self.client.create_subscription(period, self.cache)
+            self._subscription_period = period
+        new_ids = [node_id for node_id in dict.fromkeys(node_ids) if node_id not in self.cache]
+        if not new_ids:
+            return
+        nodes = [self.get_node(node_id) for node_id in new_ids]
+        for node_id, node in zip(new_ids, nodes):
+            self.cache.register(node_id, node)
+        self._subscription.subscribe_data_change(nodes)
+        self._subscribed += new_ids
+
+    def wait_for_update(self, timeout):
+        # Waits for the next data change notification, or sleeps timeout (s) without subscription
+        if self.cache is not None and self.cache.alive:
+            return self.cache.wait(timeout)
+        time.sleep(timeout)
+        return False
+
     def read_node(self, node_id):
-        node = self.client.get_node(node_id)
+        if self.cache is not None:
+            values = self.cache.get_many([node_id])
+            if values is not None:
+                return values[0]
+        node = self.get_node(node_id)
         return node.get_value()
-    
+
     def read_nodes(self, node_ids):
-        nodes = [self.client.get_node(node_id) for node_id in node_ids]
+        if self.cache is not None:
+            values = self.cache.get_many(node_ids)
+            if values is not None:
+                return values
+        nodes = [self.get_node(node_id) for node_id in node_ids]
         return self.client.read_values(nodes)
 
     def write_node(self, node_id, value):
-        node = self.client.get_node(node_id)
+        node = self.get_node(node_id)
         node.set_value(value)
-    
+
     def execute_rpc(self, node_id, rpc, arguments):
-        parent = self.client.get_node(node_id)
+        parent = self.get_node(node_id)
+        if isinstance(rpc, str):
+            rpc = self.get_method(node_id, rpc)
         res = parent.call_method(rpc, *arguments)
         return res
 
+    def execute_rpcs(self, calls, return_exceptions=False):
+        """
+            Executes RPCs concurrently over this connection, instead of one round-trip after the other.
+        calls : list of (node_id, rpc, arguments), as for execute_rpc
+        Returns their results, in order. Once all calls completed, the first failure is raised,
+        unless return_exceptions (then failures are returned in place of the result).
+        """
+        methods = [self.get_method(node_id, rpc) if isinstance(rpc, str) else rpc for node_id, rpc, _ in calls]
+        aio_client = self.client.aio_obj
+        coros = [aio_client.get_node(node_id).call_method(method, *arguments)
+                 for (node_id, _, arguments), method in zip(calls, methods)]
+        results = self.client.tloop.post(gather_results(coros, return_exceptions))
+        return results
+
+
+async def gather_results(coros, return_exceptions=False):
+    # Runs coros concurrently; once all completed, raises the first failure unless return_exceptions
+    results = await asyncio.gather(*coros, return_exceptions=True)
+    if not return_exceptions:
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+    return results
+
+
+class AsyncOPCUAConnection:
+    """
+        Same API as OPCUAConnection, as coroutines on the native asyncio client, to be used from an event loop.
+    Calls from concurrent tasks share the session and are in flight together.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.client = AsyncClient(url)
+        self._nodes = {}
+        self._methods = {}
+
+    async def connect(self):
+        await self.client.connect()
+
+    async def disconnect(self):
+        await self.client.disconnect()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.disconnect()
+
+    def get_node(self, node_id):
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._nodes[node_id] = self.client.get_node(node_id)
+        return node
+
+    async def get_method(self, node_id, rpc):
+        method = self._methods.get((node_id, rpc))
+        if method is None:
+            method = self._methods[(node_id, rpc)] = (await self.get_node(node_id).get_child(rpc)).nodeid
+        return method
+
+    async def read_node(self, node_id):
+        return await self.get_node(node_id).get_value()
+
+    async def read_nodes(self, node_ids):
+        nodes = [self.get_node(node_id) for node_id in node_ids]
+        return await self.client.read_values(nodes)
+
+    async def write_node(self, node_id, value):
+        await self.get_node(node_id).set_value(value)
+
+    async def execute_rpc(self, node_id, rpc, arguments):
+        parent = self.get_node(node_id)
+        if isinstance(rpc, str):
+            rpc = await self.get_method(node_id, rpc)
+        return await parent.call_method(rpc, *arguments)
+
+    async def execute_rpcs(self, calls, return_exceptions=False):
+        # See OPCUAConnection.execute_rpcs
+        return await gather_results([self.execute_rpc(*call) for call in calls], return_exceptions)
+
+
+class OPCUASession(OPCUAConnection):
+    """
+        Long-lived connection, shared by all helpers of a process (see get_session).
+    It connects on first use and, when the connection is lost, reopens the session:
+    reads and writes are then retried once, RPCs are not (the command may have reached the PLC)
+    and raise, the next call using the new session.
+    """
+
+    def __init__(self, url):
+        super().__init__(url)
+        self._lock = threading.RLock()
+        self.connected = False
+
+    def _new_client(self):
+        # The client runs in a daemon thread, so a forgotten session does not keep the process alive
+        tloop = ThreadLoop()
+        tloop.daemon = True
+        tloop.start()
+        return Client(self.url, tloop=tloop)
+
+    def connect(self):
+        with self._lock:
+            if self.connected:
+                return
+            if self.client is None:
+                # The thread loop of a disconnected sync client is stopped, so a new client is needed
+                self.client = self._new_client()
+                self._nodes.clear()
+                self._methods.clear()
+            try:
+                self.client.connect()
+            except Exception:
+                self._drop_client()
+                raise
+            self.connected = True
+            if self._subscribed and self._subscription is None:
+                # Subscriptions do not survive the session
+                subscribed, self._subscribed = self._subscribed, []
+                self.subscribe(subscribed, self._subscription_period)
+
+    def disconnect(self):
+        with self._lock:
+            self.connected = False
+            if self.client is not None:
+                self._drop_client()
+
+    def reconnect(self):
+        with self._lock:
+            self.disconnect()
+            self.connect()
+
+    def _drop_client(self):
+        if self.cache is not None:
+            self.cache.status_change_notification(None)
+        self.cache = None
+        self._subscription = None
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+        self.client.tloop.stop()
+        self.client = None
+
+    def _retry(self, func, *args):
+        self.connect()
+        try:
+            return func(*args)
+        except CONNECTION_ERRORS as e:
+            print(f"OPC UA session to {self.url} lost ({e!r}), reconnecting.")
+            self.reconnect()
+            return func(*args)
+
+    def subscribe(self, node_ids, period=subscription_period):
+        self.connect()
+        return super().subscribe(node_ids, period)
+
+    def read_node(self, node_id):
+        return self._retry(super().read_node, node_id)
+
+    def read_nodes(self, node_ids):
+        return self._retry(super().read_nodes, node_ids)
+
+    def write_node(self, node_id, value):
+        return self._retry(super().write_node, node_id, value)
+
+    def execute_rpc(self, node_id, rpc, arguments):
+        self.connect()
+        try:
+            return super().execute_rpc(node_id, rpc, arguments)
+        except CONNECTION_ERRORS as e:
+            print(f"OPC UA session to {self.url} lost ({e!r}) during {rpc}, reconnecting.")
+            self.reconnect()
+            raise
+
+    def execute_rpcs(self, calls, return_exceptions=False):
+        self.connect()
+        try:
+            return super().execute_rpcs(calls, return_exceptions)
+        except CONNECTION_ERRORS as e:
+            print(f"OPC UA session to {self.url} lost ({e!r}) during concurrent RPCs, reconnecting.")
+            self.reconnect()
+            raise
+
+
+# Sessions by server url
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(url):
+    """
+        Returns the process-wide session to the OPC UA server at url, connecting it on first use.
+    Helpers should not disconnect it; it is closed when the process exits.
+    """
+    with _sessions_lock:
+        session = _sessions.get(url)
+        if session is None:
+            session = _sessions[url] = OPCUASession(url)
+    session.connect()
+    return session
+
+@atexit.register
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            try:
+                session.disconnect()
+            except Exception:
+                pass
+        _sessions.clear()
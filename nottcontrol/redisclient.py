@@ -1,58 +1,320 @@
 import redis
+import re
+import queue
+import threading
+from time import monotonic
 from datetime import datetime
+from nottcontrol import config as nott_config
 from nottcontrol.camera.infratec.utils.utils import BrightnessResults
 import json
 
+# Defaults from config.ini
+batched_writes = nott_config['redis'].getboolean('batched_writes', fallback=True)
+batch_size = nott_config['redis'].getint('batch_size', fallback=500)
+flush_interval = nott_config['redis'].getfloat('flush_interval', fallback=10.)
+queue_size = nott_config['redis'].getint('queue_size', fallback=100000)
+retention_days = nott_config['redis'].getfloat('retention_days', fallback=0)
+compaction_rules = nott_config['redis'].get('compaction_rules', fallback='avg:1000, avg:60000, avg:3600000')
+compaction_retention_days = nott_config['redis'].getfloat('compaction_retention_days', fallback=0)
+
+# Labels of the time series, by key pattern (first match). Groups of the pattern fill in the {placeholders}.
+SERIES_SCHEMA = [
+    (r'roi(\d+)_(max|avg|sum|min)', {'subsystem': 'camera', 'roi': '{0}', 'stat': '{1}', 'unit': 'counts'}),
+    (r'cam_framerate', {'subsystem': 'camera', 'unit': 'Hz'}),
+    (r'cam_integtime', {'subsystem': 'camera', 'unit': 'us'}),
+    (r'DL_(\d+)_pos', {'subsystem': 'delayline', 'beam': '{0}', 'unit': 'mm'}),
+    (r'dl_T(\d+)', {'subsystem': 'delayline', 'sensor': 'T{0}', 'unit': 'degC'}),
+    (r'Shutter (\d+)_pos', {'subsystem': 'shutter', 'beam': '{0}', 'unit': 'mm'}),
+    (r'NT([PT])([AB])(\d+)_pos', {'subsystem': 'tiptilt', 'axis': '{0}', 'mirror': '{1}', 'beam': '{2}', 'unit': 'mm'}),
+    (r'ns=\d+;s=.*\.lrTempK', {'subsystem': 'cryostat', 'unit': 'K'}),
+]
+
+
+def series_labels(key):
+    # Labels of time series {key}, from SERIES_SCHEMA
+    for pattern, labels in SERIES_SCHEMA:
+        match = re.fullmatch(pattern, key)
+        if match:
+            return {label: value.format(*match.groups()) for label, value in labels.items()}
+    return {}
+
+def parse_compaction_rules(rules=compaction_rules):
+    # "avg:1000, max:60000" to [('avg', 1000), ('max', 60000)]
+    parsed = []
+    for rule in rules.split(','):
+        if rule.strip():
+            aggregation, bucket = rule.split(':')
+            parsed.append((aggregation.strip(), int(bucket)))
+    return parsed
+
+def compaction_key(key, aggregation, bucket):
+    # Key of the compacted series of {key}, {aggregation} over {bucket} ms
+    return f'{key}_{aggregation}_{bucket}'
+
+def ensure_series(ts, key, rules=None):
+    """
+        Creates time series {key} with its labels, retention and compaction rules,
+    or updates them if the series already exists (e.g. created by a TS.ADD).
+    Compacted series carry the labels of their source, plus source/aggregation/bucket labels.
+    """
+    if rules is None:
+        rules = parse_compaction_rules()
+    labels = series_labels(key)
+    retention = round(retention_days*86400*1000)
+    try:
+        ts.create(key, retention_msecs=retention, labels=labels)
+    except redis.ResponseError as e:
+        if "already exists" not in str(e):
+            raise
+        ts.alter(key, retention_msecs=retention, labels=labels)
+    for aggregation, bucket in rules:
+        dest = compaction_key(key, aggregation, bucket)
+        dest_labels = dict(labels, source=key, aggregation=aggregation, bucket=str(bucket))
+        try:
+            ts.create(dest, retention_msecs=round(compaction_retention_days*86400*1000), labels=dest_labels)
+        except redis.ResponseError as e:
+            if "already exists" not in str(e):
+                raise
+        try:
+            ts.createrule(key, dest, aggregation, bucket)
+        except redis.ResponseError as e:
+            # The rule was created before
+            if "already" not in str(e):
+                raise
+
+
+class TimeSeriesWriter(object):
+    """
+        Queues time series samples from any thread and writes them to redis with TS.MADD,
+    on a dedicated thread, in batches of at most batch_size samples or flush_interval ms.
+    Producers never block on the network: when the queue is full, samples are dropped and counted.
+    """
+
+    def __init__(self, ts, batch_size=batch_size, flush_interval=flush_interval, queue_size=queue_size):
+        """
+        Parameters
+        ----------
+        ts : redis TimeSeries client
+        batch_size : int
+            Maximum amount of samples per TS.MADD call.
+        flush_interval : float
+            Maximum time (ms) a sample waits in a partially filled batch.
+        queue_size : int
+            Maximum amount of queued samples.
+        """
+        self.ts = ts
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval / 1000.
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._known_keys = set()
+        self._lock = threading.Lock()
+        # Counters (samples, apart from batches)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, name="TimeSeriesWriter", daemon=True)
+        self._thread.start()
+
+    def add(self, key, unix_time, value):
+        # Queues one sample, unix_time in ms. Returns False if it was dropped.
+        try:
+            self._queue.put_nowait((key, unix_time, value))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def add_many(self, samples):
+        # Queues a list of (key, unix time (ms), value) samples. Returns the amount of dropped samples.
+        dropped = 0
+        for sample in samples:
+            try:
+                self._queue.put_nowait(sample)
+            except queue.Full:
+                dropped += 1
+        if dropped:
+            with self._lock:
+                self.dropped += dropped
+        return dropped
+
+    def flush(self, timeout=None):
+        """
+            Waits until all samples queued before the call are written (or failed).
+        Returns False on timeout.
+        """
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        # Writes the remaining samples and stops the writer thread.
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped,
+                    'failed': self.failed, 'batches': self.batches}
+
+    def _run(self):
+        while True:
+            batch, markers, stop = [], [], False
+            item = self._queue.get()
+            deadline = monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    markers.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0., deadline - monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.set()
+            if stop:
+                # Samples queued after close are still written
+                remaining = []
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if isinstance(item, threading.Event):
+                        item.set()
+                    elif item is not None:
+                        remaining.append(item)
+                for i in range(0, len(remaining), self.batch_size):
+                    self._write(remaining[i:i+self.batch_size])
+                return
+
+    def _create(self, key):
+        # Contrary to TS.ADD, TS.MADD does not create missing keys
+        ensure_series(self.ts, key)
+        self._known_keys.add(key)
+
+    def _write(self, batch):
+        try:
+            for key in {sample[0] for sample in batch} - self._known_keys:
+                self._create(key)
+            replies = self.ts.madd(batch)
+        except redis.RedisError as e:
+            print(f"Redis writer: failed to write {len(batch)} samples ({e}).")
+            with self._lock:
+                self.failed += len(batch)
+            return
+        # Samples are rejected one by one (e.g. duplicate timestamp), the others are written
+        errors = [reply for reply in replies if isinstance(reply, Exception)]
+        if errors:
+            print(f"Redis writer: {len(errors)} of {len(batch)} samples rejected ({errors[0]}).")
+        with self._lock:
+            self.written += len(batch) - len(errors)
+            self.failed += len(errors)
+            self.batches += 1
+
+
 class RedisClient:
-    def __init__(self, url):
+    def __init__(self, url, batched=batched_writes):
         self.db = redis.from_url(url)
         self.ts = self.db.ts()
         self.epoch = datetime.utcfromtimestamp(0)
+        # Writes go through a TimeSeriesWriter, started on the first write
+        self.batched = batched
+        self.writer = None
+        self._known_keys = set()
+
+    def bootstrap(self, keys):
+        # Creates (or updates) the labels, retention and compaction rules of the time series {keys} upfront
+        for key in keys:
+            ensure_series(self.ts, key)
+            self._known_keys.add(key)
+
+    def _add(self, key, unix_time, value):
+        if not self.batched:
+            if key not in self._known_keys:
+                self.bootstrap([key])
+            self.ts.add(key, unix_time, value)
+            return
+        if self.writer is None:
+            self.writer = TimeSeriesWriter(self.ts)
+        self.writer.add(key, unix_time, value)
+
+    def _add_many(self, samples):
+        if not self.batched:
+            self.bootstrap({key for key, _, _ in samples} - self._known_keys)
+            pipe = self.ts.pipeline()
+            for key, unix_time, value in samples:
+                pipe.add(key, unix_time, value)
+            pipe.execute()
+            return
+        if self.writer is None:
+            self.writer = TimeSeriesWriter(self.ts)
+        self.writer.add_many(samples)
+
+    def flush(self, timeout=None):
+        # Waits until all samples added so far are written
+        if self.writer is not None:
+            return self.writer.flush(timeout)
+        return True
+
+    def close(self, timeout=None):
+        if self.writer is not None:
+            self.writer.close(timeout)
+            self.writer = None
 
     def add_cam_framerate(self,time,framerate):
         unix_time = self.unix_time_ms(time)
-        self.ts.add('cam_framerate', unix_time, framerate)
+        self._add('cam_framerate', unix_time, framerate)
         
     def add_cam_integtime(self,time,integtime):
         unix_time = self.unix_time_ms(time)
-        self.ts.add('cam_integtime', unix_time, integtime)
+        self._add('cam_integtime', unix_time, integtime)
         
     def add_dl_position(self, motor, time, pos):
         unix_time = self.unix_time_ms(time)
-        self.ts.add(f'{motor}_pos', unix_time, pos)
+        self._add(f'{motor}_pos', unix_time, pos)
     
     def add_shutter_position(self, shutter, time, position):
         unix_time = self.unix_time_ms(time)
-        self.ts.add(f'{shutter}_pos', unix_time, position)
+        self._add(f'{shutter}_pos', unix_time, position)
     
     def add_temperature_1(self, time, temp):
         unix_time = self.unix_time_ms(time)
-        self.ts.add('dl_T1', unix_time, temp)
+        self._add('dl_T1', unix_time, temp)
 
     def add_temperature_2(self, time, temp):
         unix_time = self.unix_time_ms(time)
-        self.ts.add('dl_T2', unix_time, temp)
+        self._add('dl_T2', unix_time, temp)
 
     def add_temperature_3(self, time, temp):
         unix_time = self.unix_time_ms(time)
-        self.ts.add('dl_T3', unix_time, temp)
+        self._add('dl_T3', unix_time, temp)
 
     def add_temperature_4(self, time, temp):
         unix_time = self.unix_time_ms(time)
-        self.ts.add('dl_T4', unix_time, temp)
+        self._add('dl_T4', unix_time, temp)
 
     def add_roi_values(self, time, roi_results: dict[str, BrightnessResults]):
         unix_time = self.unix_time_ms(time)
 
-        pipe = self.ts.pipeline()
-
+        samples = []
         for key in roi_results.keys():
             brightness_result = roi_results[key]
-            pipe.add(f'{key}_max', unix_time, brightness_result.max)
-            pipe.add(f'{key}_avg', unix_time, brightness_result.avg)
-            pipe.add(f'{key}_sum', unix_time, brightness_result.sum)
+            samples.append((f'{key}_max', unix_time, brightness_result['max']))
+            samples.append((f'{key}_avg', unix_time, brightness_result['avg']))
+            samples.append((f'{key}_sum', unix_time, brightness_result['sum']))
 
-        pipe.execute()
+        self._add_many(samples)
         
     def unix_time_ms(self, time):
         return round((time - self.epoch).total_seconds() * 1000.0)
@@ -74,7 +336,4 @@ class RedisClient:
                 f"{len(sensor_values)} values"
             )
         unix_time = self.unix_time_ms(time)
-        pipe = self.ts.pipeline()
-        for key, value in zip(redis_keys, sensor_values):
-            pipe.add(key, unix_time, value)
-        pipe.execute()
\ No newline at end of file
+        self._add_many([(key, unix_time, value) for key, value in zip(redis_keys, sensor_values)])
\ No newline at end of file
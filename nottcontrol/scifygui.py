@@ -9,6 +9,7 @@ from nottcontrol.camera.infratec.scify import MainWindow as camera_ui
 from nottcontrol import config, sensor_config_path
 from nottcontrol.sensors import load_sensor_config
 from nottcontrol.components.motor import Motor
+from nottcontrol.commands.motion_command import execute_parallel
 from nottcontrol.shutters_window import ShutterWindow
 from nottcontrol.tiptilt_window import TipTiltWindow
 from nottcontrol.tip_tilt_control import TipTiltControl
@@ -101,6 +102,7 @@ class MainWindow(QMainWindow):
         self.opcua_conn.disconnect()
         self.t2.stop()
         self.opcua_conn_cry.disconnect()
+        self.redis_client.close()
         super().closeEvent(*args)
 
     def refresh_status(self):
@@ -298,10 +300,10 @@ class DelayLinesWindow(QMainWindow):
         configuration = self.saved_configurations[name]
         print(f'Loading DL positions: pos1: {configuration[0]}; pos2: {configuration[1]}; pos3: {configuration[2]}; pos4; {configuration[3]}')
 
-        self._motor1.command_move_absolute(configuration[0]).execute()
-        self._motor2.command_move_absolute(configuration[1]).execute()
-        self._motor3.command_move_absolute(configuration[2]).execute()
-        self._motor4.command_move_absolute(configuration[3]).execute()
+        execute_parallel([self._motor1.command_move_absolute(configuration[0]),
+                          self._motor2.command_move_absolute(configuration[1]),
+                          self._motor3.command_move_absolute(configuration[2]),
+                          self._motor4.command_move_absolute(configuration[3])])
 
     
     def startCameraRecording(self):
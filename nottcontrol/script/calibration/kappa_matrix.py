@@ -16,7 +16,7 @@ redis_url = 'redis://nott-server.ster.kuleuven.be:6379'
 # TODO: measure visibility
 # =============================================================================
 import nott_control
-from nott_database import define_time, get_field
+from nott_database import define_time, get_field, query_fields
 
     
 def build_kappa_matrix(delay, shutter_radiation, n_aper, fields, return_throughput):
@@ -92,7 +92,7 @@ def build_kappa_matrix(delay, shutter_radiation, n_aper, fields, return_throughp
         start, end = define_time(delay)
         time.sleep(delay) # Wait for the lag between the camera and the database
         
-        fluxes_shutters_closed = [get_field(elt, start, end, True)[1] for elt in fields]
+        fluxes_shutters_closed = query_fields(fields, start, end, "avg")[1][:,0] # Averaged by the server
         fluxes_shutters_closed = np.array(fluxes_shutters_closed)
 
         detbg_shutters_closed = fluxes_shutters_closed[-1] # Ambient thermal background and detector noise
@@ -105,7 +105,7 @@ def build_kappa_matrix(delay, shutter_radiation, n_aper, fields, return_throughp
         start, end = define_time(delay)    
         time.sleep(delay) # Wait for the lag between the camera and the database
 
-        fluxes = [get_field(elt, start, end, True)[1] for elt in fields]
+        fluxes = query_fields(fields, start, end, "avg")[1][:,0] # Averaged by the server
         fluxes = np.array(fluxes)
 
         detbg = fluxes[-1] # Ambient thermal background and detector noise
@@ -170,7 +170,7 @@ def get_shutter_radiation(n_aper, delay, fields):
         start, end = define_time(delay)
         time.sleep(delay) # Wait for the lag between the camera and the database
 
-        fluxes_bg = [get_field(elt, start, end, True)[1] for elt in fields]
+        fluxes_bg = query_fields(fields, start, end, "avg")[1][:,0] # Averaged by the server
         fluxes_bg = np.array(fluxes_bg)        
         shift_bg = fluxes_bg[-1]
         fluxes_bg = fluxes_bg[:-1]
@@ -182,7 +182,7 @@ def get_shutter_radiation(n_aper, delay, fields):
         start, end = define_time(delay)    
         time.sleep(delay)    # Wait for the lag between the camera and the database     
         
-        fluxes = [get_field(elt, start, end, True)[1] for elt in fields]
+        fluxes = query_fields(fields, start, end, "avg")[1][:,0] # Averaged by the server
         fluxes = np.array(fluxes)       
         detbg = fluxes[-1]
         fluxes = fluxes[:-1]
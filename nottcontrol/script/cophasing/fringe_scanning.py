@@ -8,7 +8,7 @@ from nott_control import move_abs_dl, read_current_pos, shutter_close
 from nott_figure import move_figure
 from nott_file import save_data
 from nott_fringes import fringes, fringes_env, envelop_detector
-from nott_database import define_time, get_field
+from nott_database import define_time, get_fields
 
 # Import functions
 import time
@@ -41,8 +41,8 @@ def do_scans(dl_name, dl_end_pos, speed, opcua_motor, field_of_interest, delay,
     time.sleep(wait_db)
     start, end = define_time(delay)
     time.sleep(wait_db)
-    data_IA = get_field(field_of_interest, start, end, return_avg_ts) # Output of the first stage coupler
-    dl_pos0 = get_field(dl_name, start, end, return_avg_ts)
+    # Output of the first stage coupler and DL position, in one round-trip
+    data_IA, dl_pos0 = get_fields([field_of_interest, dl_name], start, end, return_avg_ts)
 
     if revert_ts:
         data_IA = data_IA[::-1]
@@ -114,8 +114,8 @@ def set_dl_to_null(null_singlepass, opcua_motor, speed2, grab_range, dl_name, re
     time.sleep(wait_time)
     start, end = define_time(grab_range)
     time.sleep(wait_db)
-    to_null_pos = get_field(dl_name, start, end, return_avg_ts) # we only keep the position
-    to_null_flx = get_field(field_of_interest, start, end, return_avg_ts) # we keep both timestamp (in ms) and flux
+    # we only keep the position, and both timestamp (in ms) and flux
+    to_null_pos, to_null_flx = get_fields([dl_name, field_of_interest], start, end, return_avg_ts)
     current_null_pos = read_current_pos(opcua_motor) * 1000 # convert in um
     print('MSG - Reached position', current_null_pos)
     print('MSG - Gap position', current_null_pos - null_singlepass)
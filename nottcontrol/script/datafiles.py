@@ -1,15 +1,54 @@
 import numpy as np
 import os
+import threading
 
 class DataFiles:
-    def __init__(self, path):
+    # Files of the grids, relative to the data directory, by attribute name
+    files = {
         # Zemax-simulated inter-component distance grid
-        self.Dgrid = np.load(os.path.join(path,"TTMgrids/Dgrid.npy"))
+        "Dgrid": "TTMgrids/Dgrid.npy",
         # Absolute TTM angles by which the grid of distance values (Dgrid) is simulated
-        self.TTM1Xgrid = np.load(os.path.join(path, "TTMgrids/Grid_TTM1X.npy"))
-        self.TTM1Ygrid = np.load(os.path.join(path, "TTMgrids/Grid_TTM1Y.npy"))
-        self.TTM2Xgrid = np.load(os.path.join(path, "TTMgrids/Grid_TTM2X.npy"))
-        self.TTM2Ygrid = np.load(os.path.join(path, "TTMgrids/Grid_TTM2Y.npy"))
+        "TTM1Xgrid": "TTMgrids/Grid_TTM1X.npy",
+        "TTM1Ygrid": "TTMgrids/Grid_TTM1Y.npy",
+        "TTM2Xgrid": "TTMgrids/Grid_TTM2X.npy",
+        "TTM2Ygrid": "TTMgrids/Grid_TTM2Y.npy",
         # On-bench simulated accuracy grid (achieved-imposed) for positive/negative displacements
-        self.accurgrid_pos = np.load(os.path.join(path, "Grid_Accuracy_Pos.npy"))
-        self.accurgrid_neg = np.load(os.path.join(path, "Grid_Accuracy_Neg.npy"))
+        "accurgrid_pos": "Grid_Accuracy_Pos.npy",
+        "accurgrid_neg": "Grid_Accuracy_Neg.npy",
+    }
+    # Single-file bundle of all grids, read instead of the separate files when present in the data directory
+    bundle_name = "grids.npz"
+
+    def __init__(self, path, bundle=None):
+        """
+            Grids of the data directory {path}, each loaded on first access. Grids are memory-mapped read-only,
+        so that processes using them share the pages.
+        bundle : .npz file holding all grids by attribute name (see save_bundle), read instead of the separate files
+                 (default: bundle_name in {path}, if present). Grids of a bundle are read into memory, not memory-mapped.
+        """
+        self.path = path
+        if bundle is None and os.path.isfile(os.path.join(path, DataFiles.bundle_name)):
+            bundle = os.path.join(path, DataFiles.bundle_name)
+        self.bundle = bundle
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Only called for grids not loaded yet, loaded grids are instance attributes
+        if name not in DataFiles.files:
+            raise AttributeError(f"'DataFiles' object has no attribute '{name}'")
+        with self._lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = self._load(name)
+        return self.__dict__[name]
+
+    def _load(self, name):
+        if self.bundle is not None:
+            with np.load(self.bundle) as f:
+                return f[name]
+        return np.load(os.path.join(self.path, DataFiles.files[name]), mmap_mode="r")
+
+    def save_bundle(self, filename=None):
+        # Writes all grids to a single .npz bundle (default: bundle_name in the data directory)
+        if filename is None:
+            filename = os.path.join(self.path, DataFiles.bundle_name)
+        np.savez(filename, **{name: np.asarray(getattr(self, name)) for name in DataFiles.files})
@@ -56,14 +56,20 @@ import random
 import sys
 import time
 import logging
-
-# Scipy/Astropy (visible camera beam fitting)
-from astropy.modeling import models, fitting
+import hashlib
+import inspect
+import pickle
+import tempfile
+import threading
+from pathlib import Path
+from sympy import __version__ as sympy_version
+
+# Scipy/Astropy (visible camera beam fitting, astropy is imported in visible_camera_performance)
 import scipy
 
 # OPCUA / redis
 import redis
-from nottcontrol.opcua import OPCUAConnection
+from nottcontrol.opcua import OPCUAConnection, get_session
 # Silent messages from opcua every time a command is sent
 logger = logging.getLogger("asyncua")
 logger.setLevel(logging.WARNING)
@@ -71,12 +77,13 @@ logger.setLevel(logging.WARNING)
 from nottcontrol.components.motor import Motor
 # Functions for retrieving data from REDIS
 from nottcontrol.script.lib.nott_database import define_time
-from nottcontrol.script.lib.nott_database import get_field
+from nottcontrol.script.lib.nott_database import get_field, get_fields
+from nottcontrol.script.lib.nott_sampler import get_sampler
 # Shutter control
 from nottcontrol.script.lib.nott_control import all_shutters_close
 from nottcontrol.script.lib.nott_control import all_shutters_open
 from nottcontrol import config as nott_config
-from nottcontrol.script import data_files
+from nottcontrol.script.lib.nott_TTM_grids import distance_grid, accuracy_grid
 
 #-----------------------------#
 # Parameters from config file #
@@ -97,6 +104,196 @@ step_double = float(nott_config['injection']['step_double'])
 speed_double = float(nott_config['injection']['speed_double'])
 print("Read configuration [t_write,bool_UT,bool_offset,fac_loc,SNR_inj,Ncrit,Nsteps_skyb,Nexp,disp_double,step_double,speed_double] : ",[t_write,bool_UT,bool_offset,fac_loc,SNR_inj,Ncrit,Nsteps_skyb,Nexp,disp_double,step_double,speed_double])
 
+#------------------------#
+# Zemax parameter values #
+#------------------------#
+
+# Slicer quantities (mm) (Zemax)
+Rsli = 96.644
+fsli = -Rsli / 2
+# OAP focal lengths (mm) (Garreau et al. 2024)
+fOAP1 = 629.2 
+fOAP2 = 262.17
+# Lens thicknesses (mm) (Zemax)
+dinj = 10 
+dcryo = 4
+# Lens refractive indices in wavelength channels (Literature)
+niarr = [2.4189, 2.4176, 2.4168] 
+ncarr = [1.4140, 1.4115, 1.4096]
+# Injection lens curvature radius (front surface)
+Rinj = 28.195
+# Optical power front injection lens surface (1/mm)
+Parr = (niarr - np.ones(3)) / Rinj
+
+def _framework_values(D,lam):
+    # Numeric values of the framework parameters (D1,...,D8,di,dc,ni,nc,P1,f1,f2,fsl), for distances D and wavelength channel lam
+    return (*np.asarray(D,dtype=np.float64),dinj,dcryo,niarr[lam],ncarr[lam],Parr[lam],fOAP1,fOAP2,fsli)
+
+
+#----------------------#
+# Symbolic framework   |
+#----------------------#
+# Directory of the on-disk cache of the symbolic framework (empty: user cache directory)
+framework_cache_dir = nott_config['injection'].get('framework_cache_dir', '') or str(Path.home().joinpath(".cache","nottcontrol"))
+
+def _symbolic_framework():
+    """
+    Chains the component transformations encountered by a beam (see alignment), independently for the transverse X and Y dimensions.
+    Returns the framework (M,b,N) : b=Ma, with a the angular offsets (a1Y,a1X,a2Y,a2X) and b the shifts (X,Y,x,y),
+    and N the four shifts as expressions of the angular offsets. Takes about a minute, mostly simplifying.
+    """
+    #-------------#
+    # (1) Symbols #
+    #-------------#
+    X,x,Y,y = symbols("X x Y y")
+    a1X,a2X,a1Y,a2Y = symbols("a_1^X a_2^X a_1^Y a_2^Y") 
+    D1, D2, D3, D4, D5, D6, D7, D8 = symbols("D_1 D_2 D_3 D_4 D_5 D_6 D_7 D_8")
+    di, dc, ni, nc, P1, f1, f2, fsl = symbols("d_i d_c n_i n_c P_1 f_{OAP_1} f_{OAP_2} f_{sl}")
+    
+    #-------------------------------#
+    # (2) Component transformations #
+    #-------------------------------#
+    def Translation(D, M):
+        return Matrix([[1, D],[0, 1]]) * M 
+    def TTM(a, M):
+        return -M + Matrix([[0],[2*a]])
+    def ThinLens(f, nv, nprimv, M):
+        return Matrix([[1,0],[-1/f,nv/nprimv]])*M
+    def ThickLens(p1, p2, dv, nv, nprimv, n2v, M):
+        return Matrix([[1-p1*dv/n2v, nv*dv/n2v],[-p1/nprimv - p2/nprimv + p1*p2*dv / (nprimv * n2v), (1 - p2*dv / n2v)*(nv/nprimv)]])*M
+    
+    #------------------------------#
+    # (3) Chaining transformations #
+    #------------------------------#
+    # Initial state
+    initX = Matrix([[0], [0]])
+    initY = Matrix([[0], [0]])
+    # TTM1
+    M1X = TTM(a1Y,initX)
+    M1Y = TTM(a1X,initY)
+    # Translation (delay lines)
+    M2X = -Translation(D1,M1X)
+    M2Y = Translation(D1,M1Y)
+    # TTM2
+    M3X = TTM(a2Y,M2X)
+    M3Y = TTM(a2X,M2Y)
+    # Translation
+    M4X = Translation(D2,M3X)
+    M4Y = Translation(D2,M3Y)
+    # OAP1
+    M5X = -ThinLens(f1, 1, 1, M4X)
+    M5Y = -ThinLens(f1, 1, 1, M4Y)
+    # Translation (mirrors)
+    M6X = -Translation(D3, M5X)
+    M6Y = -Translation(D3, M5Y)
+    # Slicer
+    M7X = -ThinLens(fsl, 1, 1, M6X)
+    M7Y = -ThinLens(fsl, 1, 1, M6Y)
+    # Translation 
+    M8X = Translation(D4, M7X)
+    M8Y = Translation(D4, M7Y)
+    # OAP2
+    M9X = -ThinLens(f2, 1, 1, M8X)
+    M9Y = -ThinLens(f2, 1, 1, M8Y)
+    # Translation
+    M10X = Translation(D5, M9X)
+    M10Y = Translation(D5, M9Y)
+    # Cryostat lens
+    M11X = ThickLens(0, 0, dc, 1, 1, nc, M10X)
+    M11Y = ThickLens(0, 0, dc, 1, 1, nc, M10Y)
+    # Translation
+    M12X = Translation(D6, M11X)
+    M12Y = Translation(D6, M11Y)
+    ###################
+    # Cold stop plane #
+    ###################
+    # Translation
+    M13X = Translation(D7, M12X)
+    M13Y = Translation(D7, M12Y)
+    # Injection Lens
+    M14X = ThickLens(P1, 0, di, 1, 1, ni, M13X)
+    M14Y = ThickLens(P1, 0, di, 1, 1, ni, M13Y)
+    # Translation
+    M15X = Translation(D8, M14X)
+    M15Y = Translation(D8, M14Y)
+    ###############
+    # Image Plane #
+    ###############
+    # Matrices M12 and M15 now contain shifts and offsets in the cold stop pupil and the image plane respectively.
+    M12X = M12X.applyfunc(simplify)
+    M15X = M15X.applyfunc(simplify)
+    M12Y = M12Y.applyfunc(simplify)
+    M15Y = M15Y.applyfunc(simplify)
+    
+    #-------------#
+    # (4) Merging #
+    #-------------#
+    eqns = [M12X[0]-X,M12Y[0]-Y,M15X[0]-x,M15Y[0]-y]
+    
+    Mloc, bloc = linear_eq_to_matrix(eqns, [a1Y,a1X,a2Y,a2X])
+    
+    eqns_ = [M12X[0],M12Y[0],M15X[0],M15Y[0]]
+    
+    return Mloc, bloc, eqns_
+
+def _framework_symbols():
+    # Framework parameters, in the order of _framework_values
+    return symbols("D_1 D_2 D_3 D_4 D_5 D_6 D_7 D_8 d_i d_c n_i n_c P_1 f_{OAP_1} f_{OAP_2} f_{sl}")
+
+def _load_framework():
+    """
+    Symbolic framework (M,b,N), from the on-disk cache if present, otherwise built by _symbolic_framework and cached.
+    Cache files are keyed by a hash of the model definition (the source of _symbolic_framework) and of the SymPy version,
+    so a change of either builds the framework anew.
+    """
+    key = hashlib.sha256((inspect.getsource(_symbolic_framework)+sympy_version).encode()).hexdigest()[:16]
+    path = Path(framework_cache_dir).joinpath(f"ttm_framework_{key}.pkl")
+    try:
+        with open(path,"rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Failed to load the cached symbolic framework {path} ({e}), defining it anew.")
+    print("Defining symbolic framework...")
+    framework = _symbolic_framework()
+    try:
+        path.parent.mkdir(parents=True,exist_ok=True)
+        # Written to a file unique to this writer and renamed, so that concurrent processes never see (or write) a partial file
+        with tempfile.NamedTemporaryFile(dir=path.parent,prefix=path.stem,suffix=".tmp",delete=False) as f:
+            tmp_path = Path(f.name)
+            pickle.dump(framework,f)
+        tmp_path.replace(path)
+    except OSError as e:
+        print(f"Failed to cache the symbolic framework to {path} ({e}).")
+    return framework
+
+# REDIS field names of the photometric outputs' ROIs (by configuration), of the background ROI and of the camera clock
+photo_fields = ["roi8_avg","roi7_avg","roi2_avg","roi1_avg"]
+noise_field = "roi9_avg"
+clock_field = "cam_integtime"
+
+# Amount of numeric framework matrices memoized by alignment._framework_matrix
+M_cache_size = 256
+
+# Framework (M,b,N,M_numeric), shared by all alignment objects of the process, loaded on first use
+_framework = None
+_framework_lock = threading.Lock()
+
+def get_framework():
+    """
+    Returns the symbolic framework (M,b,N) and the matrix M compiled into a NumPy function of the parameter values
+    (see _framework_values), loading them on first use.
+    """
+    global _framework
+    with _framework_lock:
+        if _framework is None:
+            M,b,N = _load_framework()
+            # Numeric evaluations solve b=Ma with NumPy, instead of substituting, inverting and lambdifying symbolically
+            M_numeric = lambdify(_framework_symbols(),M,modules="numpy")
+            _framework = (M,b,N,M_numeric)
+        return _framework
+
 class alignment:
      
     def __init__(self):
@@ -133,109 +330,15 @@ class alignment:
                    
         Defines
         -------
-        The function initializes global variables M, N and b, which are then used in numeric framework evaluations.
+        Steps (1) to (6) are carried out by _symbolic_framework, upon first use of M, N or b (see get_framework).
+        The framework is cached on disk, so it is only derived again when its definition changes.
         M : (4,4) matrix of symbolic Sympy expressions
         N : (1,4) matrix of symbolic Sympy expressions
         b : (4,1) matrix of symbolic Sympy expressions
                    
         """
-        print("Defining symbolic framework...")
-        #-------------#
-        # (1) Symbols #
-        #-------------#
-        X,x,Y,y = symbols("X x Y y")
-        a1X,a2X,a1Y,a2Y = symbols("a_1^X a_2^X a_1^Y a_2^Y") 
-        D1, D2, D3, D4, D5, D6, D7, D8 = symbols("D_1 D_2 D_3 D_4 D_5 D_6 D_7 D_8")
-        di, dc, ni, nc, P1, f1, f2, fsl = symbols("d_i d_c n_i n_c P_1 f_{OAP_1} f_{OAP_2} f_{sl}")
-        
-        #-------------------------------#
-        # (2) Component transformations #
-        #-------------------------------#
-        def Translation(D, M):
-            return Matrix([[1, D],[0, 1]]) * M 
-        def TTM(a, M):
-            return -M + Matrix([[0],[2*a]])
-        def ThinLens(f, nv, nprimv, M):
-            return Matrix([[1,0],[-1/f,nv/nprimv]])*M
-        def ThickLens(p1, p2, dv, nv, nprimv, n2v, M):
-            return Matrix([[1-p1*dv/n2v, nv*dv/n2v],[-p1/nprimv - p2/nprimv + p1*p2*dv / (nprimv * n2v), (1 - p2*dv / n2v)*(nv/nprimv)]])*M
-        
-        #------------------------------#
-        # (3) Chaining transformations #
-        #------------------------------#
-        # Initial state
-        initX = Matrix([[0], [0]])
-        initY = Matrix([[0], [0]])
-        # TTM1
-        M1X = TTM(a1Y,initX)
-        M1Y = TTM(a1X,initY)
-        # Translation (delay lines)
-        M2X = -Translation(D1,M1X)
-        M2Y = Translation(D1,M1Y)
-        # TTM2
-        M3X = TTM(a2Y,M2X)
-        M3Y = TTM(a2X,M2Y)
-        # Translation
-        M4X = Translation(D2,M3X)
-        M4Y = Translation(D2,M3Y)
-        # OAP1
-        M5X = -ThinLens(f1, 1, 1, M4X)
-        M5Y = -ThinLens(f1, 1, 1, M4Y)
-        # Translation (mirrors)
-        M6X = -Translation(D3, M5X)
-        M6Y = -Translation(D3, M5Y)
-        # Slicer
-        M7X = -ThinLens(fsl, 1, 1, M6X)
-        M7Y = -ThinLens(fsl, 1, 1, M6Y)
-        # Translation 
-        M8X = Translation(D4, M7X)
-        M8Y = Translation(D4, M7Y)
-        # OAP2
-        M9X = -ThinLens(f2, 1, 1, M8X)
-        M9Y = -ThinLens(f2, 1, 1, M8Y)
-        # Translation
-        M10X = Translation(D5, M9X)
-        M10Y = Translation(D5, M9Y)
-        # Cryostat lens
-        M11X = ThickLens(0, 0, dc, 1, 1, nc, M10X)
-        M11Y = ThickLens(0, 0, dc, 1, 1, nc, M10Y)
-        # Translation
-        M12X = Translation(D6, M11X)
-        M12Y = Translation(D6, M11Y)
-        ###################
-        # Cold stop plane #
-        ###################
-        # Translation
-        M13X = Translation(D7, M12X)
-        M13Y = Translation(D7, M12Y)
-        # Injection Lens
-        M14X = ThickLens(P1, 0, di, 1, 1, ni, M13X)
-        M14Y = ThickLens(P1, 0, di, 1, 1, ni, M13Y)
-        # Translation
-        M15X = Translation(D8, M14X)
-        M15Y = Translation(D8, M14Y)
-        ###############
-        # Image Plane #
-        ###############
-        # Matrices M12 and M15 now contain shifts and offsets in the cold stop pupil and the image plane respectively.
-        M12X = M12X.applyfunc(simplify)
-        M15X = M15X.applyfunc(simplify)
-        M12Y = M12Y.applyfunc(simplify)
-        M15Y = M15Y.applyfunc(simplify)
-        
-        #-------------#
-        # (4) Merging #
-        #-------------#
-        eqns = [M12X[0]-X,M12Y[0]-Y,M15X[0]-x,M15Y[0]-y]
-        
-        Mloc, bloc = linear_eq_to_matrix(eqns, [a1Y,a1X,a2Y,a2X])
-        
-        eqns_ = [M12X[0],M12Y[0],M15X[0],M15Y[0]]
-        
-        # Defining framework 
-        self.M = Mloc.copy()
-        self.b = bloc.copy()
-        self.N = eqns_.copy()
+        # Numeric matrix M and its inverse, by (distances, wavelength channel)
+        self._M_cache = {}
         
         # Defining actuator positions corresponding to an aligned & injecting state.
         self.act_pos_align = np.array([[4.1507145,4.6841595,4.8155535,3.714595],[3.6502095,3.4818495,4.5511795,3.8486425],[4.3360325,4.716886,4.754462,3.167242],[4.8310475,4.6418865,4.88122,4.0027285]],dtype=np.float64)
@@ -246,9 +349,8 @@ class alignment:
         
         # Preparing actuators for use
         print("Preparing actuators...")
-        # Opening OPCUA connection
-        opcua_conn = OPCUAConnection(url)
-        opcua_conn.connect()
+        # Shared OPCUA session
+        opcua_conn = get_session(url)
         
         # Looping over all configurations
         for j in range(1, 5):
@@ -275,10 +377,23 @@ class alignment:
                 time.sleep(0.050)
         
         self.align()
-        
-        # Closing OPCUA connection
-        opcua_conn.disconnect()
         '''
+    @property
+    def M(self):
+        return get_framework()[0]
+    
+    @property
+    def b(self):
+        return get_framework()[1]
+    
+    @property
+    def N(self):
+        return get_framework()[2]
+    
+    @property
+    def M_numeric(self):
+        return get_framework()[3]
+    
     #-------------------------------#
     # Numeric Framework Evaluations #
     #-------------------------------#
@@ -307,59 +422,16 @@ class alignment:
         -------
         ttm_offsets_flip : (1,4) numpy array of floats (radian)
         The angular TTM offsets (dTTM1X,dTTM1Y,dTTM2X,dTTM2Y) necessary to achieve the input shifts 
+        Do note : A (K,4) batch of shifts returns a (K,4) batch of offsets.
             
         """
-        # Symbols
-        X,x,Y,y = symbols("X x Y y")
-        a1X,a2X,a1Y,a2Y = symbols("a_1^X a_2^X a_1^Y a_2^Y") 
-        D1, D2, D3, D4, D5, D6, D7, D8 = symbols("D_1 D_2 D_3 D_4 D_5 D_6 D_7 D_8")
-        di, dc, ni, nc, P1, f1, f2, fsl = symbols("d_i d_c n_i n_c P_1 f_{OAP_1} f_{OAP_2} f_{sl}")
-        
-        #------------------------#
-        # Zemax parameter values #
-        #------------------------#
-        
-        # Slicer quantities (mm) (Zemax)
-        Rsli = 96.644
-        fsli = -Rsli / 2
-        # OAP focal lengths (mm) (Garreau et al. 2024)
-        fOAP1 = 629.2 
-        fOAP2 = 262.17
-        # Lens thicknesses (mm) (Zemax)
-        dinj = 10 
-        dcryo = 4
-        # Lens refractive indices in wavelength channels (Literature)
-        niarr = [2.4189, 2.4176, 2.4168] 
-        ncarr = [1.4140, 1.4115, 1.4096]
-        # Injection lens curvature radius (front surface)
-        Rinj = 28.195
-        # Optical power front injection lens surface (1/mm)
-        Parr = (niarr - np.ones(3)) / Rinj
-        
-        # Copy of symbolic framework
-        Mcopy = self.M.copy()
-        bcopy = self.b.copy()
-        # Substituting parameter values into the symbolic matrix
-        subspar = [(D1,D[0]),(D2,D[1]),(D3,D[2]),(D4,D[3]),(D5,D[4]),(D6,D[5]),(D7,D[6]),(D8,D[7]),(di,dinj),(dc,dcryo),(ni,niarr[lam]),(nc,ncarr[lam]),(P1,Parr[lam]),(f1,fOAP1),(f2,fOAP2),(fsl,fsli)]
-        Mcopy = Mcopy.subs(subspar)
-        
-        # Inverting the (now numeric) matrix 
-        Minv = Mcopy.inv()
-        
-        # Multiplying by symbolic shifts 
-        frame = Minv*bcopy
-        
-        # Parameters
-        params = (X,Y,x,y)
-        
-        # Lambdify
-        f = lambdify(params,frame.T.tolist()[0], modules="numpy")
-        
-        # Numeric evaluation
-        ttm_offsets = f(shifts[0],shifts[1],shifts[2],shifts[3])
+        M,Minv = self._framework_matrix(D,lam)
+        
+        # Angular offsets (dTTM1Y,dTTM1X,dTTM2Y,dTTM2X) = Minv (X,Y,x,y), for one (4,) or a batch (K,4) of shifts
+        ttm_offsets = np.asarray(shifts,dtype=np.float64) @ Minv.T
         
         # Flipping X and Y angles to comply with function output
-        ttm_offsets_flip = np.array([ttm_offsets[1],ttm_offsets[0],ttm_offsets[3],ttm_offsets[2]],dtype=np.float64)
+        ttm_offsets_flip = ttm_offsets[...,[1,0,3,2]]
         
         return ttm_offsets_flip
     
@@ -386,39 +458,10 @@ class alignment:
             Induced positional shifts in CS/IM planes (X,Y,x,y).
 
         """
-        # Symbols
-        X,x,Y,y = symbols("X x Y y")
-        a1X,a2X,a1Y,a2Y = symbols("a_1^X a_2^X a_1^Y a_2^Y") 
-        D1, D2, D3, D4, D5, D6, D7, D8 = symbols("D_1 D_2 D_3 D_4 D_5 D_6 D_7 D_8")
-        di, dc, ni, nc, P1, f1, f2, fsl = symbols("d_i d_c n_i n_c P_1 f_{OAP_1} f_{OAP_2} f_{sl}")
-        
-        #------------------------#
-        # Zemax parameter values #
-        #------------------------#
-        
-        # Slicer quantities (mm) (Zemax)
-        Rsli = 96.644
-        fsli = -Rsli / 2
-        # OAP focal lengths (mm) (Garreau et al. 2024)
-        fOAP1 = 629.2 
-        fOAP2 = 262.17
-        # Lens thicknesses (mm) (Zemax)
-        dinj = 10 
-        dcryo = 4
-        # Lens refractive indices in wavelength channels (Literature)
-        niarr = [2.4189, 2.4176, 2.4168] 
-        ncarr = [1.4140, 1.4115, 1.4096]
-        # Injection lens curvature radius (front surface)
-        Rinj = 28.195
-        # Optical power front injection lens surface (1/mm)
-        Parr = (niarr - np.ones(3)) / Rinj
-        
-        # Copy of symbolic framework
-        Ncopy = self.N.copy()
-        
-        # Substituting parameter values into the symbolic matrix
-        subspar = [(D1,D[0]),(D2,D[1]),(D3,D[2]),(D4,D[3]),(D5,D[4]),(D6,D[5]),(D7,D[6]),(D8,D[7]),(di,dinj),(dc,dcryo),(ni,niarr[lam]),(nc,ncarr[lam]),(P1,Parr[lam]),(f1,fOAP1),(f2,fOAP2),(fsl,fsli),(a1X,ttm_offsets[0]),(a1Y,ttm_offsets[1]),(a2X,ttm_offsets[2]),(a2Y,ttm_offsets[3])]
-        shifts = np.array([Ncopy[0].subs(subspar),Ncopy[1].subs(subspar),Ncopy[2].subs(subspar),Ncopy[3].subs(subspar)],dtype=np.float64)
+        M,_ = self._framework_matrix(D,lam)
+        
+        # Shifts (X,Y,x,y) = M (dTTM1Y,dTTM1X,dTTM2Y,dTTM2X), for one (4,) or a batch (K,4) of offsets
+        shifts = np.asarray(ttm_offsets,dtype=np.float64)[...,[1,0,3,2]] @ M.T
         
         return shifts
     
@@ -460,69 +503,39 @@ class alignment:
             The shifts that come at the cost of inducing the TTM angles.
             
         """
-        # Symbols
-        X,x,Y,y = symbols("X x Y y")
-        a1X,a2X,a1Y,a2Y = symbols("a_1^X a_2^X a_1^Y a_2^Y") 
-        D1, D2, D3, D4, D5, D6, D7, D8 = symbols("D_1 D_2 D_3 D_4 D_5 D_6 D_7 D_8")
-        di, dc, ni, nc, P1, f1, f2, fsl = symbols("d_i d_c n_i n_c P_1 f_{OAP_1} f_{OAP_2} f_{sl}")
-        
-        #------------------------#
-        # Zemax parameter values #
-        #------------------------#
-        
-        # Slicer quantities (mm) (Zemax)
-        Rsli = 96.644
-        fsli = -Rsli / 2
-        # OAP focal lengths (mm) (Garreau et al. 2024)
-        fOAP1 = 629.2 
-        fOAP2 = 262.17
-        # Lens thicknesses (mm) (Zemax)
-        dinj = 10 
-        dcryo = 4
-        # Lens refractive indices in wavelength channels (Literature)
-        niarr = [2.4189, 2.4176, 2.4168] 
-        ncarr = [1.4140, 1.4115, 1.4096]
-        # Injection lens curvature radius (front surface)
-        Rinj = 28.195
-        # Optical power front injection lens surface (1/mm)
-        Parr = (niarr - np.ones(3)) / Rinj
-        
-        # Copy of symbolic framework
-        Mcopy = self.M.copy()
-        
-        # Substituting parameter values into the symbolic matrix
-        subspar = np.array([(D1,D[0]),(D2,D[1]),(D3,D[2]),(D4,D[3]),(D5,D[4]),(D6,D[5]),(D7,D[6]),(D8,D[7]),(di,dinj),(dc,dcryo),(ni,niarr[lam]),(nc,ncarr[lam]),(P1,Parr[lam]),(f1,fOAP1),(f2,fOAP2),(fsl,fsli)])
-        Mcopy = Mcopy.subs(subspar)
-        
-        # Inverting the (now numeric) matrix
-        frame = Mcopy.inv()
-        
-        # Evaluating
-        c = Matrix([dTTM1Y,dTTM1X,a2Y,a2X])
-        
-        # Sol contains (X,Y,x,y) pupil and image plane positions as a function of TTM2X and TTM2Y offsets
-        sol = frame.solve(c)
-        
-        if CS:
-            dTTM2X = list(solveset(sol[1],a2X).args)[0]
-            dTTM2Y = list(solveset(sol[0],a2Y).args)[0]
-            x = sol[2].subs(np.array([(a2X,dTTM2X),(a2Y,dTTM2Y)]))
-            y = sol[3].subs(np.array([(a2X,dTTM2X),(a2Y,dTTM2Y)]))
-                            
-            ttm_offsets = np.array([dTTM1X,dTTM1Y,dTTM2X,dTTM2Y],dtype=np.float64)
-            shifts = np.array([0,0,x,y],dtype=np.float64)
-            
-            return ttm_offsets,shifts
-        else:
-            dTTM2X = list(solveset(sol[3],a2X).args)[0]
-            dTTM2Y = list(solveset(sol[2],a2Y).args)[0]
-            X = sol[0].subs(np.array([(a2X,dTTM2X),(a2Y,dTTM2Y)]))
-            Y = sol[1].subs(np.array([(a2X,dTTM2X),(a2Y,dTTM2Y)]))
-                            
-            ttm_offsets = np.array([dTTM1X,dTTM1Y,dTTM2X,dTTM2Y],dtype=np.float64)
-            shifts = np.array([X,Y,0,0],dtype=np.float64)
-            
-            return ttm_offsets,shifts
+        M,_ = self._framework_matrix(D,lam)
+        
+        # Shifts are linear in the offsets : (X,Y,x,y) = M[:,:2] (dTTM1Y,dTTM1X) + M[:,2:] (dTTM2Y,dTTM2X)
+        ttm1 = np.stack([np.asarray(dTTM1Y,dtype=np.float64),np.asarray(dTTM1X,dtype=np.float64)],axis=-1)
+        shifts_ttm1 = ttm1 @ M[:,:2].T
+        # Plane kept unchanged : cold stop (X,Y) or image (x,y)
+        fixed = [0,1] if CS else [2,3]
+        # TTM2 offsets (dTTM2Y,dTTM2X) cancelling the TTM1 shifts in that plane
+        ttm2 = -shifts_ttm1[...,fixed] @ np.linalg.inv(M[fixed,2:]).T
+        shifts = shifts_ttm1 + ttm2 @ M[:,2:].T
+        shifts[...,fixed] = 0
+        
+        ttm_offsets = np.stack([ttm1[...,1],ttm1[...,0],ttm2[...,1],ttm2[...,0]],axis=-1)
+        
+        return ttm_offsets,shifts
+    
+    def _framework_matrix(self,D,lam=1):
+        """
+        Description
+        -----------
+        Numeric framework matrix M (b=Ma, with a=(dTTM1Y,dTTM1X,dTTM2Y,dTTM2X) and b=(X,Y,x,y)) and its inverse,
+        for the distances D of a distance grid point and wavelength channel lam.
+        Matrices are memoized per (D,lam), keeping the latest M_cache_size ones (D only changes when the TTMs move).
+        """
+        key = (tuple(np.asarray(D,dtype=np.float64).tolist()),lam)
+        matrices = self._M_cache.get(key)
+        if matrices is None:
+            M = np.array(self.M_numeric(*_framework_values(D,lam)),dtype=np.float64)
+            if len(self._M_cache) >= M_cache_size:
+                # Dropping the oldest entry
+                del self._M_cache[next(iter(self._M_cache))]
+            matrices = self._M_cache[key] = (M,np.linalg.inv(M))
+        return matrices
         
     #######################
     # Auxiliary Functions #
@@ -590,8 +603,8 @@ class alignment:
         """
         Description
         -----------
-        For a given set of TTM angles, corresponding to a reference configuration, the 
-        closest point in the Zemax simulated grid is found and its corresponding distance is returned. 
+        For a given set of TTM angles, corresponding to a reference configuration, the Zemax-simulated
+        distances are interpolated (multilinearly) between the surrounding grid points (see nott_TTM_grids). 
 
         Auxiliary
         ---------
@@ -605,11 +618,11 @@ class alignment:
         Remarks
         -------
         The grid is simulated for an approximate range of absolute angles of pm 1000 microrad for TTM1 and pm 500 microrad for TTM2. 
-        As of now, no TTM angles beyond these values are supported.
+        As of now, no TTM angles beyond these values are supported (the distances of the edge of the grid are returned).
             
         Parameters
         ----------
-        ttm_angles : (1,4) numpy array of floats
+        ttm_angles : (1,4) numpy array of floats, or (N,4) for N sets of angles
             TTM angles (TTM1X,TTM1Y,TTM2X,TTM2Y)
         config : single integer
             Configuration number (= VLTI input beam) (0,1,2,3).
@@ -617,20 +630,12 @@ class alignment:
 
         Returns
         -------
-        D_snap : (1,8) numpy array of float values (mm)
-            An array of Zemax-simulated distances (D1,...,D8) corresponding to the grid point closest to ttm_angles
+        D_snap : (1,8) numpy array of float values (mm), or (N,8)
+            An array of Zemax-simulated distances (D1,...,D8), interpolated at ttm_angles
 
         """
         
-        if (config < 0 or config > 3):
-            raise ValueError("Please enter a valid configuration number (0,1,2,3)")
-    
-        a = np.argmin(np.abs(data_files.TTM1Ygrid[config] - ttm_angles[1]))
-        b = np.argmin(np.abs(data_files.TTM2Ygrid[config] - ttm_angles[3]))
-        c = np.argmin(np.abs(data_files.TTM1Xgrid[config] - ttm_angles[0]))
-        d = np.argmin(np.abs(data_files.TTM2Xgrid[config] - ttm_angles[2]))
-        
-        D_snap = data_files.Dgrid[config,:,a,b,c,d]
+        D_snap = distance_grid()(ttm_angles,config)
   
         return D_snap
 
@@ -638,10 +643,9 @@ class alignment:
         """
         Description
         -----------
-        For given actuators speeds and displacements, linear interpolation of the closest four accuracy grid points is performed to 
-        return an accuracy value for each of the four actuators.
+        For given actuators speeds and displacements, bilinear interpolation of the surrounding four accuracy grid points
+        (see nott_TTM_grids) returns an accuracy value for each of the four actuators.
         Note : For points outside of the simulated grid ranges, the function returns the accuracy of the closest, edge grid point.
-        This approach is incomplete. This function is never called for points outside of the simulated grid.
     
         Auxiliary
         ---------
@@ -649,7 +653,8 @@ class alignment:
             Simulated accuracies (achieved minus imposed position, obtained using NTPB2) for positive displacements.
         accurgrid_neg : (1,21,21) numpy matrix of float values (mm)
             Simulated accuracies (achieved minus imposed position, obtained using NTPB2) for negative displacements.
-        disp_range and speed_range indicate the displacements and speeds by which these auxiliary accuracy grids were simulated.
+        The displacements and speeds by which these auxiliary accuracy grids were simulated are 
+        nott_TTM_grids.accuracy_disp_axis and accuracy_speed_axis.
         
         Parameters
         ----------
@@ -661,84 +666,11 @@ class alignment:
         Returns
         -------
         a_snap : (1,4) numpy array of floats (mm)
-            Accuracy value for each actuator, obtained by linear interpolation.
+            Accuracy value for each actuator, obtained by linear interpolation (zero for actuators that are not moved).
 
         """
         
-        # Container array for accuracies
-        a_snap = np.zeros(len(speed))
-        # Looping over all four actuators 
-        for i in range(0, len(speed)):
-            if disp[i] != 0:
-                # Sign of displacement
-                sign = np.sign(disp[i])
-                # Simulation ranges of grid
-                disp_range = sign*np.geomspace(0.0005,0.025,21) 
-                speed_range = np.geomspace(0.0005/100,0.025,21) 
-                # Determining indices (i1,j1) of closest neighbouring grid point
-                disp_diff = np.abs(disp_range - disp[i])
-                speed_diff = np.abs(speed_range - speed[i])
-                i1 = np.argmin(disp_diff)
-                j1 = np.argmin(speed_diff)
-                # Determining indices (i2,j2) of second closest neighbouring grid point
-                
-                # 1) Displacement
-                # Point is right of closest grid point...
-                if np.abs(disp[i]) > np.abs(disp_range[i1]):
-                    # ... and beyond the grid range:
-                    if (i1 == len(disp_range)-1):
-                        i2 = i1
-                    # ... and within the grid range:
-                    else:
-                        i2 = i1+1
-                # Left of closest grid point...
-                elif np.abs(disp[i]) < np.abs(disp_range[i1]):
-                    # ... and beyond the grid range:
-                    if (i1 == 0):
-                        i2 = i1
-                    # ... and within the grid range:
-                    else:
-                        i2 = i1-1
-                # On grid point
-                elif disp[i] == disp_range[i1]:
-                    i2 = i1
-                    
-                # 2) Speed
-                if speed[i] > speed_range[j1]:
-                    if (j1 == len(speed_range)-1):
-                        j2 = j1
-                    else:
-                        j2 = j1+1
-                elif speed[i] < speed_range[j1]:
-                    if (j1 == 0):
-                        j2 = j1
-                    else:
-                        j2 = j1-1
-                elif speed[i] == speed_range[j1]:
-                    j2 = j1
-    
-                # Weights 
-                if (i1==i2):
-                    v1,v2 = [0.5,0.5]
-                else:
-                    v2,v1 = [disp_diff[i1],disp_diff[i2]]/(disp_diff[i1]+disp_diff[i2])
-                if (j1==j2):
-                    w1,w2 = [0.5,0.5]
-                else:
-                    w2,w1 = [speed_diff[j1],speed_diff[j2]]/(speed_diff[j1]+speed_diff[j2]) 
-                # Interpolation
-                if sign > 0:
-                    # Accuracy interpolation
-                    a_disp = v1*data_files.accurgrid_pos[i1,j1]+v2*data_files.accurgrid_pos[i2,j1]
-                    a_speed = w1*data_files.accurgrid_pos[i1,j1]+w2*data_files.accurgrid_pos[i1,j2]
-                    # Average
-                    a_snap[i] = (a_disp+a_speed)/2
-                if sign < 0:
-                    # Accuracy interpolation
-                    a_disp = v1*data_files.accurgrid_neg[i1,j1]+v2*data_files.accurgrid_neg[i2,j1]
-                    a_speed = w1*data_files.accurgrid_neg[i1,j1]+w2*data_files.accurgrid_neg[i1,j2]
-                    # Average
-                    a_snap[i] = (a_disp+a_speed)/2
+        a_snap = accuracy_grid()(speed,disp)
         
         return a_snap
 
@@ -766,16 +698,13 @@ class alignment:
         if (config < 0 or config > 3):
             raise ValueError("Please enter a valid configuration number (0,1,2,3)")
     
-        # Opening OPCUA connection
-        opcua_conn = OPCUAConnection(url)
-        opcua_conn.connect()
+        # Shared OPCUA session
+        opcua_conn = get_session(url)
         # Retrieving actuator positions via OPCUA 
         act_names = ['NTTA'+str(config+1),'NTPA'+str(config+1),'NTTB'+str(config+1),'NTPB'+str(config+1)]
         node_ids = ['ns=4;s=MAIN.nott_ics.TipTilt.'+name+'.stat.lrPosActual' for name in act_names]
         pos = np.array(opcua_conn.read_nodes(node_ids),dtype=np.float64)
         timestamp = round(1000*time.time())
-        # Closing OPCUA connection
-        opcua_conn.disconnect()
         
         return [pos,timestamp]
     
@@ -988,6 +917,16 @@ class alignment:
         
         return accur_snap
 
+    def _get_sampler(self):
+        """
+        Description
+        -----------
+        Returns the background sampler of the photometric, background and camera clock redis fields (see nott_sampler),
+        shared by the process. ROI values are then read from memory instead of querying redis for every exposure.
+        The sampler only polls redis while exposures are read, during spirals.
+        """
+        return get_sampler(photo_fields+[noise_field,clock_field])
+
     def _get_delay(self,N,average): 
         '''
         Description
@@ -998,11 +937,12 @@ class alignment:
             1) The camera takes some time to write its ROI values to redis : on the order of 10 ms.
             2) The internal Infratec camera drifts with time. It seems to tick slower than the Windows lab pc time.
         This function quantifies the delay time, originating from a combination of 1) and 2).
+        The delays are those of the latest N polls of the background sampler (see _get_sampler).
         
         Parameters
         ----------
         N : single integer
-            Amount of samples to perform.
+            Amount of samples to use.
         average : single boolean
             If True : return the average delay of N samples.
             If False : return the maximum delay of N samples.
@@ -1014,16 +954,11 @@ class alignment:
 
         '''
         
-        delays = []
-        for i in range(0, N):
-            # Defining a python timeframe (1 second back in time)
-            t_start,t_stop = define_time(1)
-            # Retrieving the timestamps of redis data registered within this timeframe
-            t_redis = get_field("cam_integtime",t_start,t_stop,False)[:,0]
-            # Calculating the time delay (difference between requested end of timeframe and redis-registered end of timeframe)
-            t_delay_iter = t_stop - t_redis[-1]
-            # Append to list
-            delays.append(t_delay_iter)
+        # Time delays (difference between the python time of a poll and the latest redis-registered timestamp then)
+        sampler = self._get_sampler()
+        delays = sampler.delays(clock_field,N,timeout=max(1.,2*N*sampler.poll))
+        if len(delays) == 0:
+            raise ValueError("No "+clock_field+" values registered in redis, is the camera recording?")
         if average:
             # Average
             t_delay = np.average(delays)
@@ -1079,22 +1014,24 @@ class alignment:
             Noise value (standard deviation of ROI9 output)
         mean: single float
             ROI9 mean output value
+        
+        Raises
+        ------
+        TimeoutError, ValueError : when the values of an exposure are not registered in redis (see nott_sampler.RedisSampler.window)
 
         '''
+        sampler = self._get_sampler()
         # Background measurements
         exps = []
         # Noise measurements
         noises = []
-        # Gathering five exposures
+        # Gathering five exposures, the sampler waits for each to be registered
         for j in range(0, N):
-            if (j!=0):
-                time.sleep(dt)
             t_start,t_stop = t+j*dt,t+(j+1)*dt
             # Retrieving REDIS data 
-            exp_av = get_field("roi9_avg",t_start,t_stop,True)
-            exp_full = get_field("roi9_avg",t_start,t_stop,False) 
-            exps.append(exp_av[1])
-            noises.append(exp_full.std(0)[1])
+            exp_full = sampler.window(noise_field,t_start,t_stop)
+            exps.append(exp_full[:,1].mean())
+            noises.append(exp_full[:,1].std())
             
         # Taking the mean 
         mean = np.mean(exps)
@@ -1125,21 +1062,22 @@ class alignment:
         -------
         photo : single float
             Photometric output average value
+        
+        Raises
+        ------
+        TimeoutError, ValueError : when the values of an exposure are not registered in redis (see nott_sampler.RedisSampler.window)
 
         '''
-        # REDIS field names of photometric outputs' ROIs
-        names = ["roi8_avg","roi7_avg","roi2_avg","roi1_avg"]
-        fieldname = names[config]
+        fieldname = photo_fields[config]
+        sampler = self._get_sampler()
         
         # Background measurements
         exps = []
-        # Gathering five photometric exposures
+        # Gathering five photometric exposures, the sampler waits for each to be registered
         for j in range(0, N):
-            if (j!=0):
-                time.sleep(dt)
             t_start,t_stop = t+j*dt,t+(j+1)*dt
             # Retrieving REDIS data
-            exps.append(get_field(fieldname,t_start,t_stop,True)[1])
+            exps.append(sampler.mean(fieldname,t_start,t_stop))
         # Taking the mean
         photo = np.mean(exps)
         
@@ -1328,9 +1266,8 @@ class alignment:
         if (config < 0 or config > 3):
             raise ValueError("Please enter a valid configuration number (0,1,2,3)")
 
-        # Opening OPCUA connection
-        opcua_conn = OPCUAConnection(url)
-        opcua_conn.connect()
+        # Shared OPCUA session
+        opcua_conn = get_session(url)
         # Actuator names 
         act_names = ['NTTA'+str(config+1),'NTPA'+str(config+1),'NTTB'+str(config+1),'NTPB'+str(config+1)]
         
@@ -1355,11 +1292,8 @@ class alignment:
             '''
             
             # Executing move
-            parent = opcua_conn.client.get_node('ns=4;s=MAIN.nott_ics.TipTilt.'+act_names[i])
-            method = parent.get_child("4:RPC_MoveAbs")
             arguments = [final_pos_off[i], speeds[i]]
-            #t_start_iter = time.time()
-            parent.call_method(method, *arguments)
+            opcua_conn.execute_rpc('ns=4;s=MAIN.nott_ics.TipTilt.'+act_names[i], "4:RPC_MoveAbs", arguments)
             
             # Wait for the actuator to be ready
             on_destination = False
@@ -1368,9 +1302,7 @@ class alignment:
             if sample:
                 # Start time, incorporating delay time.
                 t_start_sample = self._get_time(1000*time.time(),t_delay)
-                # Camera-to-redis writing time
-                time.sleep((t_write)*10**(-3)) 
-                # After this sleep, the roi value at timestamp t_start_sample has just been registered in the redis database.
+                # The camera-to-redis writing time (t_write) is waited for by the sampler, upon reading out the sample (see _get_photo).
                     
                 # Boolean checking whether the ROI sampling has caught up with the camera-redis delay
                 caught_up = False
@@ -1397,9 +1329,7 @@ class alignment:
                     time.sleep(dt_sample/2)
                 
                     if sample:
-                        # Safety sleep
-                        time.sleep(2*t_write*10**(-3))
-                        # Readout photometric ROI average of sample timeframe.
+                        # Readout photometric ROI average of sample timeframe (waiting for it to be registered in redis).
                         roi.append(self._get_photo(Nexp,t_start_sample,round(1000*dt_sample),config))
                         # Push sample start time forward for next sample.
                         t_start_sample = round(self._get_time(1000*time.time(),t_delay)-t_write)
@@ -1431,10 +1361,8 @@ class alignment:
             disp_back = sign*0.0005
             # Backlash-neutralized position
             pos_back = act_curr_temp[i] + disp_back
-            parent = opcua_conn.client.get_node('ns=4;s=MAIN.nott_ics.TipTilt.'+act_names[i])
-            method = parent.get_child("4:RPC_MoveAbs")
             arguments = [pos_back, 0.0005]
-            parent.call_method(method, *arguments)
+            opcua_conn.execute_rpc('ns=4;s=MAIN.nott_ics.TipTilt.'+act_names[i], "4:RPC_MoveAbs", arguments)
             # Wait for the actuator to be ready
             on_destination = False
             while not on_destination:
@@ -1457,10 +1385,8 @@ class alignment:
             final_pos_off[i] = final_pos[i] - pos_offset_temp[i]
             
             # 3) Move 3 : Returning to get to the desired position in accurate fashion. No sampling required # TBD : Incorporate backlash?
-            parent = opcua_conn.client.get_node('ns=4;s=MAIN.nott_ics.TipTilt.'+act_names[i])
-            method = parent.get_child("4:RPC_MoveAbs")
             arguments = [final_pos_off[i], speeds[i]]
-            parent.call_method(method, *arguments)
+            opcua_conn.execute_rpc('ns=4;s=MAIN.nott_ics.TipTilt.'+act_names[i], "4:RPC_MoveAbs", arguments)
             # Wait for the actuator to be ready
             on_destination = False
             while not on_destination:
@@ -1498,8 +1424,6 @@ class alignment:
         
         t_end_loop = round(1000*time.time()) 
         t_spent_loop = round(t_end_loop-t_start_loop)
-        # Close OPCUA connection
-        opcua_conn.disconnect()
         return t_start_loop,t_spent_loop,act,act_times,roi,err
 
     #-----------------#
@@ -1639,7 +1563,7 @@ class alignment:
         # Readout "dt" seconds back in time
         t_start,t_stop = define_time(dt)
         
-        output = [get_field(names[i],t_start,t_stop,False) for i in range(0,len(names))]
+        output = get_fields(names,t_start,t_stop,False)
         
         return output
     
@@ -1837,8 +1761,6 @@ class alignment:
                     # Update plot
                     indplot = _update_plot(indplot,np.max(exps))
                     
-                    # Safety sleep
-                    time.sleep(10*t_write*10**(-3)) # TBD
                     # Find optimal injection found along spiral (performed once more, post-movement, to eliminate possible time sync issues during sampling)
                     # Re-reading the photometric outputs (timeframe of dt_sample around each actuator timestamp)
                     SNR_samples = np.array([self._get_photo(Nexp,round(timestamp-(1000*dt_sample/2)),round(1000*dt_sample),config)-photo_init for timestamp in ACT_times] / noise,dtype=np.float64)
@@ -2071,8 +1993,6 @@ class alignment:
             if (Nswitch % 2 == 0):
                 Nsteps += 1
     
-        # Safety sleep
-        time.sleep(10*t_write*10**(-3)) # TBD
         # Find optimal injection found along spiral (performed once more, post-movement, to eliminate possible time sync issues during sampling)
         # Re-reading the photometric outputs (timeframe of dt_sample around each actuator timestamp)
         SNR_samples = np.array([self._get_photo(Nexp,round(timestamp-(1000*dt_sample/2)),round(1000*dt_sample),config)-photo_init for timestamp in ACT_times] / noise,dtype=np.float64)
@@ -2525,9 +2445,8 @@ class alignment:
     def _move_abs_ttm_act_single(self,pos,speed,act_name,act_index,offset,config=1):        
 
         start_time = time.time()
-        # Opening OPCUA connection
-        opcua_conn = OPCUAConnection(url)
-        opcua_conn.connect()
+        # Shared OPCUA session
+        opcua_conn = get_session(url)
         
         # List of time stamps
         time_arr = []
@@ -2563,10 +2482,8 @@ class alignment:
             pos -= pos_offset # in mm
 
         # Executing move
-        parent = opcua_conn.client.get_node('ns=4;s=MAIN.nott_ics.TipTilt.'+act_name)
-        method = parent.get_child("4:RPC_MoveAbs")
         arguments = [pos, speed]
-        parent.call_method(method, *arguments)
+        opcua_conn.execute_rpc('ns=4;s=MAIN.nott_ics.TipTilt.'+act_name, "4:RPC_MoveAbs", arguments)
         #act.command_move_absolute(imposed_pos,speed)
         
         # Wait for the actuator to be ready
@@ -2592,8 +2509,6 @@ class alignment:
         print("Moving actuator "+act_name+" from "+str(curr_pos)+" mm to "+str(imposed_pos)+" mm at speed "+str(speed)+" mm/s took "+str(spent_time)+" seconds")
         print("Actual actuator position reached :"+str(final_pos)+" mm by error" +str(1000*(imposed_pos-final_pos))+" um.")
         print("----------------------------------------------------------------------------------------------------------------------------")   
-        # Close OPCUA connection
-        opcua_conn.disconnect()
         
         return spent_time,imposed_pos,final_pos,time_arr,pos_arr
     
@@ -2784,6 +2699,9 @@ class alignment:
             How much iterations, i.e. random shifts, to go through.
 
         """
+        # Only imported when fitting beams on the visible cameras, astropy.modeling is slow to import
+        from astropy.modeling import models, fitting
+        
         # Selecting devices
         tries = 0
         tries_max = 6
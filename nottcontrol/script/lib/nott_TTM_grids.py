@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Interpolated lookups on the simulated grids used by the TTM alignment (nott_TTM_alignment.py):
+the Zemax inter-component distance grid (Dgrid, by TTM angles) and the on-bench actuator accuracy grids
+(by actuator displacement and speed).
+
+Grid axes are precomputed once, and many points are evaluated in one vectorized call by multilinear
+interpolation. Axes are uniform (TTM angles) or geometric (displacements and speeds), so grid cells are
+found arithmetically instead of searching the axes. Points beyond a grid take the value at its edge.
+"""
+
+import itertools
+from functools import lru_cache
+import numpy as np
+from nottcontrol.script import data_files
+
+# Simulation ranges of the accuracy grids : absolute displacements (mm) and speeds (mm/s)
+accuracy_disp_axis = np.geomspace(0.0005,0.025,21)
+accuracy_speed_axis = np.geomspace(0.0005/100,0.025,21)
+
+
+class GridInterpolator(object):
+    """
+        Multilinear interpolation of values sampled on a regular grid, of uniform or geometric axes.
+    """
+
+    def __init__(self,axes,values,geometric=None):
+        """
+        Parameters
+        ----------
+        axes : list of d increasing 1D arrays, the grid axes
+        values : (n_1,...,n_d,...) array, the values at the grid points (scalars or arrays)
+        geometric : list of d booleans, True for geometrically spaced axes (default: all uniform)
+        """
+        if geometric is None:
+            geometric = [False]*len(axes)
+        self.axes = [np.asarray(axis,dtype=np.float64) for axis in axes]
+        values = np.asarray(values,dtype=np.float64)
+        shape = tuple(len(axis) for axis in self.axes)
+        if values.shape[:len(shape)] != shape:
+            raise ValueError(f"Grid values of shape {values.shape} do not match axes of lengths {shape}")
+        self.value_shape = values.shape[len(shape):]
+        self._values = values.reshape(int(np.prod(shape)),-1)
+        self._geometric = np.array(geometric,dtype=bool)
+        # Cell index of a coordinate u is (u-u0)/du, with u the axis value (uniform) or its logarithm (geometric)
+        coords = [np.log(axis) if geo else axis for axis,geo in zip(self.axes,geometric)]
+        for coord in coords:
+            steps = np.diff(coord)
+            if len(coord) < 2 or np.any(steps <= 0) or np.ptp(steps) > 1e-6*np.abs(steps).max():
+                raise ValueError("Grid axes should be increasing and uniformly (or geometrically) spaced")
+        self._u0 = np.array([coord[0] for coord in coords])
+        self._du = np.array([(coord[-1]-coord[0])/(len(coord)-1) for coord in coords])
+        self._n = np.array(shape)
+        self._lows = np.array([axis[0] for axis in self.axes])
+        self._highs = np.array([axis[-1] for axis in self.axes])
+        # Axes padded to a common length, to look the cell bounds up along all axes at once
+        self._padded = np.array([np.pad(axis,(0,max(shape)-len(axis)),mode='edge') for axis in self.axes])
+        self._rows = np.arange(len(shape))
+        strides = np.cumprod((shape[1:]+(1,))[::-1])[::-1]
+        self._strides = strides
+        # Corners of a grid cell, as offsets (0/1) along each axis and as flat index offsets
+        self._corners = np.array(list(itertools.product((0,1),repeat=len(shape))),dtype=bool)
+        self._corner_offsets = self._corners.astype(np.intp) @ strides
+
+    def __call__(self,points):
+        """
+            Interpolated values at points, a (...,d) array. Returns a (...,*value_shape) array.
+        """
+        points = np.asarray(points,dtype=np.float64)
+        batch = points.shape[:-1]
+        points = np.clip(points.reshape(-1,len(self.axes)),self._lows,self._highs)
+        coords = points.copy()
+        coords[:,self._geometric] = np.log(coords[:,self._geometric])
+        idx = np.clip(((coords-self._u0)/self._du+1e-9).astype(np.intp),0,self._n-2)
+        # Fractions within the cells, along each axis, from the axis values themselves
+        x0 = self._padded[self._rows,idx]
+        t = (points-x0)/(self._padded[self._rows,idx+1]-x0)
+        weights = np.where(self._corners,t[:,None,:],1-t[:,None,:]).prod(axis=-1)
+        corner_values = self._values[(idx @ self._strides)[:,None]+self._corner_offsets]
+        values = np.einsum('pk,pkv->pv',weights,corner_values)
+        return values.reshape(batch+self.value_shape)
+
+
+class DistanceGrid(object):
+    """
+        Zemax-simulated inter-component distances (D1,...,D8), interpolated by TTM angles, for the four configurations.
+    """
+
+    def __init__(self,Dgrid,TTM1Xgrid,TTM1Ygrid,TTM2Xgrid,TTM2Ygrid):
+        """
+        Parameters
+        ----------
+        Dgrid : (4,8,11,5,11,5) array of distances (mm), by (configuration,distance,TTM1Y,TTM2Y,TTM1X,TTM2X)
+        TTM1Xgrid,TTM1Ygrid : (4,11) arrays of the TTM1 angles (radian) by which Dgrid is simulated
+        TTM2Xgrid,TTM2Ygrid : (4,5) arrays of the TTM2 angles (radian) by which Dgrid is simulated
+        """
+        self._grids = [GridInterpolator((TTM1Ygrid[config],TTM2Ygrid[config],TTM1Xgrid[config],TTM2Xgrid[config]),
+                                        np.moveaxis(Dgrid[config],0,-1))
+                       for config in range(Dgrid.shape[0])]
+
+    def __call__(self,ttm_angles,config):
+        """
+            Distances (...,8) (mm) at TTM angles (...,4) = (TTM1X,TTM1Y,TTM2X,TTM2Y) (radian), for configuration config.
+        """
+        if (config < 0 or config > len(self._grids)-1):
+            raise ValueError("Please enter a valid configuration number (0,1,2,3)")
+        ttm_angles = np.asarray(ttm_angles,dtype=np.float64)
+        # Grid axes are ordered as (TTM1Y,TTM2Y,TTM1X,TTM2X)
+        return self._grids[config](ttm_angles[...,[1,3,0,2]])
+
+
+class AccuracyGrid(object):
+    """
+        On-bench simulated actuator accuracies (achieved minus imposed position), interpolated by actuator displacement and speed.
+    """
+
+    def __init__(self,accurgrid_pos,accurgrid_neg,disp_axis=accuracy_disp_axis,speed_axis=accuracy_speed_axis):
+        """
+        Parameters
+        ----------
+        accurgrid_pos, accurgrid_neg : (21,21) arrays of accuracies (mm), by (displacement,speed), for positive/negative displacements
+        disp_axis : absolute displacements (mm) by which the grids are simulated
+        speed_axis : speeds (mm/s) by which the grids are simulated
+        """
+        # Positive and negative displacement accuracies as the two values of each grid point
+        self._grid = GridInterpolator((disp_axis,speed_axis),np.stack([accurgrid_pos,accurgrid_neg],axis=-1),(True,True))
+
+    def __call__(self,speed,disp):
+        """
+            Accuracies (mm) for actuator speeds (mm/s) and displacements (mm) of the same shape. Zero for zero displacements.
+        """
+        speed,disp = np.broadcast_arrays(np.asarray(speed,dtype=np.float64),np.asarray(disp,dtype=np.float64))
+        accur = self._grid(np.stack([np.abs(disp),speed],axis=-1))
+        return np.where(disp > 0,accur[...,0],np.where(disp < 0,accur[...,1],0.))
+
+@lru_cache(maxsize=None)
+def distance_grid():
+    # Distance grid of data_files, built on first use
+    return DistanceGrid(data_files.Dgrid,data_files.TTM1Xgrid,data_files.TTM1Ygrid,data_files.TTM2Xgrid,data_files.TTM2Ygrid)
+
+@lru_cache(maxsize=None)
+def accuracy_grid():
+    # Accuracy grids of data_files, built on first use
+    return AccuracyGrid(data_files.accurgrid_pos,data_files.accurgrid_neg)
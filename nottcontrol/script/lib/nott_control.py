@@ -27,7 +27,7 @@ import time
 from nottcontrol import config
 import logging
 
-from nottcontrol.opcua import OPCUAConnection
+from nottcontrol.opcua import get_session
 from nottcontrol.components.motor import Motor
 from nottcontrol.components.shutter import Shutter
 
@@ -42,16 +42,11 @@ logger.setLevel(logging.WARNING)
 def move_rel_dl(rel_pos, speed, opcua_motor):
     """ Send a relative motion to a delay line """
 
-    # initialize the OPC UA connection
-    url =  config['DEFAULT']['opcuaaddress']
-
-    opcua_conn = OPCUAConnection(url)
-    opcua_conn.connect()
+    # Shared OPC UA session
+    opcua_conn = get_session(config['DEFAULT']['opcuaaddress'])
     # parent = opcua_conn.client.get_node('ns=4;s=MAIN.DL_Servo_1')
-    parent = opcua_conn.client.get_node('ns=4;s=MAIN.'+opcua_motor)
-    method = parent.get_child("4:RPC_MoveRel")
     arguments = [rel_pos, speed]
-    parent.call_method(method, *arguments)
+    opcua_conn.execute_rpc('ns=4;s=MAIN.'+opcua_motor, "4:RPC_MoveRel", arguments)
     
     # Wait for the DL to be ready
     on_destination = False
@@ -62,8 +57,6 @@ def move_rel_dl(rel_pos, speed, opcua_motor):
 
         on_destination = status == 'STANDING' and state == 'OPERATIONAL'
 
-    # Disconnect
-    opcua_conn.disconnect()
     return 'done'
 
 # Move abs motor
@@ -74,15 +67,8 @@ def move_abs_dl(pos, speed, opcua_motor, pos_offset):
     pos_offset: in mm
     """
 
-    # initialize the OPC UA connection
-    url =  config['DEFAULT']['opcuaaddress']
-
-    opcua_conn = OPCUAConnection(url)
-    opcua_conn.connect()
-
-    # parent = opcua_conn.client.get_node('ns=4;s=MAIN.DL_Servo_'+dl_id)
-    parent = opcua_conn.client.get_node('ns=4;s=MAIN.'+opcua_motor)
-    method = parent.get_child("4:RPC_MoveAbs")
+    # Shared OPC UA session
+    opcua_conn = get_session(config['DEFAULT']['opcuaaddress'])
 
     curr_pos = read_current_pos(opcua_motor)
 
@@ -91,8 +77,9 @@ def move_abs_dl(pos, speed, opcua_motor, pos_offset):
     else:
         pos = pos - pos_offset # in mm
 
+    # parent = opcua_conn.client.get_node('ns=4;s=MAIN.DL_Servo_'+dl_id)
     arguments = [pos, speed]
-    parent.call_method(method, *arguments)
+    opcua_conn.execute_rpc('ns=4;s=MAIN.'+opcua_motor, "4:RPC_MoveAbs", arguments)
 
     #dl = Motor(opcua_conn, 'ns=4;s=MAIN.Delay_Lines.NDL'+dl_id, 'DL_'+dl_id)
     #dl.command_move_absolute(pos, speed)
@@ -105,8 +92,6 @@ def move_abs_dl(pos, speed, opcua_motor, pos_offset):
         status, state = opcua_conn.read_nodes(['ns=4;s=MAIN.'+opcua_motor+'.stat.sStatus', 'ns=4;s=MAIN.'+opcua_motor+'.stat.sState'])
         on_destination = status == 'STANDING' and state == 'OPERATIONAL'
 
-    # Disconnect
-    opcua_conn.disconnect()      
     return 'done'
 
 
@@ -114,15 +99,11 @@ def move_abs_dl(pos, speed, opcua_motor, pos_offset):
 def read_current_pos(opcua_motor):
     """ Read current position. Return it in mm """
     
-    # Initialize the OPC UA connection
-    url =  config['DEFAULT']['opcuaaddress']
-
-    opcua_conn = OPCUAConnection(url)
-    opcua_conn.connect()
+    # Shared OPC UA session
+    opcua_conn = get_session(config['DEFAULT']['opcuaaddress'])
 
     # Read positoin
     target_pos = opcua_conn.read_node('ns=4;s=MAIN.'+opcua_motor+'.stat.lrPosActual')
-    opcua_conn.disconnect()
 
     return target_pos
 
@@ -134,31 +115,21 @@ def read_current_pos(opcua_motor):
 def shutter_close(shutter_id):
     """ Function to close a shutter """
 
-    # initialize the OPC UA connection
-    url =  config['DEFAULT']['opcuaaddress']
-
-    opcua_conn = OPCUAConnection(url)
-    opcua_conn.connect()
+    # Shared OPC UA session
+    opcua_conn = get_session(config['DEFAULT']['opcuaaddress'])
     shutter = Shutter(opcua_conn, 'ns=4;s=MAIN.nott_ics.Shutters.NSH'+shutter_id, 'Shutter '+shutter_id)
     shutter.close()
 
-    # Disconnect
-    opcua_conn.disconnect()
     return 'done'
 
 def shutter_open(shutter_id):
     """ Function to open a shutter """
 
-    # initialize the OPC UA connection
-    url =  config['DEFAULT']['opcuaaddress']
-
-    opcua_conn = OPCUAConnection(url)
-    opcua_conn.connect()
+    # Shared OPC UA session
+    opcua_conn = get_session(config['DEFAULT']['opcuaaddress'])
     shutter = Shutter(opcua_conn, 'ns=4;s=MAIN.nott_ics.Shutters.NSH'+shutter_id, 'Shutter '+shutter_id)
     shutter.open()
     
-    # Disconnect
-    opcua_conn.disconnect()
     return 'done'
 
 def all_shutters_close(n_aper):
@@ -30,7 +30,51 @@ from nottcontrol.script.lib.nott_time import unix_time_ms
 from datetime import datetime, timedelta
 from scipy.interpolate import interp1d
 import time
+import threading
 from nottcontrol import config
+from nottcontrol.redisclient import parse_compaction_rules, compaction_key
+
+# Connection pools shared by all database helpers, one per database URL, created on first use
+_pools = {}
+_pools_lock = threading.Lock()
+# Idle connections are pinged (PING) before reuse when unused for longer than this (s)
+health_check_interval = config['redis'].getint('health_check_interval', fallback=30)
+# Compaction rules of a field are fetched again after this time (s), to pick up rules created meanwhile
+rules_ttl = config['redis'].getint('rules_ttl', fallback=300)
+
+def get_connection(db_address=None):
+    """
+    Return a redis client drawing its connections from the pool shared by all helpers of this module.
+    Connections stay open between calls; stale ones are detected by the health check and reopened.
+
+    Parameters
+    ----------
+    db_address : str, optional
+        Address of the database. The default is the `databaseurl` of the config file.
+
+    Returns
+    -------
+    r : redis.Redis
+        Client using the shared connection pool.
+    """
+    if db_address is None:
+        db_address = config['DEFAULT']['databaseurl']
+    pool = _pools.get(db_address)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_address)
+            if pool is None:
+                pool = redis.ConnectionPool.from_url(db_address, health_check_interval=health_check_interval,
+                                                     socket_keepalive=True, retry_on_timeout=True)
+                _pools[db_address] = pool
+    return redis.Redis(connection_pool=pool)
+
+def close_connections():
+    """ Close all pooled connections (they are reopened on the next call) """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.disconnect()
+        _pools.clear()
 
 # #  Function to read field values from the REDIS database and corresponding delay line position for the last 'delay' ms
 # def get_field(field1, field2, field3, field4, delay, dl_name):
@@ -99,17 +143,13 @@ def get_data(field1, field2, field3, field4, delay):
     end   = datetime.utcnow() # - timedelta(seconds=0.9) # There is a 0.9 sec delay with redis
     start = end - timedelta(seconds=delay) 
 
-    # Read data
-    r = redis.from_url('redis://nott-server.ster.kuleuven.be:6379')
-
     # Extract data
-    ts = r.ts()
+    pipe = get_connection().ts().pipeline(transaction=False)
 
-    # Get ROI values
-    result1 = ts.range(field1, unix_time_ms(start), unix_time_ms(end))
-    result2 = ts.range(field2, unix_time_ms(start), unix_time_ms(end))
-    result3 = ts.range(field3, unix_time_ms(start), unix_time_ms(end))
-    result4 = ts.range(field4, unix_time_ms(start), unix_time_ms(end))
+    # Get ROI values, in a single round-trip
+    for field in (field1, field2, field3, field4):
+        pipe.range(field, unix_time_ms(start), unix_time_ms(end))
+    result1, result2, result3, result4 = pipe.execute()
     output1 = [(x[1]) for x in result1]
     output2 = [(x[1]) for x in result2]
     output3 = [(x[1]) for x in result3]
@@ -169,14 +209,45 @@ def get_field(field, start, end, return_avg, lag=0, db_address='redis://nott-ser
     
     db_address =  config['DEFAULT']['databaseurl']  
     
-    # Read data
-    r = redis.from_url(db_address)
-
     # Extract data
-    ts = r.ts()
+    ts = get_connection(db_address).ts()
 
      # Get ROI values
     output = ts.range(field, start, end) # This function returns a list of tuples
+
+    return _format_field(output, return_avg, lag)
+
+def get_fields(fields, start, end, return_avg, lag=0):
+    """
+    Same as `get_field`, for several fields over the same time range, fetched in a single pipelined round-trip.
+
+    Parameters
+    ----------
+    fields : list of str
+        Fields of the database to collect.
+    start : int
+        start timestamp in milliseconds. The timezone must be the one of the server.
+    end : int
+        end timestamp in milliseconds. The timezone must be the one of the server.
+    return_avg: bool
+        Return the average value on the number of points.
+    lag: float
+        Lag to add to the timeline, in millisecond. The default is 0.
+
+    Returns
+    -------
+    outputs : list of 2d-arrays
+        Output of each required field, in the order of `fields`, as returned by `get_field`.
+
+    """
+    pipe = get_connection().ts().pipeline(transaction=False)
+    for field in fields:
+        pipe.range(field, start, end)
+    results = pipe.execute()
+
+    return [_format_field(output, return_avg, lag) for output in results]
+
+def _format_field(output, return_avg, lag):
     output = np.array(output) # Array
     output[:,0] = output[:,0] + lag
 
@@ -185,6 +256,171 @@ def get_field(field, start, end, return_avg, lag=0, db_address='redis://nott-ser
 
     return  output
 
+# Aggregations computed by the server over time buckets (TS.RANGE/TS.MRANGE AGGREGATION)
+AGGREGATIONS = {"avg": "avg", "min": "min", "max": "max", "sum": "sum", "count": "count",
+                "std": "std.p", "var": "var.p", "first": "first", "last": "last"}
+# Aggregations that can be computed from compacted series with the same aggregation
+COMPOSABLE = ("avg", "min", "max", "sum")
+
+# Compaction rules of each field, (time fetched (time.monotonic), [(bucket (ms), aggregation, compacted field)]), from TS.INFO.
+# Cached per process for rules_ttl seconds.
+_rules = {}
+
+def query_fields(fields, start, end, aggregation=None, bucket=None, lag=0, ts=None, resolution=None):
+    """
+    Get several fields over a time range, optionally aggregated by the server, as a dense array on a common time axis.
+    All fields are fetched in a single pipelined round-trip; with an aggregation, only one value per bucket
+    is sent over the network instead of all raw samples.
+
+    Parameters
+    ----------
+    fields : list of str
+        Fields of the database to collect.
+    start : int
+        start timestamp in milliseconds. The timezone must be the one of the server.
+    end : int
+        end timestamp in milliseconds. The timezone must be the one of the server.
+    aggregation : str, optional
+        One of `AGGREGATIONS` ("avg", "min", "max", "std", ...). The default is None: raw samples.
+    bucket : int, optional
+        Duration of the aggregation buckets, in milliseconds, aligned on `start`.
+        The default is None: a single bucket spanning [start, end].
+    lag: float
+        Lag to add to the timeline, in millisecond. The default is 0.
+    ts : redis TimeSeries client, optional
+        The default is a client of the shared connection pool.
+    resolution : int, optional
+        Coarsest time resolution (ms) needed. If given, each field is read from its coarsest compacted series
+        (see `compaction_rules` in config.ini) with buckets no longer than `resolution`, instead of the raw samples.
+        Without an aggregation, the compacted "avg" samples are returned.
+
+    Returns
+    -------
+    timestamps : 1d-array
+        Common time axis (ms), sorted. With an aggregation, the start of each bucket.
+    values : 2d-array
+        Values of each field (1st axis, in the order of `fields`) at each timestamp (2nd axis).
+        NaN where a field has no sample (or empty bucket) at that timestamp.
+
+    """
+    if ts is None:
+        ts = get_connection().ts()
+    kwargs = _aggregation_kwargs(start, end, aggregation, bucket)
+    sources = list(fields)
+    if resolution is not None:
+        rules = _compaction_rules(ts, fields)
+        sources = [_select_compaction(field, rules[field], aggregation, bucket, resolution) for field in fields]
+    pipe = ts.pipeline(transaction=False)
+    for field, source in zip(fields, sources):
+        if source == field:
+            pipe.range(field, start, end, **kwargs)
+        else:
+            # Include the latest, still open, compaction bucket
+            pipe.range(source, start, end, latest=True, **kwargs)
+    results = pipe.execute()
+
+    return _dense(results, lag)
+
+def query_filter(filters, start, end, aggregation=None, bucket=None, lag=0, ts=None, resolution=None):
+    """
+    Same as `query_fields`, for all fields matching label filters, with a single TS.MRANGE.
+    Compacted series are excluded from the match; with a `resolution`, they are read in place of their source.
+
+    Parameters
+    ----------
+    filters : list of str
+        Label filters, e.g. ["subsystem=camera", "stat=avg"].
+    start, end, aggregation, bucket, lag, ts, resolution :
+        See `query_fields`.
+
+    Returns
+    -------
+    fields : list of str
+        Matching fields, sorted.
+    timestamps : 1d-array
+        Common time axis (ms), sorted.
+    values : 2d-array
+        Values of each field (1st axis, in the order of `fields`) at each timestamp (2nd axis).
+
+    """
+    if ts is None:
+        ts = get_connection().ts()
+    kwargs = _aggregation_kwargs(start, end, aggregation, bucket)
+    # Compacted series carry a "source" label, raw series do not
+    rule = None
+    if resolution is not None:
+        rules = [(rule_bucket, rule_aggregation, None) for rule_aggregation, rule_bucket in parse_compaction_rules()]
+        rule = _select_rule(rules, aggregation, bucket, resolution)
+    if rule is None:
+        result = ts.mrange(start, end, list(filters) + ["source="], **kwargs)
+    else:
+        result = ts.mrange(start, end, list(filters) + [f"aggregation={rule[1]}", f"bucket={rule[0]}"], latest=True, **kwargs)
+    series = {}
+    for item in result:
+        for key, (labels, samples) in item.items():
+            key = key.decode() if isinstance(key, bytes) else key
+            if rule is not None:
+                key = key[:-len(compaction_key("", rule[1], rule[0]))]
+            series[key] = samples
+    fields = sorted(series)
+    timestamps, values = _dense([series[field] for field in fields], lag)
+
+    return fields, timestamps, values
+
+def _compaction_rules(ts, fields):
+    # Compaction rules of {fields}, fetched in one round-trip for fields not seen within rules_ttl
+    now = time.monotonic()
+    missing = [field for field in fields if field not in _rules or now-_rules[field][0] > rules_ttl]
+    if missing:
+        pipe = ts.pipeline(transaction=False)
+        for field in missing:
+            pipe.info(field)
+        infos = pipe.execute(raise_on_error=False)
+        for field, info in zip(missing, infos):
+            if isinstance(info, Exception):
+                # Missing field, the raw range reports it
+                continue
+            rules = info.rules or []
+            if isinstance(rules, dict):
+                rules = [[dest] + list(rule) for dest, rule in rules.items()]
+            _rules[field] = (now, [(int(rule[1]), _str(rule[2]).lower(), _str(rule[0])) for rule in rules])
+    return {field: _rules[field][1] if field in _rules else [] for field in fields}
+
+def _select_rule(rules, aggregation, bucket, resolution):
+    # Coarsest compaction rule with buckets of at most {resolution} ms, from which {aggregation} over {bucket} can be computed
+    if aggregation is not None and aggregation not in COMPOSABLE:
+        return None
+    rule_aggregation = AGGREGATIONS[aggregation] if aggregation is not None else "avg"
+    candidates = [rule for rule in rules if rule[1] == rule_aggregation and rule[0] <= resolution
+                  and (bucket is None or bucket % rule[0] == 0)]
+    return max(candidates, key=lambda rule: rule[0]) if candidates else None
+
+def _select_compaction(field, rules, aggregation, bucket, resolution):
+    rule = _select_rule(rules, aggregation, bucket, resolution)
+    return field if rule is None else rule[2]
+
+def _str(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+def _aggregation_kwargs(start, end, aggregation, bucket):
+    if aggregation is None:
+        return {}
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {aggregation}, expected one of {list(AGGREGATIONS)}")
+    if bucket is None:
+        bucket = end - start + 1
+    return {"aggregation_type": AGGREGATIONS[aggregation], "bucket_size_msec": int(bucket), "align": start}
+
+def _dense(results, lag):
+    # Lists of (timestamp, value) samples to a common time axis and a NaN-filled (fields, timestamps) array
+    series = [np.array(samples, dtype=float).reshape(-1, 2) for samples in results]
+    timestamps = np.unique(np.concatenate([samples[:,0] for samples in series])) if series else np.empty(0)
+    values = np.full((len(series), len(timestamps)), np.nan)
+    for i, samples in enumerate(series):
+        values[i, np.searchsorted(timestamps, samples[:,0])] = samples[:,1]
+
+    return timestamps + lag, values
+
 def define_time(delay):
     """
     Return the rounded timestamps of the start and end of period to grab from the database, in milliseconds.
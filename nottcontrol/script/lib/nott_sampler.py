@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Background sampler of redis time series (ROI outputs of the Infratec camera), for the TTM alignment spirals
+(nott_TTM_alignment.py).
+
+A thread polls the new samples of all fields at about the camera rate, in one pipelined TS.RANGE round-trip
+per poll, and keeps them in memory by timestamp. Means and standard deviations over any past window are then
+computed from memory, without querying redis nor sleeping for the samples to be written. Windows beyond the
+kept samples are queried from redis. Windows without samples raise, they are never averaged to NaN.
+
+Samplers are shared per process (see get_sampler). A sampler only polls while it is read: polling starts with
+the first read and stops sampler_linger seconds after the last one, so an idle GUI does not load redis.
+"""
+
+import atexit
+import threading
+import time
+import numpy as np
+from nottcontrol import config as nott_config
+from nottcontrol.script.lib.nott_database import get_connection
+
+# Defaults from config.ini
+sampler_poll = nott_config['injection'].getfloat('sampler_poll', fallback=0.005)
+sampler_capacity = nott_config['injection'].getint('sampler_capacity', fallback=100000)
+sampler_backfill = nott_config['injection'].getfloat('sampler_backfill', fallback=10.)
+sampler_linger = nott_config['injection'].getfloat('sampler_linger', fallback=5.)
+# Amount of clock delays kept (one per poll)
+nb_delays = 1000
+
+
+class FieldBuffer(object):
+    """
+        Samples (timestamp (ms), value) of one field, by increasing timestamp, keeping the latest {capacity}.
+    """
+
+    def __init__(self,capacity):
+        self.capacity = capacity
+        # Twice the capacity, samples are moved back to the start when the end is reached, so windows stay contiguous
+        self._t = np.zeros(2*capacity,dtype=np.int64)
+        self._v = np.zeros(2*capacity,dtype=np.float64)
+        self._start = 0
+        self._end = 0
+        # Whether samples were discarded beyond the capacity
+        self.dropped = False
+
+    def __len__(self):
+        return self._end-self._start
+
+    def clear(self):
+        self._start = self._end = 0
+        self.dropped = False
+
+    def extend(self,t,v):
+        n = len(t)
+        self.dropped = self.dropped or len(self)+n > self.capacity
+        if n > self.capacity:
+            t,v,n = t[-self.capacity:],v[-self.capacity:],self.capacity
+        if self._end+n > len(self._t):
+            keep = min(len(self),self.capacity-n)
+            self._t[:keep] = self._t[self._end-keep:self._end]
+            self._v[:keep] = self._v[self._end-keep:self._end]
+            self._start,self._end = 0,keep
+        self._t[self._end:self._end+n] = t
+        self._v[self._end:self._end+n] = v
+        self._end += n
+        if len(self) > self.capacity:
+            self._start = self._end-self.capacity
+
+    @property
+    def first(self):
+        # Timestamp of the oldest sample kept (None if empty)
+        return int(self._t[self._start]) if len(self) else None
+
+    @property
+    def last(self):
+        # Timestamp of the latest sample (None if empty)
+        return int(self._t[self._end-1]) if len(self) else None
+
+    def window(self,start,end):
+        # (N,2) array of the samples within [start,end], as nott_database.get_field
+        t = self._t[self._start:self._end]
+        i0,i1 = np.searchsorted(t,start,'left'),np.searchsorted(t,end,'right')
+        return np.stack([t[i0:i1].astype(np.float64),self._v[self._start+i0:self._start+i1]],axis=-1)
+
+
+class RedisSampler(object):
+    """
+        Samples of redis time series, polled by a background thread and kept in memory by timestamp.
+    """
+
+    def __init__(self,fields,poll=sampler_poll,capacity=sampler_capacity,backfill=sampler_backfill,linger=sampler_linger,db_address=None):
+        """
+        Parameters
+        ----------
+        fields : list of str, fields of the database to sample
+        poll : float, polling interval (s)
+        capacity : int, amount of samples kept per field
+        backfill : float, history (s) fetched at start
+        linger : float, time (s) polling goes on after the last read (None: until stop)
+        db_address : str, address of the database (default: databaseurl of config.ini)
+        """
+        self.fields = list(fields)
+        self.poll = poll
+        self.backfill = backfill
+        self.linger = linger
+        self.db_address = db_address
+        self._buffers = {field: FieldBuffer(capacity) for field in self.fields}
+        # Timestamp from which all samples of each field are kept (None: not sampled yet)
+        self._origin = {field: None for field in self.fields}
+        # Delays (ms) between the local time of each poll and the latest timestamp of each field
+        self._delays = {field: [] for field in self.fields}
+        self._lock = threading.Lock()
+        self._new_samples = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+        # Amount of reads in progress, and time (time.perf_counter) the last one ended
+        self._readers = 0
+        self._last_read = 0.
+        self.failed_polls = 0
+
+    def __enter__(self):
+        # Keeps the sampler polling while reading (starting it if needed)
+        with self._lock:
+            self._readers += 1
+            if not self._running:
+                self._start()
+        return self
+
+    def __exit__(self,*args):
+        with self._lock:
+            self._readers -= 1
+            self._last_read = time.perf_counter()
+
+    def start(self):
+        with self._lock:
+            if not self._running:
+                self._start()
+
+    def _start(self):
+        # Samples kept before a stop may miss the samples since, sampling starts anew
+        for buffer in self._buffers.values():
+            buffer.clear()
+        self._origin = {field: None for field in self.fields}
+        self._delays = {field: [] for field in self.fields}
+        self._last_read = time.perf_counter()
+        self._running = True
+        self._thread = threading.Thread(target=self._run,name="RedisSampler",daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            thread,self._thread = self._thread,None
+            self._new_samples.notify_all()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _idle(self):
+        # Whether polling is to stop, nobody having read for linger seconds (called with the lock held)
+        return self.linger is not None and self._readers == 0 and time.perf_counter()-self._last_read > self.linger
+
+    def _run(self):
+        ts = get_connection(self.db_address).ts()
+        while True:
+            with self._lock:
+                if self._thread is not threading.current_thread():
+                    return
+                if self._idle():
+                    self._running = False
+                    self._thread = None
+                    self._new_samples.notify_all()
+                    return
+            t_poll = time.perf_counter()
+            try:
+                self._poll(ts)
+            except Exception as e:
+                self.failed_polls += 1
+                if self.failed_polls == 1 or self.failed_polls % 1000 == 0:
+                    print(f"Sampler: polling redis failed ({e}), {self.failed_polls} failed polls.")
+            delay = self.poll-(time.perf_counter()-t_poll)
+            if delay > 0:
+                time.sleep(delay)
+
+    def _poll(self,ts):
+        pipe = ts.pipeline(transaction=False)
+        for field in self.fields:
+            buffer = self._buffers[field]
+            if self._origin[field] is None:
+                # Latest sample, to start from backfill seconds before it
+                pipe.get(field)
+            else:
+                pipe.range(field,self._origin[field] if buffer.last is None else buffer.last+1,'+')
+        # A missing field does not fail the others
+        results = pipe.execute(raise_on_error=False)
+        now = round(1000*time.time())
+        with self._lock:
+            if self._thread is not threading.current_thread():
+                # Stopped meanwhile, the sampling may have started anew
+                return
+            for field,result in zip(self.fields,results):
+                if isinstance(result,Exception):
+                    continue
+                buffer = self._buffers[field]
+                if self._origin[field] is None:
+                    if result:
+                        self._origin[field] = int(result[0])-round(1000*self.backfill)
+                    continue
+                if result:
+                    samples = np.array(result,dtype=np.float64)
+                    buffer.extend(samples[:,0].astype(np.int64),samples[:,1])
+                if buffer.last is None:
+                    continue
+                delays = self._delays[field]
+                delays.append(now-buffer.last)
+                del delays[:-nb_delays]
+            self._new_samples.notify_all()
+
+    def wait_until(self,field,t,timeout=1.):
+        """
+            Waits until a sample of {field} at or after timestamp t (ms) is kept, at most timeout (s). Returns whether it is.
+        """
+        buffer = self._buffers[field]
+        with self, self._new_samples:
+            return self._new_samples.wait_for(lambda: buffer.last is not None and buffer.last >= t,timeout)
+
+    def window(self,field,start,end,timeout=1.):
+        """
+            (N,2) array of the samples (timestamp, value) of {field} within [start,end] (ms), as nott_database.get_field.
+        Waits for the samples up to end to be kept, raising TimeoutError after timeout (s). Windows starting before the
+        oldest kept sample are queried from redis. Raises ValueError if there is no sample within the window.
+        """
+        with self:
+            if not self.wait_until(field,end,timeout):
+                raise TimeoutError(f"No {field} values registered in redis up to {end} within {timeout} s")
+            with self._lock:
+                buffer = self._buffers[field]
+                origin = buffer.first if buffer.dropped else self._origin[field]
+                values = buffer.window(start,end) if origin is not None and start >= origin else None
+        if values is None:
+            values = np.array(get_connection(self.db_address).ts().range(field,start,end),dtype=np.float64).reshape(-1,2)
+        if len(values) == 0:
+            raise ValueError(f"No {field} values registered in redis between {start} and {end}")
+        return values
+
+    def mean(self,field,start,end,timeout=1.):
+        # Mean of {field} within [start,end] (ms), see window
+        return float(self.window(field,start,end,timeout)[:,1].mean())
+
+    def std(self,field,start,end,timeout=1.):
+        # Standard deviation of {field} within [start,end] (ms), see window
+        return float(self.window(field,start,end,timeout)[:,1].std())
+
+    def delays(self,field,N,timeout=1.):
+        """
+            The latest (at most) N delays (ms) between the local time of a poll and the latest timestamp of {field} then,
+        waiting at most timeout (s) for N polls.
+        """
+        with self, self._new_samples:
+            self._new_samples.wait_for(lambda: len(self._delays[field]) >= N,timeout)
+            return np.array(self._delays[field][-N:],dtype=np.float64)
+
+
+# Samplers of the process, by (database address, fields)
+_samplers = {}
+_samplers_lock = threading.Lock()
+
+def get_sampler(fields,db_address=None):
+    """
+        The sampler of {fields} shared by the process, created on first use. It polls redis only while it is read.
+    """
+    key = (db_address,tuple(fields))
+    with _samplers_lock:
+        sampler = _samplers.get(key)
+        if sampler is None:
+            sampler = _samplers[key] = RedisSampler(fields,db_address=db_address)
+    return sampler
+
+@atexit.register
+def stop_samplers():
+    # Stops the polling of all samplers of the process (they start again upon the next read)
+    with _samplers_lock:
+        samplers = list(_samplers.values())
+    for sampler in samplers:
+        sampler.stop()
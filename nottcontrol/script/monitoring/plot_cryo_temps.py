@@ -15,6 +15,7 @@ import redis
 from scipy.optimize import curve_fit
 
 from nottcontrol import config, sensor_config_path
+from nottcontrol.script.lib.nott_database import query_fields
 from nottcontrol.sensors import (
     load_sensor_config,
     opc_node_path,
@@ -87,7 +88,14 @@ def fetch_timeseries(
     key: str,
     start_ms: int,
     end_ms: int,
+    resolution_ms: int | None = None,
 ) -> tuple[np.ndarray, np.ndarray]:
+    """Samples of key; with resolution_ms, from its coarsest compaction that is fine enough."""
+    if resolution_ms is not None:
+        timestamps, values = query_fields(
+            [key], start_ms, end_ms, ts=redis_client.ts(), resolution=resolution_ms
+        )
+        return timestamps / 1000.0, values[0]
     samples = redis_client.ts().range(key, start_ms, end_ms)
     if not samples:
         return np.array([]), np.array([])
@@ -208,8 +216,11 @@ def plot_cryo_temps(
     redis_client = redis.from_url(redis_url)
     model = build_exponential_model(n_exp_terms)
 
+    # No need for more samples than can be plotted
+    resolution_ms = (end_ms - start_ms) // max(plot_max_points, 1)
+
     for key in keys:
-        times, values = fetch_timeseries(redis_client, key, start_ms, end_ms)
+        times, values = fetch_timeseries(redis_client, key, start_ms, end_ms, resolution_ms)
         if times.size == 0:
             print(f"warning: no samples for {key}", file=sys.stderr)
             continue
@@ -28,6 +28,12 @@ class ShutterWidget(QWidget):
 
         self.ui.label_name.setText(self._shutter.name)
 
+        # Status and position are then pushed by the server instead of polled
+        try:
+            self._shutter.subscribe()
+        except Exception as e:
+            print(f"Error subscribing to {self._shutter.name} status: {e}")
+
     def refresh_status(self):
         try:
             status, state, substate = self._shutter.getStatusInformation()
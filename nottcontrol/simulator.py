@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Simulated NOTT PLC: a local OPC UA server exposing the node tree of the Beckhoff PLCs.
+
+Motors (delay lines, shutters, tip/tilt actuators) accept the usual RPC_MoveAbs, RPC_MoveRel,
+RPC_Stop, RPC_Reset, RPC_Init, RPC_Enable and RPC_Disable calls and move with a trapezoidal
+velocity profile, updating their stat/ctrl nodes as the PLC does. The cryostat sensor nodes
+listed in sensors.ini drift slowly around plausible values.
+
+Run it with
+    python -m nottcontrol.simulator [--endpoint opc.tcp://127.0.0.1:4840]
+and point opcuaaddress (and opcuaaddress_cry) of config.ini to the same endpoint
+to use Motor, DelayLine, Shutter, HumInt, the command framework or the WAG backend without hardware.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import math
+import random
+import time
+from datetime import datetime
+
+from asyncua import Server, ua
+
+from nottcontrol import config, sensor_config_path
+from nottcontrol.sensors import load_sensor_config, opc_node_path
+
+NAMESPACE = 4
+
+# Defaults from config.ini
+endpoint = config['SIMULATOR'].get('endpoint', 'opc.tcp://127.0.0.1:4840')
+tick = config['SIMULATOR'].getint('tick', fallback=10) / 1000
+acceleration = config['SIMULATOR'].getfloat('acceleration', fallback=50.0)
+init_time = config['SIMULATOR'].getfloat('init_time', fallback=1.0)
+
+# Simulated motors: browse path prefix -> (travel range (mm), initial position (mm))
+MOTORS = {}
+for i in range(1, 5):
+    MOTORS[f"MAIN.nott_ics.Delay_Lines.NDL{i}"] = ((0.0, 12.5), config['DL'].getfloat(f'dl{i}_pos', fallback=5000.0) / 1000)
+    MOTORS[f"MAIN.nott_ics.Shutters.NSH{i}"] = ((0.0, 40.0), 35.0)
+    for name in ("NTPA", "NTTA", "NTPB", "NTTB"):
+        MOTORS[f"MAIN.nott_ics.TipTilt.{name}{i}"] = ((0.0, 12.0), 6.0)
+
+# Cryostat temperatures displayed by the main window (C)
+CRYO_TEMPS_C = [f"MAIN.not_cryo_ctrl.lrTempC_{i}" for i in range(1, 5)]
+
+TRIGGER_TIME = "INFRATEC_TRIGERS.sNTPExtTime"
+
+
+def _node_id(path):
+    return ua.NodeId(path, NAMESPACE)
+
+
+def _trapezoid(distance, speed, accel, t):
+    # Travelled distance and speed at time t of a move over distance (>= 0), with speed and acceleration limits
+    if distance <= 0:
+        return 0.0, 0.0, True
+    t_acc = speed / accel
+    d_acc = 0.5 * accel * t_acc**2
+    if 2*d_acc > distance:
+        # Triangular profile, the maximum speed is never reached
+        t_acc = math.sqrt(distance / accel)
+        speed = accel * t_acc
+        d_acc = 0.5 * distance
+    t_total = 2*t_acc + (distance - 2*d_acc) / speed
+    if t >= t_total:
+        return distance, 0.0, True
+    if t < t_acc:
+        return 0.5 * accel * t**2, accel * t, False
+    if t < t_total - t_acc:
+        return d_acc + speed * (t - t_acc), speed, False
+    return distance - 0.5 * accel * (t_total - t)**2, accel * (t_total - t), False
+
+
+class SimulatedMotor(object):
+    """
+        Motor of the PLC: status nodes, RPCs and kinematics. Positions are in mm and speeds in mm/s, as on the PLC.
+    """
+
+    def __init__(self, prefix, travel, position, accel=acceleration):
+        self.prefix = prefix
+        self.pos_min, self.pos_max = travel
+        self.position = position
+        self.accel = accel
+        self._move = None  # (start time, start position, target, speed)
+        self._nodes = {}
+
+    async def create(self, tree):
+        obj = await tree.add_object(self.prefix)
+        values = {
+            "stat.sStatus": "STANDING",
+            "stat.sState": "OPERATIONAL",
+            "stat.sSubstate": "READY",
+            "stat.sHwStatus": "OK",
+            "stat.bInitialised": True,
+            "stat.lrPosActual": self.position,
+            "stat.lrVelActual": 0.0,
+            "ctrl.lrPosition": self.position,
+        }
+        for name, value in values.items():
+            self._nodes[name] = await tree.add_variable(f"{self.prefix}.{name}", value)
+        double = ua.VariantType.Double
+        methods = {
+            "RPC_MoveAbs": (self.rpc_move_abs, [double, double]),
+            "RPC_MoveRel": (self.rpc_move_rel, [double, double]),
+            "RPC_Stop": (self.rpc_stop, []),
+            "RPC_Reset": (self.rpc_reset, []),
+            "RPC_Init": (self.rpc_init, []),
+            "RPC_Enable": (self.rpc_enable, []),
+            "RPC_Disable": (self.rpc_disable, []),
+        }
+        for name, (func, args) in methods.items():
+            await obj.add_method(_node_id(f"{self.prefix}.{name}"), ua.QualifiedName(name, NAMESPACE), func, args, [])
+
+    async def _write(self, name, value):
+        await self._nodes[name].write_value(value)
+
+    async def _read(self, name):
+        return await self._nodes[name].read_value()
+
+    # RPCs. A Bad status code returned by an RPC is raised by the client, as refused calls on the PLC
+
+    async def rpc_move_abs(self, parent, target, speed):
+        return await self._start_move(target.Value, speed.Value)
+
+    async def rpc_move_rel(self, parent, rel_pos, speed):
+        return await self._start_move(self.position + rel_pos.Value, speed.Value)
+
+    async def _start_move(self, target, speed):
+        if await self._read("stat.sState") != "OPERATIONAL":
+            return ua.StatusCode(ua.StatusCodes.BadInvalidState)
+        if not speed > 0:
+            return ua.StatusCode(ua.StatusCodes.BadOutOfRange)
+        # Soft limits of the PLC
+        target = min(max(target, self.pos_min), self.pos_max)
+        self._move = (time.monotonic(), self.position, target, speed)
+        await self._write("ctrl.lrPosition", target)
+        await self._write("stat.sStatus", "MOVING")
+        return []
+
+    async def rpc_stop(self, parent):
+        self._move = None
+        await self._write("stat.lrVelActual", 0.0)
+        await self._write("stat.sStatus", "STANDING")
+        return []
+
+    async def rpc_reset(self, parent):
+        await self.rpc_stop(parent)
+        await self._write("stat.sState", "NOTOP")
+        await self._write("stat.sSubstate", "NOTREADY")
+        await self._write("stat.bInitialised", False)
+        return []
+
+    async def rpc_init(self, parent):
+        await self._write("stat.sSubstate", "INITIALISING")
+        asyncio.get_running_loop().call_later(init_time, lambda: asyncio.ensure_future(self._initialised()))
+        return []
+
+    async def _initialised(self):
+        await self._write("stat.bInitialised", True)
+        await self._write("stat.sSubstate", "READY")
+
+    async def rpc_enable(self, parent):
+        if await self._read("stat.sSubstate") != "READY":
+            return ua.StatusCode(ua.StatusCodes.BadInvalidState)
+        await self._write("stat.sState", "OPERATIONAL")
+        return []
+
+    async def rpc_disable(self, parent):
+        await self.rpc_stop(parent)
+        await self._write("stat.sState", "NOTOP")
+        return []
+
+    # Kinematics
+
+    async def update(self, now):
+        if self._move is None:
+            return
+        t_start, start, target, speed = self._move
+        travelled, velocity, done = _trapezoid(abs(target - start), speed, self.accel, now - t_start)
+        direction = 1.0 if target >= start else -1.0
+        self.position = start + direction*travelled
+        await self._write("stat.lrPosActual", self.position)
+        await self._write("stat.lrVelActual", direction*velocity)
+        if done:
+            self._move = None
+            await self._write("stat.sStatus", "STANDING")
+
+
+class SimulatedSensor(object):
+    # Sensor value following a slow random walk around its nominal value
+
+    def __init__(self, path, nominal, noise):
+        self.path = path
+        self.nominal = nominal
+        self.noise = noise
+        self.value = nominal
+        self._node = None
+
+    async def create(self, tree):
+        self._node = await tree.add_variable(self.path, self.value)
+
+    async def update(self):
+        # Mean-reverting walk, so values stay close to nominal over long runs
+        self.value += 0.05*(self.nominal - self.value) + random.gauss(0.0, self.noise)
+        await self._node.write_value(self.value)
+
+
+def _sensor_nominal(path):
+    # Plausible (nominal value, noise) of a cryostat sensor, from its name
+    if "Pressure" in path:
+        return 1e-6, 1e-8
+    if "lrRamp" in path:
+        return 0.0, 1e-3
+    if "cabinet" in path or "thermal_box" in path or "sidecar" in path:
+        return 295.0, 0.01
+    if "lrTempC" in path:
+        return 20.0, 0.01
+    return 80.0, 0.01
+
+
+class NodeTree(object):
+    # Creates objects along dotted browse paths, so each node sits below its parents as on the PLC
+
+    def __init__(self, server):
+        self._root = server.nodes.objects
+        self._objects = {}
+
+    async def add_object(self, path):
+        obj = self._objects.get(path)
+        if obj is None:
+            parent_path, _, name = path.rpartition(".")
+            parent = await self.add_object(parent_path) if parent_path else self._root
+            obj = self._objects[path] = await parent.add_object(_node_id(path), ua.QualifiedName(name, NAMESPACE))
+        return obj
+
+    async def add_variable(self, path, value):
+        parent_path, _, name = path.rpartition(".")
+        parent = await self.add_object(parent_path)
+        return await parent.add_variable(_node_id(path), ua.QualifiedName(name, NAMESPACE), value)
+
+
+class PLCSimulator(object):
+    """
+        OPC UA server simulating the motors and cryostat sensors of the PLCs.
+    Use as "async with PLCSimulator() as sim:", or run() it until cancelled.
+    """
+
+    def __init__(self, endpoint=endpoint, sensors_ini=sensor_config_path, tick=tick, sensor_period=1.0):
+        self.endpoint = endpoint
+        self.tick = tick
+        self.sensor_period = sensor_period
+        self.server = None
+        self.motors = {prefix: SimulatedMotor(prefix, travel, position) for prefix, (travel, position) in MOTORS.items()}
+        sensor_paths = [opc_node_path(node) for node in load_sensor_config(sensors_ini)[0]] if sensors_ini else []
+        self.sensors = [SimulatedSensor(path, *_sensor_nominal(path)) for path in sensor_paths + CRYO_TEMPS_C]
+        self._tasks = []
+
+    async def start(self):
+        self.server = Server()
+        await self.server.init()
+        self.server.set_endpoint(self.endpoint)
+        self.server.set_server_name("NOTT PLC simulator")
+        # Nodes live in namespace 4, as on the PLC
+        i = 0
+        while await self.server.register_namespace(f"urn:nott:simulator:{i}") < NAMESPACE:
+            i += 1
+        tree = NodeTree(self.server)
+        for motor in self.motors.values():
+            await motor.create(tree)
+        for sensor in self.sensors:
+            await sensor.create(tree)
+        self._trigger_time = await tree.add_variable(TRIGGER_TIME, self._timestamp())
+        await self.server.start()
+        self._tasks = [asyncio.create_task(self._motion_loop()), asyncio.create_task(self._sensor_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.server.stop()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def run(self):
+        async with self:
+            await asyncio.Event().wait()
+
+    @staticmethod
+    def _timestamp():
+        # Same format as the NTP time of the camera triggers
+        return datetime.utcnow().strftime('%Y-%m-%d-%H:%M:%S.%f')
+
+    async def _motion_loop(self):
+        while True:
+            now = time.monotonic()
+            for motor in self.motors.values():
+                await motor.update(now)
+            await self._trigger_time.write_value(self._timestamp())
+            await asyncio.sleep(max(0.0, self.tick - (time.monotonic() - now)))
+
+    async def _sensor_loop(self):
+        while True:
+            for sensor in self.sensors:
+                await sensor.update()
+            await asyncio.sleep(self.sensor_period)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated NOTT PLC (OPC UA server)")
+    parser.add_argument("--endpoint", default=endpoint, help="OPC UA endpoint to serve")
+    parser.add_argument("--sensors-ini", default=sensor_config_path, help="Path to sensors.ini listing the cryostat sensor nodes")
+    parser.add_argument("--tick", type=float, default=tick*1000, help="Update period of the motion (ms)")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("asyncua").setLevel(logging.WARNING)
+    print(f"Simulating the NOTT PLC at {args.endpoint}, Ctrl+C to stop.")
+    try:
+        asyncio.run(PLCSimulator(args.endpoint, args.sensors_ini, args.tick/1000).run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,6 +5,7 @@ from nottcontrol.opcua import OPCUAConnection
 from nottcontrol import config
 from nottcontrol.components.shutter import Shutter
 from nottcontrol.script.lib.nott_TTM_alignment import alignment
+from nottcontrol.script.lib.nott_sampler import stop_samplers
 
 class TipTiltControl(QMainWindow):
     closing = pyqtSignal()
@@ -33,5 +34,6 @@ class TipTiltControl(QMainWindow):
 
     def closeEvent(self, *args):
         self.opcua_conn.disconnect()
+        stop_samplers()
         self.closing.emit()
         super().closeEvent(*args)
\ No newline at end of file
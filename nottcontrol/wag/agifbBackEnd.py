@@ -22,6 +22,7 @@ import json
 import sys
 from nottcontrol.components.shutter import Shutter
 from nottcontrol.components.motor import Motor
+from nottcontrol.commands.motion_command import execute_parallel
 from nottcontrol.opcua import OPCUAConnection
 from nottcontrol import config
 import threading
@@ -354,6 +355,8 @@ while running == 1:
                 if len(setupList[batch]) > 0:
                     print("batch", batch, "of devices to move:")
                     dbMsg['command']['parameters'].clear()
+                    # Motions of the batch, sent together once all devices are listed
+                    commands = []
                     for s in setupList[batch]:
                         print("Moving: ", s.dev, "to: ", s.val, "( setting", s.mType, " )")
 
@@ -363,9 +366,9 @@ while running == 1:
                             #Verify it's actually a shutter...
 
                             if s.val == 'T':
-                                shutter.open()
+                                commands.append(shutter.command_open())
                             elif s.val == 'F':
-                                shutter.close()
+                                commands.append(shutter.command_close())
                             else:
                                 print('invalid command received')
 
@@ -379,6 +382,8 @@ while running == 1:
                         attribute = "<alias>" + s.dev +":DATA.status0"
                         dbMsg['command']['parameters'].append({"attribute":attribute, "value":"MOVING"})
 
+                    execute_parallel(commands)
+
                     # Send message to wag to update the database
                     timeNow = datetime.datetime.now(datetime.timezone.utc)
                     timeStamp = timeNow.strftime("%Y-%m-%dT%H:%M:%S")